@@ -1,32 +1,146 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, abort, g, request, jsonify, stream_with_context
+import gzip
+import logging
 import os
-from services.firestore_client import get_db
-from services.user_summary import process_user_daily_submission
-from services.leaderboard import get_current_month_leaderboard  # 👈 NEW
+from config.settings import COMPRESS_MIN_BYTES, METRICS_HEADERS
+from services.data_version import current_version, etag_matches, make_etag
+from services.events import SSE_MIMETYPE, sse_stream
+from services.idempotency import IdempotencyConflict, IdempotencyInProgress, run_idempotent, submission_key
+from services.instrumentation import begin_request, end_request, metrics_snapshot
+from services.monthly_aggregates import get_user_trends
+from services.score_stats import get_user_stats
+from services.static_assets import AssetBundle, accepted_encodings
+from services.storage import StorageUnavailable, get_storage
+from services.user_summary import process_user_daily_submission, process_user_daily_submissions
+from services.leaderboard import (
+    decode_cursor,
+    get_leaderboard_page,
+    get_rank_context,
+    iter_leaderboard_entries,
+    start_shared_leaderboard,
+)
+from services.window_leaderboards import WINDOWS, current_period, get_window_leaderboard
+from services.streaming import NDJSON_MIMETYPE, json_array_chunks, ndjson_lines, stream_format
 
 app = Flask(__name__)
-db = get_db()
 
 FRONTEND_DIR = os.path.join(os.path.dirname(__file__), 'frontend')
 
+@app.before_request
+def _begin_storage_scope():
+    g.storage_scope = begin_request()
+
+@app.after_request
+def _end_storage_scope(response):
+    """Add X-Storage-* headers in debug mode and roll the request into /metrics."""
+    scope = g.get("storage_scope")
+    if scope is None:
+        return response
+    if app.debug or METRICS_HEADERS:
+        response.headers.update(scope.headers())
+    name = f"{request.method} {request.endpoint}"
+    if response.is_streamed:
+        # The body keeps reading from storage after this point
+        response.call_on_close(lambda: end_request(name, scope))
+    else:
+        end_request(name, scope)
+    return response
+
+@app.errorhandler(StorageUnavailable)
+def _storage_unavailable(e):
+    """Storage is down or its circuit is open (services/resilient_storage.py)."""
+    response = jsonify({"error": "storage temporarily unavailable"})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+# Fingerprinted and precompressed once at startup (services/static_assets.py)
+ASSETS = AssetBundle(FRONTEND_DIR)
+
+@app.after_request
+def _compress_json(response):
+    """Gzip JSON bodies of COMPRESS_MIN_BYTES or more for clients that accept it."""
+    if (response.mimetype != "application/json" or response.is_streamed
+            or response.status_code != 200 or "Content-Encoding" in response.headers
+            or "gzip" not in accepted_encodings(request.headers.get("Accept-Encoding"))):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=6))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+def _serve_asset(path):
+    asset = ASSETS.get(path)
+    if asset is None:
+        abort(404)
+    encoding, body = asset.select(request.headers.get("Accept-Encoding"))
+    headers = asset.headers(encoding)
+    if etag_matches(request.headers.get("If-None-Match"), asset.etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status=304, headers=headers)
+    return Response(body, headers=headers)
+
 @app.route("/")
 def serve_index():
-    return send_from_directory(FRONTEND_DIR, "index.html")
+    return _serve_asset("index.html")
 
 @app.route("/<path:path>")
 def serve_static(path):
-    return send_from_directory(FRONTEND_DIR, path)
+    return _serve_asset(path)
+
+def _streamed(items):
+    """
+    If the client asked for a streaming format (?format=ndjson|stream or
+    Accept: application/x-ndjson), return a response that writes items as
+    they come off the storage stream; otherwise None.
+    """
+    fmt = stream_format(request.args.get("format"), request.headers.get("Accept"))
+    if fmt == "ndjson":
+        return Response(stream_with_context(ndjson_lines(items)), mimetype=NDJSON_MIMETYPE)
+    if fmt == "array":
+        return Response(stream_with_context(json_array_chunks(items)), mimetype="application/json")
+    return None
+
+
+def _list_etag(kind):
+    """
+    Strong ETag for a list endpoint: the data version read before the
+    query runs, plus the response format so JSON and NDJSON differ.
+    """
+    fmt = stream_format(request.args.get("format"), request.headers.get("Accept")) or "json"
+    return make_etag(kind, current_version(), fmt)
+
+
+def _with_etag(response, etag):
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate every time
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(etag):
+    return _with_etag(Response(status=304), etag)
+
+
+def _user_rows():
+    for user_id, data in get_storage().iter_users(fields=["username"]):
+        yield {"userId": user_id, "username": data.get("username", user_id)}
+
 
 @app.route("/users", methods=["GET"])
 def list_users():
-    users_ref = db.collection("users")
-    docs = users_ref.stream()
-    users = [{"userId": doc.id, "username": doc.to_dict().get("username", doc.id)} for doc in docs]
-    return jsonify(users)
+    etag = _list_etag("users")
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    streamed = _streamed(_user_rows())
+    if streamed:
+        return _with_etag(streamed, etag)
+    return _with_etag(jsonify(list(_user_rows())), etag)
 
-@app.route("/submit", methods=["POST"])
-def submit_score():
-    data = request.json
+def _submit(data):
     result = process_user_daily_submission(
         data["userId"],
         data["timeSeconds"],
@@ -36,14 +150,129 @@ def submit_score():
         date_str=data.get("date")
     )
     result["submittedBy"] = data.get("submittedBy", "anonymous")
+    return result
+
+# With an Idempotency-Key header, retries of the same request replay the
+# first result (marked Idempotent-Replayed: true) instead of resubmitting
+@app.route("/submit", methods=["POST"])
+def submit_score():
+    data = request.json
+    key = request.headers.get("Idempotency-Key")
+    if not key:
+        return jsonify(_submit(data))
+    try:
+        result, replayed = run_idempotent(submission_key(data, key), data, lambda: _submit(data))
+    except IdempotencyConflict as e:
+        return jsonify({"error": str(e)}), 422
+    except IdempotencyInProgress as e:
+        return jsonify({"error": str(e)}), 409, {"Retry-After": "1"}
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    response = jsonify(result)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+# bulk/backfill endpoint: {"submissions": [<same shape as /submit>, ...]}
+@app.route("/submit-batch", methods=["POST"])
+def submit_batch():
+    data = request.json or {}
+    try:
+        result = process_user_daily_submissions(data.get("submissions", []))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(result)
 
 
 # leaderboard data endpoint
+# Optional ?limit=N pages the list; the next page's ?cursor= is returned
+# in the X-Next-Cursor header (absent on the last page).
+# ?format=ndjson|stream streams entries uncached instead.
+# Both list endpoints send an ETag; If-None-Match with it returns 304.
 @app.route("/leaderboard-data", methods=["GET"])
 def leaderboard_data():
-    leaderboard = get_current_month_leaderboard()
-    return jsonify(leaderboard)
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor")
+    try:
+        if cursor:
+            decode_cursor(cursor)
+        etag = _list_etag("leaderboard")
+        if request.if_none_match.contains(etag):
+            return _not_modified(etag)
+        streamed = _streamed(iter_leaderboard_entries(limit, cursor))
+        if streamed:
+            return _with_etag(streamed, etag)
+        leaderboard, next_cursor = get_leaderboard_page(limit, cursor)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = jsonify(leaderboard)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return _with_etag(response, etag)
+
+
+# precomputed top users this week, this month or of all time, one
+# document read each (?limit=N; see services/window_leaderboards.py)
+@app.route("/leaderboards/<window>", methods=["GET"])
+def window_leaderboard(window):
+    if window not in WINDOWS:
+        return jsonify({"error": f"unknown leaderboard window {window!r}"}), 404
+    # The period is part of the tag: a new week starts a new board
+    etag = _list_etag(f"leaderboard-{window}-{current_period(window)}")
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+    board = get_window_leaderboard(window, request.args.get("limit", type=int))
+    return _with_etag(jsonify(board), etag)
+
+# a user's rank plus ?k= neighbours either side (default 3)
+@app.route("/leaderboard-around/<user_id>", methods=["GET"])
+def leaderboard_around(user_id):
+    k = max(0, min(request.args.get("k", 3, type=int), 50))
+    context = get_rank_context(user_id, k)
+    if context is None:
+        return jsonify({"error": f"{user_id} is not on the leaderboard"}), 404
+    return jsonify(context)
+
+# month-by-month totals for one user from the monthly aggregates
+# (?months=N, default 12, newest N months, oldest first)
+@app.route("/users/<user_id>/trends", methods=["GET"])
+def user_trends(user_id):
+    return jsonify(get_user_trends(user_id, request.args.get("months", 12, type=int)))
+
+# p50/p90 score and solve time plus how today's score compares with
+# everyone else's (see services/score_stats.py)
+@app.route("/users/<user_id>/stats", methods=["GET"])
+def user_stats(user_id):
+    return jsonify(get_user_stats(user_id))
+
+# Server-Sent Events with rank changes as they happen, so the page
+# doesn't have to poll /leaderboard-data (see services/events.py)
+@app.route("/leaderboard-stream", methods=["GET"])
+def leaderboard_stream():
+    response = Response(sse_stream(), mimetype=SSE_MIMETYPE)
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# storage reads/writes and latency per endpoint and service function
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return jsonify(metrics_snapshot())
+
+def create_app():
+    """
+    Multi-worker WSGI entry point, one call per worker process, e.g.
+    gunicorn -w 4 --threads 8 'app:create_app()': workers share one
+    published leaderboard snapshot instead of each querying for it.
+    Every SSE viewer holds a thread here; gunicorn.conf.py serves
+    asgi.create_app on uvicorn workers instead.
+    """
+    start_shared_leaderboard()
+    return app
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     app.run(debug=True)
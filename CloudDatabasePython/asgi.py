@@ -0,0 +1,290 @@
+"""
+Async serving mode: the same routes as app.py on Starlette + the async
+Firestore client, so one process can serve many concurrent submitters.
+
+Run with:  uvicorn asgi:app --workers 1
+"""
+import asyncio
+import os
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from config.settings import COMPRESS_MIN_BYTES, METRICS_HEADERS
+from services.data_version import current_version, etag_matches, make_etag
+from services.events import SSE_MIMETYPE, sse_stream_async
+from services.idempotency import (
+    IdempotencyConflict,
+    IdempotencyInProgress,
+    run_idempotent_async,
+    submission_key,
+)
+from services.instrumentation import begin_request, end_request, metrics_snapshot
+from services.monthly_aggregates import get_user_trends
+from services.score_stats import get_user_stats
+from services.static_assets import AssetBundle
+from services.storage import StorageUnavailable, get_async_storage
+from services.user_summary import (
+    process_user_daily_submission_async,
+    process_user_daily_submissions_async,
+)
+from services.leaderboard import (
+    decode_cursor,
+    get_leaderboard_page_async,
+    get_rank_context,
+    iter_leaderboard_entries_async,
+    start_shared_leaderboard,
+)
+from services.window_leaderboards import WINDOWS, current_period, get_window_leaderboard
+from services.streaming import (
+    NDJSON_MIMETYPE,
+    json_array_chunks_async,
+    ndjson_lines_async,
+    stream_format,
+)
+
+FRONTEND_DIR = os.path.join(os.path.dirname(__file__), 'frontend')
+
+
+class StorageMetricsMiddleware:
+    """Per-request storage accounting, as app.py's before/after_request hooks."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        storage_scope = begin_request()
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and METRICS_HEADERS:
+                headers = MutableHeaders(scope=message)
+                for name, value in storage_scope.headers().items():
+                    headers.append(name, value)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            endpoint = getattr(scope.get("endpoint"), "__name__", "static")
+            end_request(f"{scope['method']} {endpoint}", storage_scope)
+
+
+def _int_param(request, name, default=None):
+    """Query parameter as an int, or default when missing or not a number (like Flask's type=int)."""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def _streamed(request, items):
+    """Streaming response for ?format=ndjson|stream, else None (see app.py)."""
+    fmt = stream_format(request.query_params.get("format"), request.headers.get("accept"))
+    if fmt == "ndjson":
+        return StreamingResponse(ndjson_lines_async(items), media_type=NDJSON_MIMETYPE)
+    if fmt == "array":
+        return StreamingResponse(json_array_chunks_async(items), media_type="application/json")
+    return None
+
+
+async def _list_etag(request, kind):
+    """Strong ETag for a list endpoint (see app.py)."""
+    fmt = stream_format(request.query_params.get("format"), request.headers.get("accept")) or "json"
+    # Usually a cache hit, but a miss is a blocking storage read
+    version = await asyncio.to_thread(current_version)
+    return make_etag(kind, version, fmt)
+
+
+def _with_etag(response, etag):
+    response.headers["ETag"] = f'"{etag}"'
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _not_modified(request, etag):
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return _with_etag(Response(status_code=304), etag)
+    return None
+
+
+async def _user_rows():
+    async for user_id, data in get_async_storage().iter_users(fields=["username"]):
+        yield {"userId": user_id, "username": data.get("username", user_id)}
+
+
+async def list_users(request):
+    etag = await _list_etag(request, "users")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    streamed = _streamed(request, _user_rows())
+    if streamed:
+        return _with_etag(streamed, etag)
+    return _with_etag(JSONResponse([user async for user in _user_rows()]), etag)
+
+
+async def _submit(data):
+    result = await process_user_daily_submission_async(
+        data["userId"],
+        data["timeSeconds"],
+        data["mistakes"],
+        data["hintsUsed"],
+        data["difficulty"],
+        date_str=data.get("date")
+    )
+    result["submittedBy"] = data.get("submittedBy", "anonymous")
+    return result
+
+
+async def submit_score(request):
+    data = await request.json()
+    key = request.headers.get("idempotency-key")
+    if not key:
+        return JSONResponse(await _submit(data))
+    try:
+        result, replayed = await run_idempotent_async(
+            submission_key(data, key), data, lambda: _submit(data)
+        )
+    except IdempotencyConflict as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    except IdempotencyInProgress as e:
+        return JSONResponse({"error": str(e)}, status_code=409, headers={"Retry-After": "1"})
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    response = JSONResponse(result)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+async def submit_batch(request):
+    data = await request.json()
+    try:
+        result = await process_user_daily_submissions_async(data.get("submissions", []))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return JSONResponse(result)
+
+
+# leaderboard data endpoint
+async def leaderboard_data(request):
+    try:
+        limit = _int_param(request, "limit")
+        cursor = request.query_params.get("cursor")
+        if cursor:
+            decode_cursor(cursor)
+        etag = await _list_etag(request, "leaderboard")
+        not_modified = _not_modified(request, etag)
+        if not_modified:
+            return not_modified
+        streamed = _streamed(request, iter_leaderboard_entries_async(limit, cursor))
+        if streamed:
+            return _with_etag(streamed, etag)
+        leaderboard, next_cursor = await get_leaderboard_page_async(limit, cursor)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return _with_etag(JSONResponse(leaderboard, headers=headers), etag)
+
+
+
+async def window_leaderboard(request):
+    window = request.path_params["window"]
+    if window not in WINDOWS:
+        return JSONResponse({"error": f"unknown leaderboard window {window!r}"}, status_code=404)
+    etag = await _list_etag(request, f"leaderboard-{window}-{current_period(window)}")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    limit = _int_param(request, "limit")
+    # One document read, usually cached; off the event loop when it isn't
+    board = await asyncio.to_thread(get_window_leaderboard, window, limit)
+    return _with_etag(JSONResponse(board), etag)
+
+
+async def leaderboard_around(request):
+    k = max(0, min(_int_param(request, "k", 3), 50))
+    user_id = request.path_params["user_id"]
+    # A handful of point reads and counts; run them off the event loop
+    context = await asyncio.to_thread(get_rank_context, user_id, k)
+    if context is None:
+        return JSONResponse({"error": f"{user_id} is not on the leaderboard"}, status_code=404)
+    return JSONResponse(context)
+
+async def user_trends(request):
+    months = _int_param(request, "months", 12)
+    trends = await asyncio.to_thread(get_user_trends, request.path_params["user_id"], months)
+    return JSONResponse(trends)
+
+async def user_stats(request):
+    stats = await asyncio.to_thread(get_user_stats, request.path_params["user_id"])
+    return JSONResponse(stats)
+
+
+async def leaderboard_stream(request):
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(sse_stream_async(), media_type=SSE_MIMETYPE, headers=headers)
+
+
+async def metrics(request):
+    return JSONResponse(await asyncio.to_thread(metrics_snapshot))
+
+
+async def storage_unavailable(request, exc):
+    """503 while storage is down or its circuit is open (see app.py)."""
+    headers = {"Retry-After": str(exc.retry_after)}
+    return JSONResponse({"error": "storage temporarily unavailable"}, status_code=503, headers=headers)
+
+
+ASSETS = AssetBundle(FRONTEND_DIR)
+
+
+async def static_asset(request):
+    """Precompressed frontend files (see services/static_assets.py)."""
+    asset = ASSETS.get(request.path_params["path"])
+    if asset is None:
+        return Response(status_code=404)
+    encoding, body = asset.select(request.headers.get("accept-encoding"))
+    headers = asset.headers(encoding)
+    if etag_matches(request.headers.get("if-none-match"), asset.etag):
+        headers.pop("Content-Encoding", None)
+        return Response(status_code=304, headers=headers)
+    return Response(body, headers=headers)
+
+
+# GZipMiddleware compresses JSON/NDJSON of COMPRESS_MIN_BYTES or more on
+# the fly; it leaves SSE and the already-encoded static assets alone
+app = Starlette(exception_handlers={StorageUnavailable: storage_unavailable}, middleware=[
+    Middleware(StorageMetricsMiddleware),
+    Middleware(GZipMiddleware, minimum_size=COMPRESS_MIN_BYTES),
+], routes=[
+    Route("/users", list_users, methods=["GET"]),
+    Route("/submit", submit_score, methods=["POST"]),
+    Route("/submit-batch", submit_batch, methods=["POST"]),
+    Route("/leaderboard-data", leaderboard_data, methods=["GET"]),
+    Route("/leaderboards/{window}", window_leaderboard, methods=["GET"]),
+    Route("/leaderboard-around/{user_id}", leaderboard_around, methods=["GET"]),
+    Route("/leaderboard-stream", leaderboard_stream, methods=["GET"]),
+    Route("/users/{user_id}/trends", user_trends, methods=["GET"]),
+    Route("/users/{user_id}/stats", user_stats, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+    # index.html at "/" and everything else in frontend/
+    Route("/{path:path}", static_asset, methods=["GET"]),
+])
+
+
+def create_app():
+    """
+    Production entry point, one call per worker process: gunicorn -c
+    gunicorn.conf.py, or uvicorn --factory asgi:create_app --workers 4
+    (see app.create_app).
+    """
+    start_shared_leaderboard()
+    return app
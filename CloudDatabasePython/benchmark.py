@@ -0,0 +1,263 @@
+"""
+Benchmark the submit, leaderboard and rollover paths.
+
+Seeds N users x M days of scores, then measures latency percentiles,
+throughput and Firestore-style read/write counts per operation for:
+
+  submit              POST /submit (mix of new days and resubmissions)
+  leaderboard_cold    GET /leaderboard-data with the cache dropped first
+  leaderboard_warm    GET /leaderboard-data served from the cache
+  leaderboard_page    GET /leaderboard-data?limit=50, cold
+  rollover            run_monthly_rollover over every seeded user
+
+Runs in-process against SQLite by default, or against the Firestore
+emulator with --backend emulator (FIRESTORE_EMULATOR_HOST must be set;
+the emulator's data is wiped first). Results are printed as JSON.
+
+    python benchmark.py --users 200 --days 20 --output bench.json
+    python benchmark.py --baseline bench.json   # exit 1 if reads/writes per op grew
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import urllib.request
+from datetime import date, timedelta
+
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "benchmark")
+
+from app import app
+from services.counting_storage import CountingStorage
+from services.leaderboard import invalidate_leaderboard_cache
+from services.monthly_aggregates import update_month_aggregates
+from services.monthly_rollover import run_monthly_rollover
+from services.score_stats import write_user_sketch
+from services.storage import set_storage
+from services.user_summary import _score_fields
+from services.utils import month_of, next_month, today_id, week_date_range, week_of
+from services.window_leaderboards import rebuild_window_boards
+
+
+def _create_storage(backend):
+    if backend == "sqlite":
+        from services.sqlite_storage import SQLiteStorage
+        return SQLiteStorage(":memory:")
+
+    host = os.getenv("FIRESTORE_EMULATOR_HOST")
+    if not host:
+        raise SystemExit("--backend emulator needs FIRESTORE_EMULATOR_HOST")
+    project = os.environ["GOOGLE_CLOUD_PROJECT"]
+    request = urllib.request.Request(
+        f"http://{host}/emulator/v1/projects/{project}/databases/(default)/documents",
+        method="DELETE"
+    )
+    urllib.request.urlopen(request).close()
+
+    from services.firestore_storage import FirestoreStorage
+    return FirestoreStorage()
+
+
+def _random_inputs(rng):
+    return {
+        "timeSeconds": round(rng.uniform(30, 900), 1),
+        "mistakes": rng.randint(0, 5),
+        "hintsUsed": rng.randint(0, 3),
+        "difficulty": rng.randint(1, 5),
+    }
+
+
+def seed(store, users, days, rng):
+    """Write users x days scores with summaries, month aggregates and window boards."""
+    today = date.today()
+    month = month_of(today.isoformat())
+    week = week_of(today.isoformat())
+    first_week_date, last_week_date = week_date_range(week)
+    dates = [(today - timedelta(days=offset)).isoformat() for offset in range(days)]
+
+    for n in range(users):
+        user_id = f"user{n:05d}"
+        items = []
+        for date_id in dates:
+            inputs = _random_inputs(rng)
+            fields = _score_fields(
+                store, date_id, inputs["timeSeconds"], inputs["mistakes"],
+                inputs["hintsUsed"], inputs["difficulty"]
+            )
+            items.append((date_id, fields))
+
+        this_month = [fields for date_id, fields in items if month_of(date_id) == month]
+        total = sum(fields["dailyScore"] for fields in this_month)
+        total_time = sum(fields["timeSeconds"] for fields in this_month)
+        week_total = sum(fields["dailyScore"] for date_id, fields in items
+                         if first_week_date <= date_id <= last_week_date)
+        months = {month_of(date_id): [] for date_id in dates}
+
+        def _write(txn):
+            for date_id, fields in items:
+                txn.set_score(user_id, date_id, fields)
+            txn.set_user(user_id, {
+                "username": f"User {n}",
+                "currentMonthTotal": total,
+                "currentMonthCount": len(this_month),
+                "currentMonthTime": total_time,
+                "averageTime": total_time / len(this_month) if this_month else 0,
+                "summaryMonth": month,
+                "lastRolloverId": None,
+                "weekTotal": week_total,
+                "summaryWeek": week,
+                "allTimeTotal": sum(fields["dailyScore"] for _, fields in items),
+            })
+            update_month_aggregates(txn, store, user_id, {}, months, items)
+            write_user_sketch(txn, store, user_id, None, items, [])
+
+        store.run_transaction(_write)
+
+    rebuild_window_boards()
+
+
+def _summarise(name, latencies, elapsed, counter):
+    ops = len(latencies)
+    ms = sorted(latency * 1000 for latency in latencies)
+    totals = counter.totals()
+    return {
+        "operation": name,
+        "ops": ops,
+        "throughputPerSec": round(ops / elapsed, 2) if elapsed else None,
+        "latencyMs": {
+            "mean": round(statistics.fmean(ms), 3),
+            "p50": round(ms[int(0.50 * (ops - 1))], 3),
+            "p90": round(ms[int(0.90 * (ops - 1))], 3),
+            "p99": round(ms[int(0.99 * (ops - 1))], 3),
+            "max": round(ms[-1], 3),
+        },
+        "readsPerOp": round(totals["reads"] / ops, 2),
+        "writesPerOp": round(totals["writes"] / ops, 2),
+        "byStorageCall": counter.snapshot(),
+    }
+
+
+def _measure(name, counter, runs, fn):
+    counter.reset()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(runs):
+        op_started = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - op_started)
+    return _summarise(name, latencies, time.perf_counter() - started, counter)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    store = CountingStorage(_create_storage(args.backend))
+    set_storage(store)
+    client = app.test_client()
+
+    started = time.perf_counter()
+    seed(store, args.users, args.days, rng)
+    seed_seconds = time.perf_counter() - started
+
+    today = date.today()
+
+    def submit(_):
+        # Mostly today's score, sometimes a resubmission of an earlier day
+        offset = 0 if rng.random() < 0.7 else rng.randrange(min(args.days, today.day))
+        response = client.post("/submit", json={
+            "userId": f"user{rng.randrange(args.users):05d}",
+            "date": (today - timedelta(days=offset)).isoformat(),
+            **_random_inputs(rng),
+        })
+        assert response.status_code == 200, response.data
+
+    def leaderboard(path, cold):
+        def _get(_):
+            if cold:
+                invalidate_leaderboard_cache()
+            response = client.get(path)
+            assert response.status_code == 200, response.data
+        return _get
+
+    results = [
+        _measure("submit", store.counter, args.submits, submit),
+        _measure("leaderboard_cold", store.counter, args.reads,
+                 leaderboard("/leaderboard-data", cold=True)),
+        _measure("leaderboard_warm", store.counter, args.reads,
+                 leaderboard("/leaderboard-data", cold=False)),
+        _measure("leaderboard_page", store.counter, args.reads,
+                 leaderboard("/leaderboard-data?limit=50", cold=True)),
+    ]
+
+    # Roll into next month, like the real run at month end; clear the
+    # checkpoint an earlier run against the same emulator may have left
+    rollover_id = next_month(month_of(today_id()))
+    store.set_doc("rollovers", rollover_id, {
+        "completed": False, "ranksFrozen": False, "lastUserId": None, "processed": 0
+    })
+    with contextlib.redirect_stdout(sys.stderr):
+        rollover = _measure(
+            "rollover", store.counter, 1,
+            lambda _: run_monthly_rollover(rollover_id, progress=None)
+        )
+    rollover["usersPerSec"] = round(args.users / rollover["latencyMs"]["max"] * 1000, 2)
+    results.append(rollover)
+
+    return {
+        "backend": args.backend,
+        "users": args.users,
+        "days": args.days,
+        "seed": args.seed,
+        "seedSeconds": round(seed_seconds, 3),
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the operations whose reads or writes per op grew past tolerance."""
+    previous = {result["operation"]: result for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = previous.get(result["operation"])
+        if not before:
+            continue
+        for key in ("readsPerOp", "writesPerOp"):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{result['operation']}.{key}: {before[key]} -> {result[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["sqlite", "emulator"], default="sqlite")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--submits", type=int, default=500)
+    parser.add_argument("--reads", type=int, default=100, help="requests per leaderboard scenario")
+    parser.add_argument("--seed", type=int, default=310)
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--baseline", help="earlier report to compare read/write counts with")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="allowed relative growth in reads/writes per op (default 0.05)")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
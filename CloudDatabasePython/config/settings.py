@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load .env variables
@@ -9,3 +10,100 @@ SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 
 # Optional: Firebase/GCP project ID
 PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
+
+# Seconds a computed leaderboard is served from memory (0 disables the cache)
+LEADERBOARD_CACHE_TTL = float(os.getenv("LEADERBOARD_CACHE_TTL", "30"))
+
+# Entries kept in each precomputed weekly/monthly/all-time leaderboard
+# document (services/window_leaderboards.py)
+LEADERBOARD_TOP_K = int(os.getenv("LEADERBOARD_TOP_K", "100"))
+
+# Seconds between batched updates of those documents; Firestore sustains
+# about one write per second per document (0 updates them after every
+# submission)
+WINDOW_BOARD_FLUSH_SECONDS = float(os.getenv("WINDOW_BOARD_FLUSH_SECONDS", "1"))
+
+# Relative error of the score/time percentile sketches (services/sketches.py)
+SKETCH_ACCURACY = float(os.getenv("SKETCH_ACCURACY", "0.01"))
+
+# Documents each day's everyone-who-played sketch is spread over, so
+# concurrent submitters rarely update the same one
+SKETCH_SHARDS = int(os.getenv("SKETCH_SHARDS", "8"))
+
+# Monthly rollover: users per batched write (Firestore caps a batch at 500)
+# and how many batches may be committed in parallel
+ROLLOVER_BATCH_SIZE = min(int(os.getenv("ROLLOVER_BATCH_SIZE", "400")), 500)
+ROLLOVER_WORKERS = int(os.getenv("ROLLOVER_WORKERS", "4"))
+
+# Where services keep their data: "firestore" (default) or "sqlite" for
+# offline benchmarking and local-disk deployments (":memory:" works too)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "local.db")
+
+# Seconds a worker trusts its cached copy of the data version before
+# re-reading it (used for ETags on the list endpoints)
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "1"))
+
+# Documents the data version counter is spread over, so every submission
+# doesn't write the same one; reading the version reads them all
+DATA_VERSION_SHARDS = int(os.getenv("DATA_VERSION_SHARDS", "8"))
+
+# Server-Sent Events: seconds between keep-alive comments on an idle
+# stream, and how many events a slow viewer may fall behind before it is
+# told to reload instead
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+
+# Count storage reads/writes and their latency per request and per
+# service function (served at /metrics); METRICS_HEADERS also adds them
+# to every response as X-Storage-* headers (always on in Flask debug mode)
+INSTRUMENT_STORAGE = os.getenv("INSTRUMENT_STORAGE", "1") == "1"
+METRICS_HEADERS = os.getenv("METRICS_HEADERS", "0") == "1"
+
+# Write-behind for /submit: milliseconds to gather summary updates before
+# committing them together (0 disables it; each submission then updates
+# its user's summary in its own transaction), and users per commit
+SUBMIT_COALESCE_MS = float(os.getenv("SUBMIT_COALESCE_MS", "0"))
+COALESCE_USERS_PER_COMMIT = int(os.getenv("COALESCE_USERS_PER_COMMIT", "100"))
+
+# Idempotency-Key on /submit: seconds a result is replayed for retries,
+# how many keys are remembered (least recently used are dropped first),
+# and seconds a retry waits for a first attempt that is still running
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", "30"))
+
+# JSON responses of at least this many bytes are gzip-compressed for
+# clients that accept it (frontend files are precompressed at startup)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+
+# Multi-worker serving (gunicorn.conf.py): the file one worker publishes
+# the ranked leaderboard to for all of them (a tmpfs such as /dev/shm
+# keeps it in memory), and how often the publisher checks for changes
+SHARED_LEADERBOARD_PATH = os.getenv(
+    "SHARED_LEADERBOARD_PATH",
+    os.path.join(tempfile.gettempdir(), "cse310-leaderboard.snapshot")
+)
+SHARED_LEADERBOARD_INTERVAL = float(os.getenv("SHARED_LEADERBOARD_INTERVAL", "1"))
+
+# Storage resilience (services/resilient_storage.py): per-RPC Firestore
+# deadline in seconds, and the overall seconds one storage operation may
+# take including retries
+FIRESTORE_TIMEOUT = float(os.getenv("FIRESTORE_TIMEOUT", "5"))
+STORAGE_DEADLINE = float(os.getenv("STORAGE_DEADLINE", "10"))
+
+# Retries of transient storage errors: attempts per operation, the first
+# backoff in milliseconds (doubling, with full jitter), and the extra
+# calls retries and hedges may add per call across the process
+RESILIENT_STORAGE = os.getenv("RESILIENT_STORAGE", "1") == "1"
+STORAGE_RETRY_ATTEMPTS = int(os.getenv("STORAGE_RETRY_ATTEMPTS", "4"))
+STORAGE_RETRY_BASE_MS = float(os.getenv("STORAGE_RETRY_BASE_MS", "50"))
+STORAGE_RETRY_BUDGET = float(os.getenv("STORAGE_RETRY_BUDGET", "0.1"))
+
+# Milliseconds before a slow full-leaderboard read is sent a second time
+LEADERBOARD_HEDGE_MS = float(os.getenv("LEADERBOARD_HEDGE_MS", "250"))
+
+# Consecutive failed storage operations that open the circuit, and the
+# seconds it stays open (requests fail fast with 503) before a trial call
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "15"))
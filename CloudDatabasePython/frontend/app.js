@@ -0,0 +1,253 @@
+const userSelect = document.getElementById("userId");
+const form = document.getElementById("scoreForm");
+const resultEl = document.getElementById("result");
+const leaderboardBody = document.querySelector("#leaderboardTable tbody");
+const refreshBtn = document.getElementById("refreshLeaderboard");
+const myStatsDiv = document.getElementById("myStats");
+
+// Cache leaderboard data so we can show stats for the selected user
+let leaderboardCache = [];
+// Last percentiles fetched, {userId, html}; kept across leaderboard
+// re-renders so live updates don't refetch them
+let percentiles = { userId: null, html: "" };
+
+/* --------------------------
+     Load Users for Dropdown
+  --------------------------- */
+async function populateUsers() {
+  try {
+    const response = await fetch("/users");
+    const users = await response.json();
+
+    userSelect.innerHTML = ""; // Clear any existing options
+
+    users.forEach((user) => {
+      const option = document.createElement("option");
+      option.value = user.userId;
+      option.textContent = user.username;
+      userSelect.appendChild(option);
+    });
+
+    if (users.length === 0) {
+      resultEl.textContent = "No users found in Firestore.";
+    }
+  } catch (err) {
+    console.error("Failed to fetch users:", err);
+    resultEl.textContent = "Error loading users.";
+  }
+}
+
+/* --------------------------
+     Load Leaderboard Data
+  --------------------------- */
+async function loadLeaderboard() {
+  try {
+    const response = await fetch("/leaderboard-data");
+    renderLeaderboard(await response.json());
+  } catch (err) {
+    console.error("Failed to fetch leaderboard:", err);
+  }
+}
+
+function renderLeaderboard(rows) {
+  leaderboardCache = rows; // store for My Stats use
+  leaderboardBody.innerHTML = ""; // Clear
+
+  rows.forEach((entry) => {
+    const tr = document.createElement("tr");
+
+    // Top 3 highlights
+    if (entry.rank === 1) tr.classList.add("gold");
+    else if (entry.rank === 2) tr.classList.add("silver");
+    else if (entry.rank === 3) tr.classList.add("bronze");
+
+    tr.innerHTML = `
+                <td>${entry.rank}</td>
+                <td>${entry.username}</td>
+                <td>${entry.currentMonthTotal ?? 0}</td>
+                <td>${entry.lastMonthTotal ?? 0}</td>
+                <td>${(entry.averageTime ?? 0).toFixed(2)}</td>
+            `;
+
+    leaderboardBody.appendChild(tr);
+  });
+
+  if (rows.length === 0) {
+    leaderboardBody.innerHTML =
+      "<tr><td colspan='5'>No data yet.</td></tr>";
+  }
+
+  // After loading leaderboard, refresh My Stats for the current selection
+  updateMyStats();
+}
+
+/* --------------------------
+     Live Updates (SSE)
+  --------------------------- */
+// Apply a "rank" event to the cached rows; returns false if the
+// event is for a user we don't have, so the caller reloads instead.
+// Only the submitter's total changed, so re-sorting the rows the way
+// the server orders them (total descending, then user id) gives
+// everyone's new place.
+function applyRankChange(change) {
+  const changed = leaderboardCache.find((e) => e.userId === change.userId);
+  if (!changed) return false;
+
+  changed.currentMonthTotal = change.currentMonthTotal;
+  changed.averageTime = change.averageTime;
+
+  const rows = [...leaderboardCache].sort(
+    (a, b) =>
+      (b.currentMonthTotal ?? 0) - (a.currentMonthTotal ?? 0) ||
+      (a.userId < b.userId ? -1 : a.userId > b.userId ? 1 : 0)
+  );
+  rows.forEach((entry, i) => (entry.rank = i + 1));
+
+  renderLeaderboard(rows);
+  return true;
+}
+
+// Revalidate now and then even with a live stream: rank events only
+// come from the worker that handled the submission, and viewers on
+// another host only hear of it this way. Unchanged data is a 304.
+const POLL_INTERVAL_MS = 30000;
+
+function listenForUpdates() {
+  setInterval(loadLeaderboard, POLL_INTERVAL_MS);
+  if (!window.EventSource) return;
+
+  const events = new EventSource("/leaderboard-stream");
+  let connected = false;
+
+  // Reload on reconnect, since events sent while away are lost
+  events.addEventListener("open", () => {
+    if (connected) loadLeaderboard();
+    connected = true;
+  });
+  events.addEventListener("rank", (e) => {
+    if (!applyRankChange(JSON.parse(e.data))) loadLeaderboard();
+  });
+  events.addEventListener("reset", loadLeaderboard);
+}
+
+/* --------------------------
+     Update "My Stats" box
+  --------------------------- */
+function updateMyStats() {
+  const selectedUserId = userSelect.value;
+  if (!selectedUserId || leaderboardCache.length === 0) {
+    myStatsDiv.innerHTML = "<p>No stats yet.</p>";
+    return;
+  }
+
+  const entry = leaderboardCache.find((e) => e.userId === selectedUserId);
+
+  if (!entry) {
+    myStatsDiv.innerHTML = "<p>No stats yet for this user.</p>";
+    return;
+  }
+
+  myStatsDiv.innerHTML = `
+          <p><strong>Player:</strong> ${entry.username}</p>
+          <p><strong>Rank:</strong> #${entry.rank}</p>
+          <p><strong>Current Month Total:</strong> ${
+            entry.currentMonthTotal ?? 0
+          }</p>
+          <p><strong>Last Month Total:</strong> ${
+            entry.lastMonthTotal ?? 0
+          }</p>
+          <p><strong>Average Time:</strong> ${(
+            entry.averageTime ?? 0
+          ).toFixed(2)} s</p>
+          <div id="myPercentiles">${
+            percentiles.userId === selectedUserId ? percentiles.html : ""
+          }</div>
+      `;
+}
+
+/* --------------------------
+     Percentiles for My Stats
+  --------------------------- */
+// Only when the selection changes or after a submit, not on every
+// leaderboard event: each call is a few storage reads on the server
+async function loadPercentiles() {
+  const userId = userSelect.value;
+  if (!userId) return;
+  try {
+    const res = await fetch(`/users/${encodeURIComponent(userId)}/stats`);
+    const stats = await res.json();
+    // The selection may have changed while we waited
+    if (userSelect.value !== userId) return;
+
+    const { allTime, today } = stats;
+    let html = "";
+    if (allTime.count > 0) {
+      html += `
+          <p><strong>Daily Score (p50 / p90):</strong> ${allTime.dailyScore.p50} / ${allTime.dailyScore.p90}</p>
+          <p><strong>Solve Time (p50 / p90):</strong> ${allTime.timeSeconds.p50} / ${allTime.timeSeconds.p90} s</p>
+      `;
+    }
+    if (today && today.players > 1) {
+      html += `<p><strong>Today:</strong> you beat ${today.beatPercent}% of players</p>`;
+    }
+    percentiles = { userId, html };
+    const target = document.getElementById("myPercentiles");
+    if (target) target.innerHTML = html;
+  } catch (err) {
+    console.error("Error loading percentiles:", err);
+  }
+}
+
+/* --------------------------
+     Submit Score Handler
+  --------------------------- */
+form.addEventListener("submit", async (e) => {
+  e.preventDefault();
+
+  const payload = {
+    userId: userSelect.value,
+    timeSeconds: parseFloat(document.getElementById("timeSeconds").value),
+    mistakes: parseInt(document.getElementById("mistakes").value),
+    hintsUsed: parseInt(document.getElementById("hintsUsed").value),
+    difficulty: parseInt(document.getElementById("difficulty").value),
+    submittedBy: "WebUser",
+    date: document.getElementById("scoreDate").value || null, // 👈 NEW
+  };
+
+  try {
+    const response = await fetch("/submit", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify(payload),
+    });
+
+    const data = await response.json();
+    resultEl.textContent = JSON.stringify(data, null, 2);
+
+    // Refresh leaderboard & stats after submission
+    await loadLeaderboard();
+    loadPercentiles();
+  } catch (err) {
+    console.error("Submit error:", err);
+    resultEl.textContent = "Error submitting score.";
+  }
+});
+
+/* --------------------------
+     Initial Page Load
+  --------------------------- */
+(async function init() {
+  await populateUsers();
+  await loadLeaderboard();
+  loadPercentiles();
+  listenForUpdates();
+})();
+
+// Refresh leaderboard button
+refreshBtn.addEventListener("click", loadLeaderboard);
+
+// When the selected player changes, update My Stats
+userSelect.addEventListener("change", () => {
+  updateMyStats();
+  loadPercentiles();
+});
@@ -0,0 +1,31 @@
+"""
+Production serving: gunicorn -c gunicorn.conf.py
+
+Runs the ASGI app (asgi.py) on uvicorn workers. Every open page keeps a
+/leaderboard-stream connection, and on an event loop that is a suspended
+coroutine, not a thread; with threaded WSGI workers a handful of viewers
+would use up every thread and block normal requests.
+
+Each worker builds its own Firestore client after the fork, because gRPC
+channels don't survive fork(). The workers share the leaderboard through
+the snapshot file one of them publishes (SHARED_LEADERBOARD_PATH), so
+adding workers adds capacity for reads without adding leaderboard queries.
+
+Caches and /metrics counters are per worker. Live rank events reach the
+viewers of the worker that handled the submission; every other worker
+sends its viewers a reset once the change reaches the shared snapshot
+(services/events.py).
+"""
+import multiprocessing
+import os
+
+wsgi_app = "asgi:create_app()"
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app in each worker, not the master (see above)
+preload_app = False
+timeout = 60
+graceful_timeout = 30
+accesslog = "-"
@@ -1,6 +1,8 @@
+import logging
 from services.monthly_rollover import run_monthly_rollover
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     print("Starting monthly rollover...")
     run_monthly_rollover()
     print("Done.")
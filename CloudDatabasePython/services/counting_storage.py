@@ -0,0 +1,328 @@
+"""
+Storage wrappers that count document reads and writes per operation,
+the way Firestore bills them:
+
+  - a point read costs 1 read whether or not the document exists
+  - a query costs 1 read per document returned, and at least 1
+  - a count aggregation costs 1 read per 1000 index entries, at least 1
+  - every document set (merged or not) costs 1 write
+
+Totals per storage call are kept on the wrapper's OpCounter, and every
+call is also charged, with its round-trip time, to the current request
+and function scopes (services/instrumentation.py). get_storage() wraps
+the configured backend in these when INSTRUMENT_STORAGE is on; the
+benchmark wraps its own.
+"""
+import threading
+import time
+from .instrumentation import record_storage_call
+from .storage import AsyncStorage, AsyncTransaction, Storage, Transaction
+
+
+class OpCounter:
+    """Thread-safe {operation: {"calls", "reads", "writes", "ms"}} totals."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {}
+
+    def record(self, op: str, reads: int = 0, writes: int = 0, seconds: float = 0.0):
+        with self._lock:
+            entry = self._counts.setdefault(op, {"calls": 0, "reads": 0, "writes": 0, "ms": 0.0})
+            entry["calls"] += 1
+            entry["reads"] += reads
+            entry["writes"] += writes
+            entry["ms"] += seconds * 1000
+
+    def snapshot(self):
+        with self._lock:
+            return {op: {**entry, "ms": round(entry["ms"], 3)} for op, entry in self._counts.items()}
+
+    def totals(self):
+        totals = {"reads": 0, "writes": 0}
+        for entry in self.snapshot().values():
+            totals["reads"] += entry["reads"]
+            totals["writes"] += entry["writes"]
+        return totals
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+
+def _count_reads(count):
+    return max(1, -(-count // 1000))
+
+
+def _one(_):
+    return 1
+
+
+class _Counted:
+    """Shared helpers; `_counter` and `_prefix` are set by subclasses."""
+
+    def _record(self, op, reads, writes, seconds):
+        self._counter.record(self._prefix + op, reads, writes, seconds)
+        record_storage_call(reads, writes, seconds)
+
+    def _read(self, op, fn, reads=_one):
+        started = time.perf_counter()
+        result = fn()
+        self._record(op, reads(result), 0, time.perf_counter() - started)
+        return result
+
+    def _write(self, op, fn, writes=1):
+        started = time.perf_counter()
+        fn()
+        self._record(op, 0, writes, time.perf_counter() - started)
+
+    def _query(self, op, rows):
+        # Only time spent fetching rows counts, not the caller's work between them
+        returned, seconds = 0, 0.0
+        iterator = iter(rows)
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                returned += 1
+                yield row
+        finally:
+            self._record(op, max(returned, 1), 0, seconds)
+
+    async def _read_async(self, op, awaitable, reads=_one):
+        started = time.perf_counter()
+        result = await awaitable
+        self._record(op, reads(result), 0, time.perf_counter() - started)
+        return result
+
+    async def _query_async(self, op, rows):
+        returned, seconds = 0, 0.0
+        iterator = rows.__aiter__()
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - started
+                returned += 1
+                yield row
+        finally:
+            self._record(op, max(returned, 1), 0, seconds)
+
+    def _buffered_write(self, op):
+        # Transaction writes are buffered until commit; count them here
+        self._record(op, 0, 1, 0.0)
+
+
+class CountingTransaction(_Counted, Transaction):
+    _prefix = "txn."
+
+    def __init__(self, txn: Transaction, counter: OpCounter):
+        self._txn = txn
+        self._counter = counter
+
+    def get_user(self, user_id):
+        return self._read("get_user", lambda: self._txn.get_user(user_id))
+
+    def get_score(self, user_id, date_id):
+        return self._read("get_score", lambda: self._txn.get_score(user_id, date_id))
+
+    def get_scores(self, user_id, date_ids):
+        return self._read(
+            "get_scores", lambda: self._txn.get_scores(user_id, date_ids), lambda _: len(set(date_ids))
+        )
+
+    def iter_month_scores(self, user_id, month):
+        return self._query("iter_month_scores", self._txn.iter_month_scores(user_id, month))
+
+    def iter_user_scores(self, user_id):
+        return self._query("iter_user_scores", self._txn.iter_user_scores(user_id))
+
+    def get_user_months(self, user_id, months):
+        return self._read(
+            "get_user_months", lambda: self._txn.get_user_months(user_id, months), lambda _: len(set(months))
+        )
+
+    def set_user(self, user_id, fields):
+        self._txn.set_user(user_id, fields)
+        self._buffered_write("set_user")
+
+    def set_score(self, user_id, date_id, fields):
+        self._txn.set_score(user_id, date_id, fields)
+        self._buffered_write("set_score")
+
+    def set_user_month(self, user_id, month, fields):
+        self._txn.set_user_month(user_id, month, fields)
+        self._buffered_write("set_user_month")
+
+    def get_doc(self, collection, doc_id):
+        return self._read("get_doc", lambda: self._txn.get_doc(collection, doc_id))
+
+    def set_doc(self, collection, doc_id, fields):
+        self._txn.set_doc(collection, doc_id, fields)
+        self._buffered_write("set_doc")
+
+
+class CountingStorage(_Counted, Storage):
+    _prefix = ""
+
+    def __init__(self, storage: Storage, counter: OpCounter | None = None):
+        self.storage = storage
+        self.counter = self._counter = counter or OpCounter()
+        self.server_timestamp = storage.server_timestamp
+        self.transient_errors = storage.transient_errors
+
+    # --- users -------------------------------------------------------------
+
+    def get_user(self, user_id):
+        return self._read("get_user", lambda: self.storage.get_user(user_id))
+
+    def iter_users(self, fields=None):
+        return self._query("iter_users", self.storage.iter_users(fields))
+
+    def page_users(self, after_id, limit, fields=None):
+        return self._read(
+            "page_users", lambda: self.storage.page_users(after_id, limit, fields),
+            lambda page: max(len(page), 1)
+        )
+
+    def set_user(self, user_id, fields):
+        self._write("set_user", lambda: self.storage.set_user(user_id, fields))
+
+    def set_users(self, updates):
+        self._write("set_users", lambda: self.storage.set_users(updates), len(updates))
+
+    def iter_leaderboard(self, limit=None, start_after=None):
+        return self._query("iter_leaderboard", self.storage.iter_leaderboard(limit, start_after))
+
+    def count_users_ahead(self, total, user_id):
+        # Two aggregations on Firestore: users above, then ties before
+        return self._read(
+            "count_users_ahead", lambda: self.storage.count_users_ahead(total, user_id),
+            lambda count: _count_reads(count) + 1
+        )
+
+    def iter_leaderboard_before(self, total, user_id, limit):
+        return self._query(
+            "iter_leaderboard_before", self.storage.iter_leaderboard_before(total, user_id, limit)
+        )
+
+    # --- daily scores ------------------------------------------------------
+
+    def set_score(self, user_id, date_id, fields):
+        self._write("set_score", lambda: self.storage.set_score(user_id, date_id, fields))
+
+    def set_scores(self, updates):
+        self._write("set_scores", lambda: self.storage.set_scores(updates), len(updates))
+
+    def iter_month_scores(self, user_id, month):
+        return self._query("iter_month_scores", self.storage.iter_month_scores(user_id, month))
+
+    def iter_user_scores(self, user_id):
+        return self._query("iter_user_scores", self.storage.iter_user_scores(user_id))
+
+    # --- monthly aggregates ------------------------------------------------
+
+    def iter_user_months(self, user_id, limit=None):
+        return self._query("iter_user_months", self.storage.iter_user_months(user_id, limit))
+
+    def set_user_months(self, updates):
+        self._write("set_user_months", lambda: self.storage.set_user_months(updates), len(updates))
+
+    # --- bookkeeping documents ---------------------------------------------
+
+    def get_doc(self, collection, doc_id):
+        return self._read("get_doc", lambda: self.storage.get_doc(collection, doc_id))
+
+    def set_doc(self, collection, doc_id, fields):
+        self._write("set_doc", lambda: self.storage.set_doc(collection, doc_id, fields))
+
+    def increment_doc(self, collection, doc_id, field, amount=1):
+        self._write("increment_doc", lambda: self.storage.increment_doc(collection, doc_id, field, amount))
+
+    # --- transactions ------------------------------------------------------
+
+    def run_transaction(self, fn):
+        # Firestore retries re-run fn, and every attempt is billed
+        return self.storage.run_transaction(lambda txn: fn(CountingTransaction(txn, self._counter)))
+
+
+class CountingAsyncTransaction(_Counted, AsyncTransaction):
+    _prefix = "txn."
+
+    def __init__(self, txn: AsyncTransaction, counter: OpCounter):
+        self._txn = txn
+        self._counter = counter
+
+    async def get_user(self, user_id):
+        return await self._read_async("get_user", self._txn.get_user(user_id))
+
+    async def get_score(self, user_id, date_id):
+        return await self._read_async("get_score", self._txn.get_score(user_id, date_id))
+
+    async def get_scores(self, user_id, date_ids):
+        return await self._read_async(
+            "get_scores", self._txn.get_scores(user_id, date_ids), lambda _: len(set(date_ids))
+        )
+
+    def iter_month_scores(self, user_id, month):
+        return self._query_async("iter_month_scores", self._txn.iter_month_scores(user_id, month))
+
+    def iter_user_scores(self, user_id):
+        return self._query_async("iter_user_scores", self._txn.iter_user_scores(user_id))
+
+    async def get_user_months(self, user_id, months):
+        return await self._read_async(
+            "get_user_months", self._txn.get_user_months(user_id, months), lambda _: len(set(months))
+        )
+
+    async def get_doc(self, collection, doc_id):
+        return await self._read_async("get_doc", self._txn.get_doc(collection, doc_id))
+
+    def set_user(self, user_id, fields):
+        self._txn.set_user(user_id, fields)
+        self._buffered_write("set_user")
+
+    def set_score(self, user_id, date_id, fields):
+        self._txn.set_score(user_id, date_id, fields)
+        self._buffered_write("set_score")
+
+    def set_user_month(self, user_id, month, fields):
+        self._txn.set_user_month(user_id, month, fields)
+        self._buffered_write("set_user_month")
+
+    def set_doc(self, collection, doc_id, fields):
+        self._txn.set_doc(collection, doc_id, fields)
+        self._buffered_write("set_doc")
+
+
+class CountingAsyncStorage(_Counted, AsyncStorage):
+    _prefix = "async."
+
+    def __init__(self, storage: AsyncStorage, counter: OpCounter | None = None):
+        self.storage = storage
+        self.counter = self._counter = counter or OpCounter()
+        self.server_timestamp = storage.server_timestamp
+        self.transient_errors = storage.transient_errors
+
+    async def get_user(self, user_id):
+        return await self._read_async("get_user", self.storage.get_user(user_id))
+
+    def iter_users(self, fields=None):
+        return self._query_async("iter_users", self.storage.iter_users(fields))
+
+    def iter_leaderboard(self, limit=None, start_after=None):
+        return self._query_async("iter_leaderboard", self.storage.iter_leaderboard(limit, start_after))
+
+    async def run_transaction(self, fn):
+        return await self.storage.run_transaction(
+            lambda txn: fn(CountingAsyncTransaction(txn, self._counter))
+        )
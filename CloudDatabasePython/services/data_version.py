@@ -0,0 +1,64 @@
+"""
+A counter bumped whenever submissions or a rollover change what the list
+endpoints return. It backs their ETags so idle polling gets a 304 without
+re-running the query.
+
+Every submission bumps it, and Firestore sustains only about one write per
+second on a document. So the counter is spread over DATA_VERSION_SHARDS
+documents (meta/dataVersion, meta/dataVersion-1, ...): a bump increments
+one at random and the version is their sum. The sum only ever grows,
+like a single counter, and the first shard is the original document so
+versions carry on from where it left off.
+"""
+import random
+import threading
+import time
+from config.settings import DATA_VERSION_SHARDS, DATA_VERSION_TTL
+from .storage import get_storage
+
+_lock = threading.Lock()
+_cached = None  # (expires_at, version)
+
+
+def _shard_id(shard):
+    return f"dataVersion-{shard}" if shard else "dataVersion"
+
+
+def current_version(shards: int = DATA_VERSION_SHARDS) -> int:
+    """Return the data version, re-reading it at most every DATA_VERSION_TTL seconds."""
+    global _cached
+    now = time.monotonic()
+    with _lock:
+        if _cached and _cached[0] > now:
+            return _cached[1]
+
+    store = get_storage()
+    version = sum(
+        (store.get_doc("meta", _shard_id(shard)) or {}).get("version", 0)
+        for shard in range(shards)
+    )
+
+    with _lock:
+        _cached = (now + DATA_VERSION_TTL, version)
+    return version
+
+
+def bump_version(shards: int = DATA_VERSION_SHARDS):
+    """Record that user data changed; this process sees the new version immediately."""
+    global _cached
+    get_storage().increment_doc("meta", _shard_id(random.randrange(shards)), "version")
+    with _lock:
+        _cached = None
+
+
+def make_etag(kind: str, version: int, variant: str = "") -> str:
+    """Strong ETag value (without quotes) for one representation of a list."""
+    return f"{kind}-{version}-{variant}" if variant else f"{kind}-{version}"
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """True if an If-None-Match header value covers the given ETag."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or f'"{etag}"' in candidates
@@ -0,0 +1,186 @@
+"""
+In-process pub/sub for leaderboard changes, served as Server-Sent Events.
+
+Writers publish once per committed change and every open /leaderboard-stream
+connection gets a copy from its own bounded queue, so N viewers cost no
+storage reads at all. Rank events only reach viewers connected to the
+process that made the change. With several workers, each one also watches
+the shared leaderboard snapshot (services/shared_leaderboard.py) and sends
+its viewers a reset when another worker's change is published there; the
+page also revalidates the leaderboard now and then, for viewers served by
+another host.
+
+Event types:
+  rank   {"userId", "currentMonthTotal", "averageTime", "rank"} after a
+         submission (rank 0 = unranked). Everyone else keeps their total,
+         so clients re-sort their rows to find the places that moved
+  reset  {"reason"} after a rollover, when a viewer fell too far behind,
+         or ("update") when the shared snapshot moved to a newer data
+         version; clients should reload the whole leaderboard
+"""
+import asyncio
+import itertools
+import json
+import queue
+import threading
+from config.settings import SSE_HEARTBEAT_SECONDS, SSE_QUEUE_SIZE
+
+SSE_MIMETYPE = "text/event-stream"
+
+
+def _reset_event(reason):
+    return None, "reset", {"reason": reason}
+
+
+class Subscription:
+    """A viewer's queue of (id, type, data) events, read from a worker thread."""
+
+    def __init__(self, maxsize: int):
+        self._queue = queue.Queue(maxsize)
+        self._overflowed = False
+
+    def push(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout: float):
+        """Next event, or None if nothing arrived within timeout."""
+        if self._overflowed:
+            self._overflowed = False
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            return _reset_event("overflow")
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """Same as Subscription for a viewer served on an asyncio event loop."""
+
+    def __init__(self, maxsize: int):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize)
+        self._overflowed = False
+
+    def push(self, event):
+        # Publishers run on worker threads as well as on the loop itself
+        self._loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self._overflowed = True
+
+    async def get(self, timeout: float):
+        if self._overflowed:
+            self._overflowed = False
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            return _reset_event("overflow")
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        return self._add(Subscription(self.queue_size))
+
+    def subscribe_async(self):
+        return self._add(AsyncSubscription(self.queue_size))
+
+    def _add(self, subscription):
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type: str, data: dict):
+        with self._lock:
+            event = (next(self._ids), event_type, data)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            try:
+                subscription.push(event)
+            except RuntimeError:
+                # Its event loop has shut down
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+_broker = EventBroker(SSE_QUEUE_SIZE)
+
+
+def publish(event_type: str, data: dict):
+    """Send an event to every connected viewer in this process."""
+    _broker.publish(event_type, data)
+
+
+def publish_rank_change(user_id, current_month_total, average_time, rank):
+    publish("rank", {
+        "userId": user_id,
+        "currentMonthTotal": current_month_total,
+        "averageTime": average_time,
+        "rank": rank,
+    })
+
+
+def publish_reset(reason: str):
+    publish("reset", {"reason": reason})
+
+
+def subscriber_count():
+    return _broker.subscriber_count()
+
+
+def _format_sse(event):
+    event_id, event_type, data = event
+    text = f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+    return f"id: {event_id}\n{text}" if event_id else text
+
+
+def sse_stream(heartbeat: float = SSE_HEARTBEAT_SECONDS):
+    """
+    Subscribe and yield events as SSE text, with a comment line while idle
+    so proxies keep the connection open. The subscription is made on first
+    iteration and dropped when the client goes away (the generator closes).
+    """
+    subscription = _broker.subscribe()
+    try:
+        # Reconnect after 5s if the connection drops
+        yield "retry: 5000\n\n"
+        while True:
+            event = subscription.get(heartbeat)
+            yield _format_sse(event) if event else ": keep-alive\n\n"
+    finally:
+        _broker.unsubscribe(subscription)
+
+
+async def sse_stream_async(heartbeat: float = SSE_HEARTBEAT_SECONDS):
+    subscription = _broker.subscribe_async()
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            event = await subscription.get(heartbeat)
+            yield _format_sse(event) if event else ": keep-alive\n\n"
+    finally:
+        _broker.unsubscribe(subscription)
@@ -1,33 +1,87 @@
+import logging
 import os
-from dotenv import load_dotenv
+import threading
+import time
 from google.cloud import firestore
+from google.oauth2 import service_account
+from config.settings import SERVICE_ACCOUNT_FILE, PROJECT_ID
 
-# Load environment variables from .env
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Get the service account JSON path from environment variable
-SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-PROJECT_ID = os.getenv("GOOGLE_CLOUD_PROJECT")
+_lock = threading.Lock()
+_credentials = None
+_db = None
+_async_db = None
 
-if not SERVICE_ACCOUNT_FILE:
-    raise ValueError(
-        "GOOGLE_APPLICATION_CREDENTIALS not set in environment or .env file"
-    )
+# Seconds spent building each client, for checking cold-start cost
+startup_timings = {}
 
-if not PROJECT_ID:
-    raise ValueError(
-        "GOOGLE_CLOUD_PROJECT not set in environment or .env file"
-    )
 
-# Optional: print to verify
-print("Using service account:", SERVICE_ACCOUNT_FILE)
-print("Firestore project:", PROJECT_ID)
+def _load_credentials():
+    """
+    Load the service account once per process and share it between the
+    sync and async clients. Returns None when talking to the emulator.
+    """
+    global _credentials
+
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        return None
+
+    if not SERVICE_ACCOUNT_FILE:
+        raise ValueError(
+            "GOOGLE_APPLICATION_CREDENTIALS not set in environment or .env file"
+        )
+
+    if not PROJECT_ID:
+        raise ValueError(
+            "GOOGLE_CLOUD_PROJECT not set in environment or .env file"
+        )
+
+    if _credentials is None:
+        started = time.perf_counter()
+        _credentials = service_account.Credentials.from_service_account_file(
+            SERVICE_ACCOUNT_FILE,
+            scopes=firestore.Client.SCOPE
+        )
+        startup_timings["credentials"] = time.perf_counter() - started
+
+    return _credentials
+
 
 def get_db():
     """
-    Returns a Firestore client using the service account.
+    Returns the process-wide Firestore client, creating it on first use.
+
+    Nothing touches the network or the credentials file until this is
+    called, so importing services is cheap for CLIs and tests.
     """
-    return firestore.Client.from_service_account_json(
-        SERVICE_ACCOUNT_FILE,
-        project=PROJECT_ID
-    )
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                credentials = _load_credentials()
+                started = time.perf_counter()
+                _db = firestore.Client(project=PROJECT_ID, credentials=credentials)
+                startup_timings["client"] = time.perf_counter() - started
+                logger.info(
+                    "Firestore client for project %s ready in %.1f ms",
+                    _db.project, startup_timings["client"] * 1000
+                )
+    return _db
+
+
+def get_async_db():
+    """Returns the process-wide AsyncClient, sharing credentials with get_db()."""
+    global _async_db
+    if _async_db is None:
+        with _lock:
+            if _async_db is None:
+                credentials = _load_credentials()
+                started = time.perf_counter()
+                _async_db = firestore.AsyncClient(project=PROJECT_ID, credentials=credentials)
+                startup_timings["async_client"] = time.perf_counter() - started
+                logger.info(
+                    "Async Firestore client for project %s ready in %.1f ms",
+                    _async_db.project, startup_timings["async_client"] * 1000
+                )
+    return _async_db
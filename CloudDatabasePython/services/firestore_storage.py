@@ -0,0 +1,348 @@
+from google.api_core import exceptions as api_exceptions
+from google.cloud import firestore
+from google.cloud.firestore import SERVER_TIMESTAMP
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from config.settings import FIRESTORE_TIMEOUT
+from .firestore_client import get_async_db, get_db
+from .storage import AsyncStorage, AsyncTransaction, Storage, Transaction
+from .utils import month_date_range
+
+
+# Worth retrying: the request may succeed if sent again
+TRANSIENT_ERRORS = (
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+)
+
+
+def _rpc_options(timeout):
+    """
+    Per-RPC deadline, with the client library's own retries turned off:
+    they can stretch one call to a minute. Retries, with backoff and a
+    budget, are done by services/resilient_storage.py instead.
+    """
+    return {"timeout": timeout, "retry": None}
+
+
+def _leaderboard_query(query, limit=None, start_after=None):
+    """
+    Order by currentMonthTotal descending, ties by document id; users
+    missing the field are left out by Firestore, as before.
+    """
+    query = (
+        query.order_by("currentMonthTotal", direction=firestore.Query.DESCENDING)
+             .order_by(FieldPath.document_id())
+    )
+    if start_after:
+        total, user_id = start_after
+        query = query.start_after({"currentMonthTotal": total, FieldPath.document_id(): user_id})
+    if limit:
+        query = query.limit(limit)
+    return query
+
+
+def _month_scores_query(user_ref, month):
+    """
+    A user's scores dated in `month`, as a range on the YYYY-MM-DD document
+    ids. Served by the built-in __name__ index, so it needs no composite
+    index and reads exactly the month's documents.
+    """
+    scores_ref = user_ref.collection("scores")
+    first_date_id, last_date_id = month_date_range(month)
+    return (
+        scores_ref.where(filter=FieldFilter(FieldPath.document_id(), ">=", scores_ref.document(first_date_id)))
+                  .where(filter=FieldFilter(FieldPath.document_id(), "<=", scores_ref.document(last_date_id)))
+    )
+
+
+class FirestoreTransaction(Transaction):
+    def __init__(self, storage, transaction):
+        self._storage = storage
+        self._transaction = transaction
+
+    def get_user(self, user_id):
+        ref = self._storage._user_ref(user_id)
+        snap = ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def get_score(self, user_id, date_id):
+        ref = self._storage._score_ref(user_id, date_id)
+        snap = ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def get_scores(self, user_id, date_ids):
+        refs = [self._storage._score_ref(user_id, date_id) for date_id in set(date_ids)]
+        snaps = self._transaction.get_all(refs, **self._storage._rpc)
+        return {snap.id: snap.to_dict() for snap in snaps if snap.exists}
+
+    def iter_month_scores(self, user_id, month):
+        return self._storage.iter_month_scores(user_id, month, transaction=self._transaction)
+
+    def iter_user_scores(self, user_id):
+        return self._storage.iter_user_scores(user_id, transaction=self._transaction)
+
+    def get_user_months(self, user_id, months):
+        refs = [self._storage._month_ref(user_id, month) for month in set(months)]
+        snaps = self._transaction.get_all(refs, **self._storage._rpc)
+        return {snap.id: snap.to_dict() for snap in snaps if snap.exists}
+
+    def get_doc(self, collection, doc_id):
+        ref = self._storage.db.collection(collection).document(doc_id)
+        snap = ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def set_user(self, user_id, fields):
+        self._transaction.set(self._storage._user_ref(user_id), fields, merge=True)
+
+    def set_score(self, user_id, date_id, fields):
+        self._transaction.set(self._storage._score_ref(user_id, date_id), fields, merge=True)
+
+    def set_user_month(self, user_id, month, fields):
+        self._transaction.set(self._storage._month_ref(user_id, month), fields, merge=True)
+
+    def set_doc(self, collection, doc_id, fields):
+        ref = self._storage.db.collection(collection).document(doc_id)
+        self._transaction.set(ref, fields, merge=True)
+
+
+class FirestoreStorage(Storage):
+    """
+    users/{userId}                  user documents
+    users/{userId}/scores/{date}    one document per daily score
+    users/{userId}/months/{YYYY-MM} monthly aggregates
+    {collection}/{docId}            bookkeeping documents
+    """
+
+    server_timestamp = SERVER_TIMESTAMP
+    transient_errors = TRANSIENT_ERRORS
+
+    def __init__(self, db=None, timeout: float = FIRESTORE_TIMEOUT):
+        self.db = db or get_db()
+        self._rpc = _rpc_options(timeout)
+
+    def _user_ref(self, user_id):
+        return self.db.collection("users").document(user_id)
+
+    def _score_ref(self, user_id, date_id):
+        return self._user_ref(user_id).collection("scores").document(date_id)
+
+    def _month_ref(self, user_id, month):
+        return self._user_ref(user_id).collection("months").document(month)
+
+    def get_user(self, user_id):
+        snap = self._user_ref(user_id).get(**self._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def iter_users(self, fields=None):
+        query = self.db.collection("users")
+        if fields:
+            query = query.select(fields)
+        for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def page_users(self, after_id, limit, fields=None):
+        query = self.db.collection("users")
+        if fields:
+            query = query.select(fields)
+        query = query.order_by(FieldPath.document_id()).limit(limit)
+        if after_id:
+            query = query.start_after({FieldPath.document_id(): after_id})
+        return [(doc.id, doc.to_dict() or {}) for doc in query.stream(**self._rpc)]
+
+    def set_user(self, user_id, fields):
+        self._user_ref(user_id).set(fields, merge=True, **self._rpc)
+
+    def set_users(self, updates):
+        batch = self.db.batch()
+        for user_id, fields in updates:
+            batch.set(self._user_ref(user_id), fields, merge=True)
+        batch.commit(**self._rpc)
+
+    def iter_leaderboard(self, limit=None, start_after=None):
+        query = _leaderboard_query(self.db.collection("users"), limit, start_after)
+        for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def count_users_ahead(self, total, user_id):
+        users_ref = self.db.collection("users")
+        above = users_ref.where(filter=FieldFilter("currentMonthTotal", ">", total))
+        ties_before = (
+            users_ref.where(filter=FieldFilter("currentMonthTotal", "==", total))
+                     .where(filter=FieldFilter(FieldPath.document_id(), "<", users_ref.document(user_id)))
+        )
+        return sum(query.count().get(**self._rpc)[0][0].value for query in (above, ties_before))
+
+    def iter_leaderboard_before(self, total, user_id, limit):
+        # Same ordering reversed, starting just past the user
+        query = (
+            self.db.collection("users")
+                .order_by("currentMonthTotal")
+                .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+                .start_after({"currentMonthTotal": total, FieldPath.document_id(): user_id})
+                .limit(limit)
+        )
+        for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def set_score(self, user_id, date_id, fields):
+        self._score_ref(user_id, date_id).set(fields, merge=True, **self._rpc)
+
+    def set_scores(self, updates):
+        batch = self.db.batch()
+        for user_id, date_id, fields in updates:
+            batch.set(self._score_ref(user_id, date_id), fields, merge=True)
+        batch.commit(**self._rpc)
+
+    def iter_month_scores(self, user_id, month, transaction=None):
+        query = _month_scores_query(self._user_ref(user_id), month)
+        for doc in query.stream(transaction=transaction, **self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def iter_user_scores(self, user_id, transaction=None):
+        query = self._user_ref(user_id).collection("scores").order_by(FieldPath.document_id())
+        for doc in query.stream(transaction=transaction, **self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def iter_user_months(self, user_id, limit=None):
+        query = self._user_ref(user_id).collection("months").order_by(
+            FieldPath.document_id(), direction=firestore.Query.DESCENDING
+        )
+        if limit:
+            query = query.limit(limit)
+        for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    def set_user_months(self, updates):
+        batch = self.db.batch()
+        for user_id, month, fields in updates:
+            batch.set(self._month_ref(user_id, month), fields, merge=True)
+        batch.commit(**self._rpc)
+
+    def get_doc(self, collection, doc_id):
+        snap = self.db.collection(collection).document(doc_id).get(**self._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def set_doc(self, collection, doc_id, fields):
+        self.db.collection(collection).document(doc_id).set(fields, merge=True, **self._rpc)
+
+    def increment_doc(self, collection, doc_id, field, amount=1):
+        self.db.collection(collection).document(doc_id).set(
+            {field: firestore.Increment(amount)}, merge=True, **self._rpc
+        )
+
+    def run_transaction(self, fn):
+        @firestore.transactional
+        def _run(transaction):
+            return fn(FirestoreTransaction(self, transaction))
+
+        return _run(self.db.transaction())
+
+
+class AsyncFirestoreTransaction(AsyncTransaction):
+    def __init__(self, storage, transaction):
+        self._storage = storage
+        self._transaction = transaction
+
+    async def get_user(self, user_id):
+        ref = self._storage._user_ref(user_id)
+        snap = await ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    async def get_score(self, user_id, date_id):
+        ref = self._storage._score_ref(user_id, date_id)
+        snap = await ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    async def get_scores(self, user_id, date_ids):
+        refs = [self._storage._score_ref(user_id, date_id) for date_id in set(date_ids)]
+        snaps = self._storage.db.get_all(
+            refs, transaction=self._transaction, **self._storage._rpc
+        )
+        return {snap.id: snap.to_dict() async for snap in snaps if snap.exists}
+
+    def iter_month_scores(self, user_id, month):
+        return self._storage.iter_month_scores(user_id, month, transaction=self._transaction)
+
+    def iter_user_scores(self, user_id):
+        return self._storage.iter_user_scores(user_id, transaction=self._transaction)
+
+    async def get_user_months(self, user_id, months):
+        refs = [self._storage._month_ref(user_id, month) for month in set(months)]
+        snaps = self._storage.db.get_all(
+            refs, transaction=self._transaction, **self._storage._rpc
+        )
+        return {snap.id: snap.to_dict() async for snap in snaps if snap.exists}
+
+    async def get_doc(self, collection, doc_id):
+        ref = self._storage.db.collection(collection).document(doc_id)
+        snap = await ref.get(transaction=self._transaction, **self._storage._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    def set_user(self, user_id, fields):
+        self._transaction.set(self._storage._user_ref(user_id), fields, merge=True)
+
+    def set_score(self, user_id, date_id, fields):
+        self._transaction.set(self._storage._score_ref(user_id, date_id), fields, merge=True)
+
+    def set_user_month(self, user_id, month, fields):
+        self._transaction.set(self._storage._month_ref(user_id, month), fields, merge=True)
+
+    def set_doc(self, collection, doc_id, fields):
+        ref = self._storage.db.collection(collection).document(doc_id)
+        self._transaction.set(ref, fields, merge=True)
+
+
+class AsyncFirestoreStorage(AsyncStorage):
+    """Same layout as FirestoreStorage, on the shared AsyncClient."""
+
+    server_timestamp = SERVER_TIMESTAMP
+    transient_errors = TRANSIENT_ERRORS
+
+    def __init__(self, db=None, timeout: float = FIRESTORE_TIMEOUT):
+        self.db = db or get_async_db()
+        self._rpc = _rpc_options(timeout)
+
+    def _user_ref(self, user_id):
+        return self.db.collection("users").document(user_id)
+
+    def _score_ref(self, user_id, date_id):
+        return self._user_ref(user_id).collection("scores").document(date_id)
+
+    def _month_ref(self, user_id, month):
+        return self._user_ref(user_id).collection("months").document(month)
+
+    async def get_user(self, user_id):
+        snap = await self._user_ref(user_id).get(**self._rpc)
+        return snap.to_dict() if snap.exists else None
+
+    async def iter_users(self, fields=None):
+        query = self.db.collection("users")
+        if fields:
+            query = query.select(fields)
+        async for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    async def iter_leaderboard(self, limit=None, start_after=None):
+        query = _leaderboard_query(self.db.collection("users"), limit, start_after)
+        async for doc in query.stream(**self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    async def iter_month_scores(self, user_id, month, transaction=None):
+        query = _month_scores_query(self._user_ref(user_id), month)
+        async for doc in query.stream(transaction=transaction, **self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    async def iter_user_scores(self, user_id, transaction=None):
+        query = self._user_ref(user_id).collection("scores").order_by(FieldPath.document_id())
+        async for doc in query.stream(transaction=transaction, **self._rpc):
+            yield doc.id, doc.to_dict() or {}
+
+    async def run_transaction(self, fn):
+        @firestore.async_transactional
+        async def _run(transaction):
+            return await fn(AsyncFirestoreTransaction(self, transaction))
+
+        return await _run(self.db.transaction())
@@ -0,0 +1,156 @@
+"""
+Idempotency keys for /submit.
+
+A client that sends `Idempotency-Key: <key>` gets the same result for
+every retry of that request within IDEMPOTENCY_TTL seconds, without the
+score being written or the summary recomputed again. Results are kept in
+a bounded in-process LRU keyed by (userId, date, key). A retry that
+arrives while the first attempt is still running waits for it (up to
+IDEMPOTENCY_WAIT seconds) instead of starting a second one; a failed
+attempt is forgotten so it can be retried.
+
+The cache belongs to one worker process. With several workers, a retry
+that reaches a different worker is submitted again: its writes are
+repeated, but the totals are not, since resubmitting a day replaces its
+score. Route retries to the same worker (or run one) for strict replay.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from config.settings import IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT
+from .utils import today_id
+
+# Longest Idempotency-Key accepted; clients usually send a UUID
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(ValueError):
+    """The key was already used for a different request body."""
+
+
+class IdempotencyInProgress(Exception):
+    """The first request with this key is still running after the wait."""
+
+
+def request_fingerprint(data: dict) -> str:
+    """Stable hash of a request body, to catch a key reused for other data."""
+    raw = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """
+    LRU of request results with expiry. Each entry is
+    (expires_at, fingerprint, future); the future is pending while the
+    first attempt runs.
+    """
+
+    def __init__(self, ttl: float, max_keys: int, wait: float = IDEMPOTENCY_WAIT):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait = wait
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _claim(self, key, fingerprint):
+        """Return (future, owner); owner is True if the caller must compute."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                if entry[1] != fingerprint:
+                    raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2], False
+
+            self.misses += 1
+            future = Future()
+            self._entries[key] = (now + self.ttl, fingerprint, future)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+            return future, True
+
+    def _forget(self, key, future, error):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] is future:
+                del self._entries[key]
+        future.set_exception(error)
+
+    def run(self, key, fingerprint, compute):
+        """Return (result, replayed)."""
+        future, owner = self._claim(key, fingerprint)
+        if not owner:
+            try:
+                return future.result(timeout=self.wait), True
+            except FutureTimeoutError:
+                raise IdempotencyInProgress("The first request with this Idempotency-Key is still running") from None
+        try:
+            result = compute()
+        except BaseException as e:
+            self._forget(key, future, e)
+            raise
+        future.set_result(result)
+        return result, False
+
+    async def run_async(self, key, fingerprint, compute):
+        """Async version of run(); compute is a coroutine function."""
+        future, owner = self._claim(key, fingerprint)
+        if not owner:
+            try:
+                # Shielded: timing out must not cancel the first attempt's future
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait), True
+            except asyncio.TimeoutError:
+                raise IdempotencyInProgress("The first request with this Idempotency-Key is still running") from None
+        try:
+            result = await compute()
+        except BaseException as e:
+            self._forget(key, future, e)
+            raise
+        future.set_result(result)
+        return result, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "ttlSeconds": self.ttl,
+            }
+
+
+_cache = IdempotencyCache(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS)
+
+
+def submission_key(data: dict, key: str):
+    """Cache key for a /submit body and its Idempotency-Key header."""
+    if len(key) > MAX_KEY_LENGTH:
+        raise ValueError(f"Idempotency-Key is longer than {MAX_KEY_LENGTH} characters")
+    return data["userId"], data.get("date") or today_id(), key
+
+
+def run_idempotent(key, data, compute):
+    """Run compute() once per key; returns (result, replayed)."""
+    return _cache.run(key, request_fingerprint(data), compute)
+
+
+async def run_idempotent_async(key, data, compute):
+    """Async version of run_idempotent."""
+    return await _cache.run_async(key, request_fingerprint(data), compute)
+
+
+def idempotency_stats():
+    return _cache.stats()
@@ -0,0 +1,175 @@
+"""
+Per-request and per-function storage accounting.
+
+The counting storage wrapper reports every call here with its Firestore
+read/write cost and round-trip time. Calls are added to every open scope
+in the current context: the request scope opened by the web app and any
+@instrumented service functions it is running. Finished scopes are rolled
+up into process-wide totals for /metrics.
+
+Scopes live in a ContextVar, so they follow asyncio tasks and
+asyncio.to_thread calls, and concurrent requests never mix.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+
+_scope = contextvars.ContextVar("storage_scope", default=None)
+
+
+class Scope:
+    """Storage cost of one request or function call."""
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.calls = 0
+        self.storage_seconds = 0.0
+        self.started = time.perf_counter()
+
+    def add(self, reads, writes, deletes, seconds):
+        self.reads += reads
+        self.writes += writes
+        self.deletes += deletes
+        self.calls += 1
+        self.storage_seconds += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def headers(self):
+        """Debug response headers describing this scope."""
+        return {
+            "X-Storage-Reads": str(self.reads),
+            "X-Storage-Writes": str(self.writes),
+            "X-Storage-Deletes": str(self.deletes),
+            "X-Storage-Calls": str(self.calls),
+            "X-Storage-Time-Ms": f"{self.storage_seconds * 1000:.1f}",
+        }
+
+
+class MetricsRegistry:
+    """Running totals per endpoint or function name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, name, scope: Scope, elapsed: float):
+        with self._lock:
+            entry = self._entries.setdefault(name, {
+                "count": 0, "reads": 0, "writes": 0, "deletes": 0, "storageCalls": 0,
+                "storageMs": 0.0, "totalMs": 0.0, "maxMs": 0.0, "maxReads": 0,
+            })
+            entry["count"] += 1
+            entry["reads"] += scope.reads
+            entry["writes"] += scope.writes
+            entry["deletes"] += scope.deletes
+            entry["storageCalls"] += scope.calls
+            entry["storageMs"] += scope.storage_seconds * 1000
+            entry["totalMs"] += elapsed * 1000
+            entry["maxMs"] = max(entry["maxMs"], elapsed * 1000)
+            entry["maxReads"] = max(entry["maxReads"], scope.reads)
+
+    def snapshot(self):
+        with self._lock:
+            entries = {name: dict(entry) for name, entry in self._entries.items()}
+        for entry in entries.values():
+            count = entry["count"]
+            entry["avgReads"] = round(entry["reads"] / count, 2)
+            entry["avgWrites"] = round(entry["writes"] / count, 2)
+            entry["avgMs"] = round(entry["totalMs"] / count, 3)
+            for key in ("storageMs", "totalMs", "maxMs"):
+                entry[key] = round(entry[key], 3)
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+endpoint_metrics = MetricsRegistry()
+function_metrics = MetricsRegistry()
+
+
+def record_storage_call(reads: int, writes: int, seconds: float, deletes: int = 0):
+    """Charge one storage call to every open scope in this context."""
+    scope = _scope.get()
+    while scope is not None:
+        scope.add(reads, writes, deletes, seconds)
+        scope = scope.parent
+
+
+def begin_request():
+    """
+    Open a fresh request scope (replacing any left over from an earlier
+    request on this thread) and return it.
+    """
+    scope = Scope()
+    _scope.set(scope)
+    return scope
+
+
+def end_request(name: str, scope: Scope):
+    """Roll a finished request scope into the per-endpoint totals."""
+    endpoint_metrics.record(name, scope, scope.elapsed())
+
+
+def instrumented(fn):
+    """Record a service function's storage cost and latency under its name."""
+    name = f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            scope = Scope(_scope.get())
+            token = _scope.set(scope)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _scope.reset(token)
+                function_metrics.record(name, scope, scope.elapsed())
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        scope = Scope(_scope.get())
+        token = _scope.set(scope)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _scope.reset(token)
+            function_metrics.record(name, scope, scope.elapsed())
+    return wrapper
+
+
+def metrics_snapshot():
+    """Everything /metrics serves."""
+    # Imported here: those modules are themselves instrumented
+    from .events import subscriber_count
+    from .idempotency import idempotency_stats
+    from .leaderboard import leaderboard_cache_stats
+    from .score_stats import day_sketch_stats
+    from .storage import get_storage
+    from .window_leaderboards import window_leaderboard_stats
+    from .write_coalescer import coalescer_stats
+
+    storage = get_storage()
+    counter = getattr(storage, "counter", None)
+    resilience = getattr(storage, "resilience", None)
+    return {
+        "endpoints": endpoint_metrics.snapshot(),
+        "functions": function_metrics.snapshot(),
+        "storageCalls": counter.snapshot() if counter else None,
+        "storageResilience": resilience.stats() if resilience else None,
+        "leaderboardCache": leaderboard_cache_stats(),
+        "windowLeaderboards": window_leaderboard_stats(),
+        "daySketches": day_sketch_stats(),
+        "idempotencyCache": idempotency_stats(),
+        "streamSubscribers": subscriber_count(),
+        "submitCoalescer": coalescer_stats(),
+    }
@@ -1,42 +1,381 @@
-from google.cloud import firestore
-from .firestore_client import get_db
+import asyncio
+import base64
+import json
+import threading
+import time
+from collections import OrderedDict
+from config.settings import LEADERBOARD_CACHE_TTL, SHARED_LEADERBOARD_INTERVAL, SHARED_LEADERBOARD_PATH
+from .data_version import current_version
+from .events import publish_reset
+from .instrumentation import instrumented
+from .shared_leaderboard import SnapshotPublisher, SnapshotReader
+from .storage import StorageUnavailable, get_async_storage, get_storage
+
+
+class LeaderboardCache:
+    """
+    Small in-process cache for computed leaderboards, keyed by limit.
+
+    Entries expire after `ttl` seconds and are dropped immediately by
+    invalidate(), which writers call whenever totals change. Callers that
+    pass a data version only get entries computed at that version or
+    later, so a page is never older than the ETag it is served under,
+    even after another process's write. The last
+    result computed for each key is also kept (up to `keep_last` keys)
+    and served, stale, while storage is unavailable.
+    """
+
+    def __init__(self, ttl: float, keep_last: int = 64):
+        self.ttl = ttl
+        self.keep_last = keep_last
+        self.hits = 0
+        self.misses = 0
+        self.stale_served = 0
+        self._entries = {}
+        self._last_good = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _lookup(self, key, version):
+        """Return (hit, value_or_generation)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now and (version is None or entry[2] >= version):
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, self._generation
+
+    def _store(self, key, generation, version, value):
+        with self._lock:
+            # Don't store a result that an invalidate() raced past
+            if generation == self._generation and self.ttl > 0:
+                self._entries[key] = (time.monotonic() + self.ttl, value, version or 0)
+            self._last_good[key] = value
+            self._last_good.move_to_end(key)
+            if len(self._last_good) > self.keep_last:
+                self._last_good.popitem(last=False)
+
+    def _stale(self, key, error):
+        with self._lock:
+            if key not in self._last_good:
+                raise error
+            self.stale_served += 1
+            return self._last_good[key]
+
+    def get(self, key, compute, version: int | None = None):
+        hit, value = self._lookup(key, version)
+        if hit:
+            return value
+        try:
+            result = compute()
+        except StorageUnavailable as e:
+            return self._stale(key, e)
+        self._store(key, value, version, result)
+        return result
+
+    async def get_async(self, key, compute, version: int | None = None):
+        hit, value = self._lookup(key, version)
+        if hit:
+            return value
+        try:
+            result = await compute()
+        except StorageUnavailable as e:
+            return self._stale(key, e)
+        self._store(key, value, version, result)
+        return result
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "staleServed": self.stale_served,
+                "ttlSeconds": self.ttl,
+            }
+
+
+_cache = LeaderboardCache(LEADERBOARD_CACHE_TTL)
+
+# (reader, publisher) once start_shared_leaderboard() has run
+_shared = None
+_shared_hits = 0
+# Wall-clock time of this process's last invalidate; snapshots built
+# before it may predate this process's own writes
+_invalidated_at = 0.0
+
+
+def _leaderboard_entry(rank, user_id, data):
+    current_total = data.get("currentMonthTotal", 0)
+    last_total = data.get("lastMonthTotal", 0)
+    avg_time = data.get("averageTime", 0)
+    username = data.get("username", user_id)
+
+    return {
+        "rank": rank,
+        "userId": user_id,
+        "username": username,
+        "currentMonthTotal": current_total,
+        "lastMonthTotal": last_total,
+        "averageTime": avg_time,
+    }
+
+
+def encode_cursor(total, user_id, rank):
+    """Opaque page cursor: the last row's sort key plus its rank."""
+    raw = json.dumps([total, user_id, rank], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        total, user_id, rank = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError("invalid leaderboard cursor") from e
+    if not isinstance(user_id, str) or not isinstance(rank, int):
+        raise ValueError("invalid leaderboard cursor")
+    return total, user_id, rank
+
+
+def _next_cursor(leaderboard, limit):
+    if limit and len(leaderboard) == limit:
+        last = leaderboard[-1]
+        return encode_cursor(last["currentMonthTotal"], last["userId"], last["rank"])
+    return None
+
+
+def _build_page(rows, limit, start_rank):
+    leaderboard = [
+        _leaderboard_entry(start_rank + i, user_id, data)
+        for i, (user_id, data) in enumerate(rows)
+    ]
+    return leaderboard, _next_cursor(leaderboard, limit)
+
+
+def _shared_page(limit, cursor, version):
+    """
+    The page from the cross-process snapshot, or None when there is no
+    usable one. A snapshot is served under the same rule as the in-process
+    cache: at most LEADERBOARD_CACHE_TTL old, built at `version` or later,
+    and never older than this process's own last write.
+    """
+    global _shared_hits
+    if _shared is None:
+        return None
+    snapshot = _shared[0].current()
+    if (snapshot is None or snapshot.version < version or snapshot.built_at <= _invalidated_at
+            or time.time() - snapshot.built_at > LEADERBOARD_CACHE_TTL):
+        return None
+
+    start = 0
+    if cursor:
+        total, user_id, rank = decode_cursor(cursor)
+        # Only continue from the snapshot if the cursor's row is where it says
+        anchor = snapshot.rows(rank - 1, rank)
+        if not anchor or (anchor[0]["userId"], anchor[0]["currentMonthTotal"]) != (user_id, total):
+            return None
+        start = rank
+
+    leaderboard = snapshot.rows(start, start + limit if limit else snapshot.count)
+    _shared_hits += 1
+    return leaderboard, _next_cursor(leaderboard, limit)
+
+
+def _query_leaderboard(limit: int | None = None, cursor: str | None = None):
+    start_after, start_rank = None, 1
+    if cursor:
+        total, user_id, rank = decode_cursor(cursor)
+        start_after, start_rank = (total, user_id), rank + 1
+
+    rows = get_storage().iter_leaderboard(limit, start_after)
+    return _build_page(rows, limit, start_rank)
+
+
+async def _query_leaderboard_async(limit: int | None = None, cursor: str | None = None):
+    start_after, start_rank = None, 1
+    if cursor:
+        total, user_id, rank = decode_cursor(cursor)
+        start_after, start_rank = (total, user_id), rank + 1
+
+    rows = [row async for row in get_async_storage().iter_leaderboard(limit, start_after)]
+    return _build_page(rows, limit, start_rank)
 
-db = get_db()
 
 def get_current_month_leaderboard(limit: int | None = None):
     """
     Returns a list of users sorted by currentMonthTotal (descending),
     with ranks calculated in Python.
+
+    Results are cached in memory for LEADERBOARD_CACHE_TTL seconds; the
+    returned list is shared between callers and must not be modified.
     """
-    users_ref = db.collection("users")
+    return get_leaderboard_page(limit)[0]
+
+
+@instrumented
+def get_leaderboard_page(limit: int | None = None, cursor: str | None = None):
+    """
+    Returns (entries, next_cursor) for one page of the leaderboard.
+
+    Pages are read with start_after on (currentMonthTotal, userId), so a
+    page costs O(limit) reads however deep it is. next_cursor is None on
+    the last page. Ranks are positions in the ordering. The page reflects
+    current_version() or later, so read that first for an ETag.
+    """
+    if cursor:
+        decode_cursor(cursor)
+    version = current_version()
+    shared = _shared_page(limit, cursor, version)
+    if shared is not None:
+        return shared
+    return _cache.get((limit, cursor), lambda: _query_leaderboard(limit, cursor), version)
+
 
-    # Order by currentMonthTotal descending; missing fields treated as 0 in our code
-    query = users_ref.order_by("currentMonthTotal", direction=firestore.Query.DESCENDING)
-    if limit:
-        query = query.limit(limit)
+async def get_current_month_leaderboard_async(limit: int | None = None):
+    """Async version of get_current_month_leaderboard, sharing its cache."""
+    return (await get_leaderboard_page_async(limit))[0]
 
-    docs = query.stream()
 
-    leaderboard = []
-    rank = 1
+@instrumented
+async def get_leaderboard_page_async(limit: int | None = None, cursor: str | None = None):
+    """Async version of get_leaderboard_page, sharing its cache."""
+    if cursor:
+        decode_cursor(cursor)
+    # Usually a cache hit, but a miss is a blocking storage read
+    version = await asyncio.to_thread(current_version)
+    # A local file read, no storage round trip
+    shared = _shared_page(limit, cursor, version)
+    if shared is not None:
+        return shared
+    return await _cache.get_async((limit, cursor), lambda: _query_leaderboard_async(limit, cursor), version)
 
-    for doc in docs:
-        data = doc.to_dict() or {}
-        current_total = data.get("currentMonthTotal", 0)
-        last_total = data.get("lastMonthTotal", 0)
-        avg_time = data.get("averageTime", 0)
-        username = data.get("username", doc.id)
 
-        leaderboard.append({
-            "rank": rank,
-            "userId": doc.id,
-            "username": username,
-            "currentMonthTotal": current_total,
-            "lastMonthTotal": last_total,
-            "averageTime": avg_time,
-        })
+def iter_leaderboard_entries(limit: int | None = None, cursor: str | None = None):
+    """
+    Yield leaderboard entries straight off the storage stream, uncached,
+    for streaming responses. (With RESILIENT_STORAGE the rows are read
+    whole first, so the read can be hedged.)
+    """
+    start_after, rank = None, 1
+    if cursor:
+        total, user_id, last_rank = decode_cursor(cursor)
+        start_after, rank = (total, user_id), last_rank + 1
 
+    for user_id, data in get_storage().iter_leaderboard(limit, start_after):
+        yield _leaderboard_entry(rank, user_id, data)
         rank += 1
 
-    return leaderboard
-    
\ No newline at end of file
+
+async def iter_leaderboard_entries_async(limit: int | None = None, cursor: str | None = None):
+    """Async version of iter_leaderboard_entries."""
+    start_after, rank = None, 1
+    if cursor:
+        total, user_id, last_rank = decode_cursor(cursor)
+        start_after, rank = (total, user_id), last_rank + 1
+
+    async for user_id, data in get_async_storage().iter_leaderboard(limit, start_after):
+        yield _leaderboard_entry(rank, user_id, data)
+        rank += 1
+
+
+@instrumented
+def get_rank_context(user_id: str, k: int = 3):
+    """
+    Returns a user's leaderboard position plus up to k neighbours above
+    and below, or None if the user isn't on the leaderboard.
+
+    The rank comes from count aggregations over currentMonthTotal and the
+    neighbours from two k-sized queries either side of the user, so the
+    cost doesn't grow with the number of users.
+    """
+    store = get_storage()
+    data = store.get_user(user_id)
+    if not data or "currentMonthTotal" not in data:
+        return None
+
+    total = data["currentMonthTotal"]
+    rank = store.count_users_ahead(total, user_id) + 1
+
+    above = list(store.iter_leaderboard_before(total, user_id, k)) if k else []
+    above.reverse()
+    below = list(store.iter_leaderboard(k, (total, user_id))) if k else []
+
+    rows = above + [(user_id, data)] + below
+    return {
+        "userId": user_id,
+        "rank": rank,
+        "entries": [
+            _leaderboard_entry(rank - len(above) + i, other_id, other)
+            for i, (other_id, other) in enumerate(rows)
+        ],
+    }
+
+
+def rank_of(user_id: str, total: int) -> int:
+    """
+    A user's place on the monthly leaderboard for a given total, from one
+    count aggregation. Users on 0 are ranked like everyone else, since
+    the leaderboard lists them too.
+    """
+    return get_storage().count_users_ahead(total, user_id) + 1
+
+
+def invalidate_leaderboard_cache():
+    """Drop cached leaderboards after a write that changes monthly totals."""
+    global _invalidated_at
+    _invalidated_at = time.time()
+    _cache.invalidate()
+
+
+def leaderboard_cache_stats():
+    """Return hit/miss counters for the leaderboard cache and shared snapshot."""
+    stats = _cache.stats()
+    if _shared is not None:
+        reader, publisher = _shared
+        snapshot = reader.current()
+        stats["shared"] = {
+            "path": reader.path,
+            "publisher": publisher.is_leader,
+            "publishes": publisher.publishes,
+            "hits": _shared_hits,
+            "version": snapshot.version if snapshot else None,
+            "rows": snapshot.count if snapshot else 0,
+            "ageSeconds": round(time.time() - snapshot.built_at, 3) if snapshot else None,
+        }
+    return stats
+
+
+def _build_snapshot():
+    # Version first: the snapshot may be newer than it claims, never older
+    version = current_version()
+    entries, _ = _query_leaderboard()
+    return version, entries
+
+
+def start_shared_leaderboard(path: str = SHARED_LEADERBOARD_PATH):
+    """
+    Serve leaderboard pages from the cross-process snapshot at `path`
+    (services/shared_leaderboard.py), and join the election for which
+    process publishes it. Every process also watches the snapshot and
+    tells its own SSE viewers to reload when another process's writes
+    show up in it. Called by the app factories; idempotent.
+    """
+    global _shared
+    if _shared is not None:
+        return
+    publisher = SnapshotPublisher(
+        path, SHARED_LEADERBOARD_INTERVAL, LEADERBOARD_CACHE_TTL, _build_snapshot, current_version
+    )
+    reader = SnapshotReader(path)
+    _shared = (reader, publisher)
+    publisher.start()
+    reader.watch(lambda version: publish_reset("update"), SHARED_LEADERBOARD_INTERVAL)
@@ -0,0 +1,163 @@
+"""
+Per-user monthly aggregates, users/{userId}/months/{YYYY-MM}.
+
+Each document keeps a small `days` map (one entry per date played that
+month) next to the figures derived from it, so a resubmitted day replaces
+its old entry and bestScore stays exact without rereading score documents.
+Submissions update them in the same transaction as the score, the monthly
+rollover marks the month it closes as finalized, and history/trend views
+read one document per month instead of every score.
+
+A score belongs to the month of its date id ("2025-01-14" -> "2025-01").
+"""
+from .instrumentation import instrumented
+from .storage import get_storage
+from .utils import month_date_range, month_of
+
+MAX_TREND_MONTHS = 60
+
+
+def _day_entry(score):
+    return {
+        "score": score.get("dailyScore", 0),
+        "time": score.get("timeSeconds", 0),
+        "mistakes": score.get("mistakes", 0),
+        "hints": score.get("hintsUsed", 0),
+    }
+
+
+def _summarise(days):
+    entries = days.values()
+    count = len(days)
+    total_time = sum(day["time"] for day in entries)
+    return {
+        "total": sum(day["score"] for day in entries),
+        "count": count,
+        "totalTime": total_time,
+        "avgTime": total_time / count if count else 0,
+        "bestScore": max((day["score"] for day in entries), default=0),
+        "mistakes": sum(day["mistakes"] for day in entries),
+        "hints": sum(day["hints"] for day in entries),
+    }
+
+
+def _month_fields(store, month, days):
+    return {"month": month, "days": days, **_summarise(days), "updatedAt": store.server_timestamp}
+
+
+def read_month_aggregates(txn, user_id, date_ids):
+    """
+    Transaction reads needed before update_month_aggregates: the existing
+    aggregates for every month touched, plus a scan of the month's scores
+    for any month that has no aggregate yet (data from before they existed).
+    Returns (month_docs, seeds).
+    """
+    months = {month_of(date_id) for date_id in date_ids}
+    month_docs = txn.get_user_months(user_id, list(months))
+    seeds = {
+        month: list(txn.iter_month_scores(user_id, month))
+        for month in months if month not in month_docs
+    }
+    return month_docs, seeds
+
+
+async def read_month_aggregates_async(txn, user_id, date_ids):
+    """Async twin of read_month_aggregates."""
+    months = {month_of(date_id) for date_id in date_ids}
+    month_docs = await txn.get_user_months(user_id, list(months))
+    seeds = {}
+    for month in months:
+        if month not in month_docs:
+            seeds[month] = [item async for item in txn.iter_month_scores(user_id, month)]
+    return month_docs, seeds
+
+
+def update_month_aggregates(txn, store, user_id, month_docs, seeds, items):
+    """
+    Fold (date_id, score fields) items into the month documents and write
+    the ones that changed or were seeded. Returns {month: days} for every
+    month read, for days_total().
+    """
+    days_by_month = {month: dict(doc.get("days", {})) for month, doc in month_docs.items()}
+    for month, scores in seeds.items():
+        days_by_month[month] = {date_id: _day_entry(score) for date_id, score in scores}
+
+    for date_id, fields in items:
+        days_by_month[month_of(date_id)][date_id] = _day_entry(fields)
+
+    for month in {month_of(date_id) for date_id, _ in items} | set(seeds):
+        txn.set_user_month(user_id, month, _month_fields(store, month, days_by_month[month]))
+    return days_by_month
+
+
+def days_total(days_by_month, first_date_id, last_date_id):
+    """Score total of the days in [first_date_id, last_date_id] (e.g. one week)."""
+    return sum(
+        day["score"]
+        for days in days_by_month.values()
+        for date_id, day in days.items()
+        if first_date_id <= date_id <= last_date_id
+    )
+
+
+@instrumented
+def rebuild_month_aggregate(user_id: str, month: str):
+    """
+    Repair/backfill mode: recompute one month's aggregate from its score
+    documents. Returns the summary that was written.
+    """
+    store = get_storage()
+    days = {
+        date_id: _day_entry(score)
+        for date_id, score in store.iter_month_scores(user_id, month)
+    }
+    fields = _month_fields(store, month, days)
+    store.set_user_months([(user_id, month, fields)])
+    return _summarise(days)
+
+
+def closing_month(data, month_key):
+    """
+    The month a rollover to month_key closes for a user document (the one
+    its running counters belong to), or None when there is nothing to
+    close, e.g. already rolled over and idle since.
+    """
+    month = data.get("summaryMonth")
+    played = data.get("currentMonthCount", 0) > 0 or data.get("currentMonthTotal", 0) > 0
+    return month if month and month < month_key and played else None
+
+
+def finalize_month_updates(store, closed):
+    """
+    Rollover helper: (user_id, month, fields) updates that mark each
+    (user_id, month, total) in `closed` finalized with its final total.
+    The rollover writes finalRank separately, from the leaderboard, before
+    any total is reset.
+    """
+    return [
+        (user_id, month, {
+            "finalized": True,
+            "finalTotal": total,
+            "finalizedAt": store.server_timestamp
+        })
+        for user_id, month, total in closed
+    ]
+
+
+def _trend_row(month, data):
+    row = {key: value for key, value in data.items() if key not in ("days", "updatedAt", "finalizedAt")}
+    row["month"] = month
+    row.setdefault("finalized", False)
+    return row
+
+
+@instrumented
+def get_user_trends(user_id: str, months: int = 12):
+    """
+    Return {"userId", "months": [...]} with the user's last `months`
+    monthly aggregates, oldest first. One read per month.
+    """
+    months = max(1, min(months, MAX_TREND_MONTHS))
+    rows = [_trend_row(month, data) for month, data in get_storage().iter_user_months(user_id, months)]
+    rows.reverse()
+    return {"userId": user_id, "months": rows}
@@ -1,34 +1,188 @@
-from google.cloud.firestore import SERVER_TIMESTAMP
-from .firestore_client import get_db
+import heapq
+import re
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import ROLLOVER_BATCH_SIZE, ROLLOVER_WORKERS
+from .data_version import bump_version
+from .events import publish_reset
+from .instrumentation import instrumented
+from .leaderboard import invalidate_leaderboard_cache
+from .monthly_aggregates import closing_month, finalize_month_updates
+from .storage import get_storage
+from .utils import month_of, previous_month, today_id
 
-db = get_db()
 
-def run_monthly_rollover():
+def _print_progress(processed, skipped):
+    print(f"Rolled over {processed} users ({skipped} already done)...")
+
+
+def _closing(store, users, rollover_id):
+    """
+    Yield (user_id, month, total, carried) for each of `users`: the month
+    rollover_id closes for them (None if nothing) and its total.
+
+    `carried` users already have counters for rollover_id, because they
+    submitted in the new month before the rollover reached them. Their
+    counters are left alone, and the month being closed is the one before
+    rollover_id, read back from its aggregate.
+    """
+    previous = previous_month(rollover_id)
+    for user_id, data in users:
+        if data.get("summaryMonth", "") >= rollover_id:
+            # Newest first: rollover_id's aggregate, then the closed month's
+            aggregate = dict(store.iter_user_months(user_id, 2)).get(previous) or {}
+            played = aggregate.get("count", 0) > 0
+            yield user_id, previous if played else None, aggregate.get("total", 0), True
+        else:
+            yield user_id, closing_month(data, rollover_id), data.get("currentMonthTotal", 0), False
+
+
+def _freeze_final_ranks(store, rollover_id, batch_size):
+    """
+    Record finalRank on the month aggregate each user is about to close:
+    their position by that month's total, before any total is reset. Ranks
+    are counted on read everywhere else, so this is the only place one is
+    stored. Safe to run again: the totals it ranks are still unchanged.
+
+    Carried users (see _closing) sit on the leaderboard by their new
+    month's total, so they are taken out of its order and merged back in
+    by the total of the month they close. There are few of them: only
+    those who submitted between midnight and the rollover.
+    """
+    carried = sorted(
+        (-total, user_id, month)
+        for user_id, month, total, is_carried in _closing(store, store.iter_leaderboard(), rollover_id)
+        if is_carried
+    )
+    others = (
+        (-total, user_id, month)
+        for user_id, month, total, is_carried in _closing(store, store.iter_leaderboard(), rollover_id)
+        if not is_carried
+    )
+
+    updates = []
+    for rank, (_, user_id, month) in enumerate(heapq.merge(carried, others), start=1):
+        if month:
+            updates.append((user_id, month, {"finalRank": rank}))
+        if len(updates) == batch_size:
+            store.set_user_months(updates)
+            updates = []
+    if updates:
+        store.set_user_months(updates)
+
+
+def _commit_chunk(store, users, rollover_id):
+    """Roll over one chunk of users in a single batched write."""
+    # Already rolled over by an earlier, interrupted run
+    users = [(user_id, data) for user_id, data in users if data.get("lastRolloverId") != rollover_id]
+    closing = list(_closing(store, users, rollover_id))
+
+    # Close the month aggregates first: lastRolloverId below marks the user
+    # done, and finalizing twice after a crash is harmless
+    month_updates = finalize_month_updates(
+        store, [(user_id, month, total) for user_id, month, total, _ in closing if month]
+    )
+    if month_updates:
+        store.set_user_months(month_updates)
+
+    updates = []
+    for user_id, _, total, carried in closing:
+        fields = {
+            "lastMonthTotal": total,
+            "lastRolloverId": rollover_id,
+            "updatedAt": store.server_timestamp
+        }
+        if not carried:
+            fields.update({
+                "currentMonthTotal": 0,
+                "averageTime": 0,
+                "currentMonthCount": 0,
+                "currentMonthTime": 0,
+            })
+        updates.append((user_id, fields))
+
+    if updates:
+        store.set_users(updates)
+    return len(updates)
+
+
+@instrumented
+def run_monthly_rollover(
+    rollover_id: str | None = None,
+    batch_size: int = ROLLOVER_BATCH_SIZE,
+    max_workers: int = ROLLOVER_WORKERS,
+    progress=_print_progress
+):
     """
     For every user:
       lastMonthTotal = currentMonthTotal
       currentMonthTotal = 0
       averageTime = 0
-      (optionally) currentRank = 0
+      running month counters = 0
+      months/{summaryMonth} finalized with the final total and rank
+
+    Users who already submitted in rollover_id keep their counters, which
+    belong to the new month; lastMonthTotal and the finalized month come
+    from the previous month's aggregate instead (see _closing).
+
+    Final ranks are taken from a walk of the leaderboard first, since
+    submissions count ranks on read instead of storing them.
+
+    Users are read in document-id order and written in batches of
+    batch_size, with up to max_workers batches committed in parallel.
+    After each wave of batches the last user id is saved to
+    rollovers/{rollover_id}, so a crashed run picks up where it stopped
+    when called again with the same id (defaults to the current month).
     """
-    users_ref = db.collection("users")
-    users = users_ref.stream()
+    store = get_storage()
+    # Same clock as today_id(), which dates submissions and their summaryMonth
+    rollover_id = rollover_id or month_of(today_id())
+    if not re.fullmatch(r"\d{4}-(0[1-9]|1[0-2])", rollover_id):
+        raise ValueError(f"rollover_id must be a 'YYYY-MM' month, got {rollover_id!r}")
+    checkpoint = store.get_doc("rollovers", rollover_id) or {}
+
+    if checkpoint.get("completed"):
+        print(f"Rollover {rollover_id} already completed for {checkpoint.get('processed', 0)} users.")
+        return checkpoint.get("processed", 0)
+
+    if not checkpoint.get("ranksFrozen"):
+        _freeze_final_ranks(store, rollover_id, batch_size)
+        store.set_doc("rollovers", rollover_id, {"ranksFrozen": True, "updatedAt": store.server_timestamp})
+
+    last_user_id = checkpoint.get("lastUserId")
+    processed = checkpoint.get("processed", 0)
+    skipped = 0
+    if last_user_id:
+        print(f"Resuming rollover {rollover_id} after user {last_user_id}")
+
+    wave_size = batch_size * max_workers
 
-    count = 0
-    for doc in users:
-        data = doc.to_dict() or {}
-        current_total = data.get("currentMonthTotal", 0)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            users = store.page_users(last_user_id, wave_size, fields=[
+                "currentMonthTotal", "currentMonthCount", "summaryMonth", "lastRolloverId"
+            ])
+            if not users:
+                break
 
-        print(f"Rolling over user {doc.id}: currentMonthTotal={current_total}")
+            chunks = [users[i:i + batch_size] for i in range(0, len(users), batch_size)]
+            written = sum(executor.map(lambda chunk: _commit_chunk(store, chunk, rollover_id), chunks))
 
-        doc.reference.set({
-            "lastMonthTotal": current_total,
-            "currentMonthTotal": 0,
-            "averageTime": 0,
-            "currentRank": 0,
-            "updatedAt": SERVER_TIMESTAMP
-        }, merge=True)
+            processed += written
+            skipped += len(users) - written
+            last_user_id = users[-1][0]
 
-        count += 1
+            store.set_doc("rollovers", rollover_id, {
+                "lastUserId": last_user_id,
+                "processed": processed,
+                "updatedAt": store.server_timestamp
+            })
+            bump_version()
+            if progress:
+                progress(processed, skipped)
 
-    print(f"Monthly rollover complete for {count} users.")
+    store.set_doc("rollovers", rollover_id, {"completed": True, "updatedAt": store.server_timestamp})
+    invalidate_leaderboard_cache()
+    bump_version()
+    publish_reset("rollover")
+    print(f"Monthly rollover complete for {processed} users.")
+    return processed
@@ -0,0 +1,486 @@
+"""
+Retries, hedged reads and a circuit breaker around the storage backend.
+
+get_storage()/get_async_storage() wrap the backend in these when
+RESILIENT_STORAGE is on. Per-RPC deadlines are set by the backend itself
+(FIRESTORE_TIMEOUT, with the client library's own retries off). This
+layer decides what happens when a call fails with one of the backend's
+`transient_errors`:
+
+  - It retries with full-jitter exponential backoff, while the attempt
+    count, the operation's overall STORAGE_DEADLINE and a process-wide
+    retry budget all allow it. Retries may add at most
+    STORAGE_RETRY_BUDGET extra calls per call, plus a small reserve, so
+    an outage doesn't turn into a retry storm.
+  - Leaderboard queries, pages and the full board alike, are hedged. If
+    the first attempt hasn't answered within LEADERBOARD_HEDGE_MS, a
+    duplicate is sent (paid from the same budget) and whichever answers
+    first wins. They are read whole, so a hedge or retry can't repeat rows.
+  - After BREAKER_FAILURES failed operations in a row, the circuit opens
+    and calls fail fast for BREAKER_COOLDOWN seconds. After that, one
+    trial call decides whether it closes again. A trial call that ends
+    any other way (a non-transient error, a stream closed early) counts
+    as failed.
+
+A call that gives up raises StorageUnavailable. The leaderboard cache
+then serves its last good page, and the web apps answer 503 everywhere
+else.
+
+Streams are retried only if they fail before the first row, so rows
+are never duplicated. Transactions are never retried here: a commit
+that timed out may still have applied, and not every transaction
+function is safe to apply twice.
+"""
+import asyncio
+import contextvars
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config.settings import (
+    BREAKER_COOLDOWN,
+    BREAKER_FAILURES,
+    LEADERBOARD_HEDGE_MS,
+    STORAGE_DEADLINE,
+    STORAGE_RETRY_ATTEMPTS,
+    STORAGE_RETRY_BASE_MS,
+    STORAGE_RETRY_BUDGET,
+)
+from .storage import AsyncStorage, Storage, StorageUnavailable
+
+# Longest single backoff sleep
+_MAX_BACKOFF = 2.0
+
+# Retries allowed up front, before the ratio has earned any
+_BUDGET_RESERVE = 10
+
+
+class RetryBudget:
+    """Token bucket: every call deposits `ratio` tokens, every retry or hedge costs 1."""
+
+    def __init__(self, ratio: float, reserve: float = _BUDGET_RESERVE):
+        self.ratio = ratio
+        self.reserve = reserve
+        self.spent = 0
+        self.denied = 0
+        self._tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.spent += 1
+                return True
+            self.denied += 1
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {"tokens": round(self._tokens, 2), "spent": self.spent, "denied": self.denied}
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures; one trial call after
+    `cooldown` seconds. allow() returns None to reject a call, 0 to let it
+    through, or the trial call's probe id, which abandon() takes.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.opened = 0
+        self.rejected = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        # Id of the trial call in flight, 0 when there is none
+        self._probing = 0
+        self._probes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> int | None:
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half-open"
+            if self.state == "half-open" and not self._probing:
+                self._probes += 1
+                self._probing = self._probes
+                return self._probing
+            self.rejected += 1
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive = 0
+            self._probing = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._record_failure()
+
+    def _record_failure(self):
+        self._consecutive += 1
+        self._probing = 0
+        if self.state == "half-open" or self._consecutive >= self.failures:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def abandon(self, probe: int | None):
+        """
+        A call ended without recording success or failure (a non-transient
+        error, a stream closed early). If it was the trial call, count it
+        as failed so that a later call can probe again.
+        """
+        with self._lock:
+            if probe and self._probing == probe:
+                self._record_failure()
+
+    def retry_after(self) -> int:
+        with self._lock:
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+        return max(1, int(remaining + 0.999))
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+class ResiliencePolicy:
+    """Retry/hedge/breaker settings and counters, shared by the sync and async wrappers."""
+
+    def __init__(self, transient_errors, attempts=STORAGE_RETRY_ATTEMPTS,
+                 base_delay=STORAGE_RETRY_BASE_MS / 1000, deadline=STORAGE_DEADLINE,
+                 hedge_after=LEADERBOARD_HEDGE_MS / 1000, budget=None, breaker=None):
+        self.transient_errors = tuple(transient_errors)
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.budget = budget or RetryBudget(STORAGE_RETRY_BUDGET)
+        self.breaker = breaker or CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def admit(self, op):
+        """
+        Breaker check and budget deposit at the start of an operation.
+        Returns the breaker's probe id, for abandon() if the call ends
+        some other way.
+        """
+        probe = self.breaker.allow()
+        if probe is None:
+            raise StorageUnavailable(f"{op}: storage circuit is open", self.breaker.retry_after())
+        self.budget.deposit()
+        return probe
+
+    def backoff(self, op, attempt, started, error):
+        """
+        Seconds to sleep before retry number `attempt`, or raise
+        StorageUnavailable if this operation has to give up.
+        """
+        delay = random.uniform(0, min(_MAX_BACKOFF, self.base_delay * 2 ** attempt))
+        out_of_time = time.monotonic() - started + delay > self.deadline
+        if attempt >= self.attempts or out_of_time or not self.budget.withdraw():
+            self.breaker.record_failure()
+            raise StorageUnavailable(f"{op} failed: {error}", self.breaker.retry_after()) from error
+        self.retries += 1
+        return delay
+
+    def fail(self, op, error):
+        self.breaker.record_failure()
+        return StorageUnavailable(f"{op} failed: {error}", self.breaker.retry_after())
+
+    def stats(self):
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedgeWins": self.hedge_wins,
+            "retryBudget": self.budget.stats(),
+            "breaker": self.breaker.stats(),
+        }
+
+
+class ResilientStorage(Storage):
+    """Storage wrapper applying a ResiliencePolicy to every call."""
+
+    def __init__(self, storage: Storage, policy: ResiliencePolicy | None = None):
+        self.storage = storage
+        self.resilience = policy or ResiliencePolicy(storage.transient_errors)
+        self.server_timestamp = storage.server_timestamp
+        self.transient_errors = storage.transient_errors
+        # /metrics reads the counting wrapper's totals through this one
+        self.counter = getattr(storage, "counter", None)
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="storage-hedge")
+
+    def _call(self, op, fn):
+        policy = self.resilience
+        probe = policy.admit(op)
+        try:
+            started, attempt = time.monotonic(), 0
+            while True:
+                try:
+                    result = fn()
+                except policy.transient_errors as e:
+                    attempt += 1
+                    time.sleep(policy.backoff(op, attempt, started, e))
+                    continue
+                policy.breaker.record_success()
+                return result
+        except BaseException:
+            policy.breaker.abandon(probe)
+            raise
+
+    def _stream(self, op, make_rows):
+        policy = self.resilience
+        probe = policy.admit(op)
+        try:
+            started, attempt = time.monotonic(), 0
+            while True:
+                rows = iter(make_rows())
+                try:
+                    first = next(rows)
+                except StopIteration:
+                    policy.breaker.record_success()
+                    return
+                except policy.transient_errors as e:
+                    attempt += 1
+                    time.sleep(policy.backoff(op, attempt, started, e))
+                    continue
+                break
+
+            yield first
+            try:
+                yield from rows
+            except policy.transient_errors as e:
+                # Rows were already handed out; retrying would repeat them
+                raise policy.fail(op, e) from e
+            policy.breaker.record_success()
+        except BaseException:
+            # Includes GeneratorExit when the caller stops reading early
+            policy.breaker.abandon(probe)
+            raise
+
+    def _hedged(self, op, fn):
+        """Run fn, and a duplicate if it's slow; the first success wins."""
+        policy = self.resilience
+        first = self._pool.submit(contextvars.copy_context().run, fn)
+        futures = {first}
+        done, _ = wait(futures, timeout=policy.hedge_after)
+        if not done and policy.budget.withdraw():
+            policy.hedges += 1
+            futures.add(self._pool.submit(contextvars.copy_context().run, fn))
+
+        error = None
+        pending = futures
+        while pending:
+            done, pending = wait(pending, timeout=policy.deadline, return_when=FIRST_COMPLETED)
+            if not done:
+                raise policy.fail(op, TimeoutError("storage call passed its deadline"))
+            for future in done:
+                if future.exception() is None:
+                    if future is not first:
+                        policy.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    # --- users -------------------------------------------------------------
+
+    def get_user(self, user_id):
+        return self._call("get_user", lambda: self.storage.get_user(user_id))
+
+    def iter_users(self, fields=None):
+        return self._stream("iter_users", lambda: self.storage.iter_users(fields))
+
+    def page_users(self, after_id, limit, fields=None):
+        return self._call("page_users", lambda: self.storage.page_users(after_id, limit, fields))
+
+    def set_user(self, user_id, fields):
+        self._call("set_user", lambda: self.storage.set_user(user_id, fields))
+
+    def set_users(self, updates):
+        self._call("set_users", lambda: self.storage.set_users(updates))
+
+    def iter_leaderboard(self, limit=None, start_after=None):
+        # Read whole, so a hedge or retry can't repeat rows
+        return self._call("iter_leaderboard", lambda: self._hedged(
+            "iter_leaderboard", lambda: list(self.storage.iter_leaderboard(limit, start_after))
+        ))
+
+    def count_users_ahead(self, total, user_id):
+        return self._call("count_users_ahead", lambda: self.storage.count_users_ahead(total, user_id))
+
+    def iter_leaderboard_before(self, total, user_id, limit):
+        return self._stream(
+            "iter_leaderboard_before", lambda: self.storage.iter_leaderboard_before(total, user_id, limit)
+        )
+
+    # --- daily scores ------------------------------------------------------
+
+    def set_score(self, user_id, date_id, fields):
+        self._call("set_score", lambda: self.storage.set_score(user_id, date_id, fields))
+
+    def set_scores(self, updates):
+        self._call("set_scores", lambda: self.storage.set_scores(updates))
+
+    def iter_month_scores(self, user_id, month):
+        return self._stream("iter_month_scores", lambda: self.storage.iter_month_scores(user_id, month))
+
+    def iter_user_scores(self, user_id):
+        return self._stream("iter_user_scores", lambda: self.storage.iter_user_scores(user_id))
+
+    # --- monthly aggregates ------------------------------------------------
+
+    def iter_user_months(self, user_id, limit=None):
+        return self._stream("iter_user_months", lambda: self.storage.iter_user_months(user_id, limit))
+
+    def set_user_months(self, updates):
+        self._call("set_user_months", lambda: self.storage.set_user_months(updates))
+
+    # --- bookkeeping documents ---------------------------------------------
+
+    def get_doc(self, collection, doc_id):
+        return self._call("get_doc", lambda: self.storage.get_doc(collection, doc_id))
+
+    def set_doc(self, collection, doc_id, fields):
+        self._call("set_doc", lambda: self.storage.set_doc(collection, doc_id, fields))
+
+    def increment_doc(self, collection, doc_id, field, amount=1):
+        # Only ever used for the data version, where a doubled bump is harmless
+        self._call("increment_doc", lambda: self.storage.increment_doc(collection, doc_id, field, amount))
+
+    # --- transactions ------------------------------------------------------
+
+    def run_transaction(self, fn):
+        policy = self.resilience
+        probe = policy.admit("run_transaction")
+        try:
+            result = self.storage.run_transaction(fn)
+        except policy.transient_errors as e:
+            raise policy.fail("run_transaction", e) from e
+        except BaseException:
+            policy.breaker.abandon(probe)
+            raise
+        policy.breaker.record_success()
+        return result
+
+
+class ResilientAsyncStorage(AsyncStorage):
+    """Async twin of ResilientStorage; hedges are cancelled when they lose."""
+
+    def __init__(self, storage: AsyncStorage, policy: ResiliencePolicy | None = None):
+        self.storage = storage
+        self.resilience = policy or ResiliencePolicy(storage.transient_errors)
+        self.server_timestamp = storage.server_timestamp
+        self.transient_errors = storage.transient_errors
+        self.counter = getattr(storage, "counter", None)
+
+    async def _call(self, op, make_awaitable):
+        policy = self.resilience
+        probe = policy.admit(op)
+        try:
+            started, attempt = time.monotonic(), 0
+            while True:
+                try:
+                    result = await asyncio.wait_for(make_awaitable(), policy.deadline)
+                except (*policy.transient_errors, asyncio.TimeoutError) as e:
+                    attempt += 1
+                    await asyncio.sleep(policy.backoff(op, attempt, started, e))
+                    continue
+                policy.breaker.record_success()
+                return result
+        except BaseException:
+            policy.breaker.abandon(probe)
+            raise
+
+    async def _stream(self, op, make_rows):
+        policy = self.resilience
+        probe = policy.admit(op)
+        try:
+            started, attempt = time.monotonic(), 0
+            while True:
+                rows = make_rows().__aiter__()
+                try:
+                    first = await rows.__anext__()
+                except StopAsyncIteration:
+                    policy.breaker.record_success()
+                    return
+                except policy.transient_errors as e:
+                    attempt += 1
+                    await asyncio.sleep(policy.backoff(op, attempt, started, e))
+                    continue
+                break
+
+            yield first
+            try:
+                async for row in rows:
+                    yield row
+            except policy.transient_errors as e:
+                raise policy.fail(op, e) from e
+            policy.breaker.record_success()
+        except BaseException:
+            policy.breaker.abandon(probe)
+            raise
+
+    async def _hedged(self, make_coroutine):
+        policy = self.resilience
+        first = asyncio.ensure_future(make_coroutine())
+        tasks = {first}
+        done, _ = await asyncio.wait(tasks, timeout=policy.hedge_after)
+        if not done and policy.budget.withdraw():
+            policy.hedges += 1
+            tasks.add(asyncio.ensure_future(make_coroutine()))
+
+        error = None
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            policy.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_user(self, user_id):
+        return await self._call("get_user", lambda: self.storage.get_user(user_id))
+
+    def iter_users(self, fields=None):
+        return self._stream("iter_users", lambda: self.storage.iter_users(fields))
+
+    async def iter_leaderboard(self, limit=None, start_after=None):
+        async def _read():
+            return [row async for row in self.storage.iter_leaderboard(limit, start_after)]
+
+        rows = await self._call("iter_leaderboard", lambda: self._hedged(_read))
+        for row in rows:
+            yield row
+
+    async def run_transaction(self, fn):
+        policy = self.resilience
+        probe = policy.admit("run_transaction")
+        try:
+            result = await self.storage.run_transaction(fn)
+        except policy.transient_errors as e:
+            raise policy.fail("run_transaction", e) from e
+        except BaseException:
+            policy.breaker.abandon(probe)
+            raise
+        policy.breaker.record_success()
+        return result
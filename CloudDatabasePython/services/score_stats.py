@@ -0,0 +1,252 @@
+"""
+Score and solve-time percentiles for the stats page.
+
+Two kinds of sketch document (services/sketches.py) live in the
+`sketches` collection:
+
+  user-{userId}        every score the user has. The submission
+                       transactions fold it in next to allTimeTotal and
+                       seed it from the same one-off scan of their scores.
+  day-{date}-{shard}   everyone's score for one day, spread over
+                       SKETCH_SHARDS documents. _after_summary_change moves
+                       a submission into one random shard in a small
+                       transaction of its own; reading the day merges them.
+                       Scores are counted exactly (ScoreHistogram, field
+                       `scores`), so "you beat N%" only treats equal
+                       scores as ties; times are a sketch.
+
+This month's percentiles come straight from the month aggregate's days,
+which are exact. Day sketches are keyed by date, so the monthly rollover
+has nothing to reset: a new day starts empty and old days stay readable.
+Days played before the sketches existed are missing from the day
+sketches; record_day_sketches() only sees new submissions. Day shards
+written before the exact `scores` field have only a `score` sketch, which
+is ignored.
+"""
+import logging
+import math
+import random
+from config.settings import LEADERBOARD_CACHE_TTL, SKETCH_ACCURACY, SKETCH_SHARDS
+from .instrumentation import instrumented
+from .leaderboard import LeaderboardCache
+from .sketches import ScoreHistogram, ScoreSketch
+from .storage import get_storage
+from .utils import month_of, today_id
+
+logger = logging.getLogger(__name__)
+
+SKETCH_COLLECTION = "sketches"
+
+PERCENTILES = (50, 90)
+
+_day_cache = LeaderboardCache(LEADERBOARD_CACHE_TTL)
+
+
+def _user_sketch_id(user_id):
+    return f"user-{user_id}"
+
+
+def _day_sketch_id(date_id, shard):
+    return f"day-{date_id}-{shard}"
+
+
+def _load(doc):
+    doc = doc or {}
+    return (ScoreSketch.from_dict(doc.get("score"), SKETCH_ACCURACY),
+            ScoreSketch.from_dict(doc.get("time"), SKETCH_ACCURACY))
+
+
+def _load_day(doc):
+    doc = doc or {}
+    return (ScoreHistogram.from_dict(doc.get("scores")),
+            ScoreSketch.from_dict(doc.get("time"), SKETCH_ACCURACY))
+
+
+def _apply(score, time, changes):
+    for _, old, new in changes:
+        if old is not None:
+            score.remove(old.get("dailyScore", 0))
+            time.remove(old.get("timeSeconds", 0))
+        score.add(new["dailyScore"])
+        time.add(new["timeSeconds"])
+
+
+def _fold(doc, changes):
+    """Sketch document fields with (date_id, old, new) score changes applied."""
+    score, time = _load(doc)
+    _apply(score, time, changes)
+    return {"score": score.to_dict(), "time": time.to_dict()}
+
+
+def _fold_day(doc, changes):
+    """Day shard fields with (date_id, old, new) score changes applied."""
+    score, time = _load_day(doc)
+    _apply(score, time, changes)
+    return {"scores": score.to_dict(), "time": time.to_dict()}
+
+
+def score_changes(old_scores, items):
+    """
+    (date_id, old, new) for writing (date_id, fields) items, in order, over
+    old_scores; a date repeated in items replaces its own earlier entry.
+    """
+    old_scores = dict(old_scores)
+    changes = []
+    for date_id, fields in items:
+        changes.append((date_id, old_scores.get(date_id), fields))
+        old_scores[date_id] = fields
+    return changes
+
+
+def read_user_sketch(txn, user_id):
+    """Transaction read needed before write_user_sketch."""
+    return txn.get_doc(SKETCH_COLLECTION, _user_sketch_id(user_id))
+
+
+async def read_user_sketch_async(txn, user_id):
+    """Async twin of read_user_sketch."""
+    return await txn.get_doc(SKETCH_COLLECTION, _user_sketch_id(user_id))
+
+
+def write_user_sketch(txn, store, user_id, sketch_doc, history, changes):
+    """
+    Fold score changes into the user's sketch document. A missing document
+    is first seeded from `history`, the (date_id, score) pairs the user had
+    before the changes.
+    """
+    if sketch_doc is None:
+        sketch_doc = _fold(None, [(date_id, None, data) for date_id, data in history])
+    txn.set_doc(SKETCH_COLLECTION, _user_sketch_id(user_id), {
+        **_fold(sketch_doc, changes),
+        "updatedAt": store.server_timestamp
+    })
+
+
+def rebuild_user_sketch(store, user_id, scores):
+    """Repair mode: rewrite the user's sketch from (date_id, score) pairs."""
+    store.set_doc(SKETCH_COLLECTION, _user_sketch_id(user_id), {
+        **_fold(None, [(date_id, None, data) for date_id, data in scores]),
+        "updatedAt": store.server_timestamp
+    })
+
+
+@instrumented
+def record_day_sketches(changes, shards: int = SKETCH_SHARDS):
+    """
+    Fold committed (date_id, old, new) score changes into one random
+    shard of each day's sketch.
+    """
+    if not changes:
+        return
+    store = get_storage()
+    shard = random.randrange(shards)
+    by_date = {}
+    for change in changes:
+        by_date.setdefault(change[0], []).append(change)
+
+    def _update(txn):
+        docs = {
+            date_id: txn.get_doc(SKETCH_COLLECTION, _day_sketch_id(date_id, shard))
+            for date_id in by_date
+        }
+        for date_id, doc in docs.items():
+            txn.set_doc(SKETCH_COLLECTION, _day_sketch_id(date_id, shard), {
+                **_fold_day(doc, by_date[date_id]),
+                "date": date_id,
+                "updatedAt": store.server_timestamp
+            })
+
+    try:
+        store.run_transaction(_update)
+    except Exception:
+        # The submission itself is committed; it is only missing from the day's percentiles
+        logger.exception("Updating the day sketches for %s failed", ", ".join(by_date))
+    finally:
+        _day_cache.invalidate()
+
+
+def _read_day(date_id, shards):
+    store = get_storage()
+    score, time = _load_day(None)
+    for shard in range(shards):
+        shard_score, shard_time = _load_day(store.get_doc(SKETCH_COLLECTION, _day_sketch_id(date_id, shard)))
+        score.merge(shard_score)
+        time.merge(shard_time)
+    return score, time
+
+
+def get_day_sketches(date_id: str, shards: int = SKETCH_SHARDS):
+    """
+    (ScoreHistogram, time ScoreSketch) of everyone who played date_id;
+    SKETCH_SHARDS reads, cached.
+    """
+    return _day_cache.get(date_id, lambda: _read_day(date_id, shards))
+
+
+def _rounded(value):
+    return round(value, 1) if value is not None else None
+
+
+def _sketch_percentiles(sketch):
+    return {f"p{p}": _rounded(sketch.quantile(p / 100)) for p in PERCENTILES}
+
+
+def _exact_percentiles(values):
+    """Same rank rule as ScoreSketch.quantile, on the values themselves."""
+    values = sorted(values)
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {f"p{p}": values[math.floor(p / 100 * (len(values) - 1))] for p in PERCENTILES}
+
+
+def _today(date_id, entry):
+    score, _ = get_day_sketches(date_id)
+    players = score.count
+    others = players - 1
+    beaten = score.count_below(entry["score"])
+    return {
+        "date": date_id,
+        "dailyScore": entry["score"],
+        "timeSeconds": entry["time"],
+        "players": players,
+        # Equal scores are ties, not beaten
+        "beatPercent": round(100 * beaten / others, 1) if others > 0 else 0.0,
+    }
+
+
+@instrumented
+def get_user_stats(user_id: str):
+    """
+    Return {"userId", "allTime", "month", "today"}: p50/p90 of the user's
+    daily score and solve time over all time and this month, and how
+    today's score compares with everyone who played today ("today" is
+    None if they haven't). Two reads plus the day's shards, however many
+    scores there are.
+    """
+    store = get_storage()
+    date_id = today_id()
+    month = month_of(date_id)
+
+    score, time = _load(store.get_doc(SKETCH_COLLECTION, _user_sketch_id(user_id)))
+    latest = dict(store.iter_user_months(user_id, 1))
+    days = latest.get(month, {}).get("days", {})
+
+    return {
+        "userId": user_id,
+        "allTime": {
+            "count": score.count,
+            "dailyScore": _sketch_percentiles(score),
+            "timeSeconds": _sketch_percentiles(time),
+        },
+        "month": {
+            "month": month,
+            "count": len(days),
+            "dailyScore": _exact_percentiles(day["score"] for day in days.values()),
+            "timeSeconds": _exact_percentiles(day["time"] for day in days.values()),
+        },
+        "today": _today(date_id, days[date_id]) if date_id in days else None,
+    }
+
+
+def day_sketch_stats():
+    return _day_cache.stats()
@@ -1,9 +1,62 @@
-def calculate_daily_score(time_seconds, mistakes, hints_used, difficulty):
+# Scoring formulas by version. Old versions stay here so history scored
+# with them can be reproduced; bump CURRENT_SCORING_VERSION to switch.
+SCORING_FORMULAS = {
+    1: {"base": 1000, "time": 0.5, "mistake": 50, "hint": 25, "difficulty": 10},
+}
+CURRENT_SCORING_VERSION = 1
+
+
+def calculate_daily_score(time_seconds, mistakes, hints_used, difficulty,
+                          version=CURRENT_SCORING_VERSION):
+    f = SCORING_FORMULAS[version]
     score = (
-        1000
-        - (time_seconds * 0.5)
-        - (50 * mistakes)
-        - (25 * hints_used)
-        + (10 * difficulty)
+        f["base"]
+        - (time_seconds * f["time"])
+        - (f["mistake"] * mistakes)
+        - (f["hint"] * hints_used)
+        + (f["difficulty"] * difficulty)
     )
     return max(int(score), 0)
+
+
+def calculate_daily_scores(time_seconds, mistakes, hints_used, difficulty,
+                           version=CURRENT_SCORING_VERSION):
+    """
+    Vectorised calculate_daily_score over equal-length arrays (or lists).
+
+    Uses the same float64 arithmetic in the same order, then truncates
+    toward zero and clamps at 0, so every element matches the scalar
+    function exactly. Returns a numpy int64 array.
+    """
+    import numpy as np
+
+    f = SCORING_FORMULAS[version]
+    t = np.asarray(time_seconds, dtype=np.float64)
+    m = np.asarray(mistakes, dtype=np.float64)
+    h = np.asarray(hints_used, dtype=np.float64)
+    d = np.asarray(difficulty, dtype=np.float64)
+
+    score = (
+        f["base"]
+        - (t * f["time"])
+        - (f["mistake"] * m)
+        - (f["hint"] * h)
+        + (f["difficulty"] * d)
+    )
+    return np.maximum(np.trunc(score), 0).astype(np.int64)
+
+
+def rescore(rows, version=CURRENT_SCORING_VERSION):
+    """
+    Re-score a columnar batch of history, e.g. after a formula change.
+
+    `rows` maps timeSeconds/mistakes/hintsUsed/difficulty to arrays, as
+    stored on score documents. Returns the new dailyScore array.
+    """
+    return calculate_daily_scores(
+        rows["timeSeconds"],
+        rows["mistakes"],
+        rows["hintsUsed"],
+        rows["difficulty"],
+        version=version
+    )
@@ -0,0 +1,189 @@
+"""
+Cross-process leaderboard snapshot for multi-worker deployments.
+
+One worker (whichever holds an exclusive flock on `<path>.lock`) is the
+publisher: whenever the data version changes, or its snapshot is half a
+cache TTL old, it reads the whole ranked leaderboard once and writes it
+to `<path>`. Every worker, the publisher included, maps that file with
+mmap and serves leaderboard pages straight out of it. Adding workers
+therefore doesn't add leaderboard queries. If the publisher dies, its
+lock is released and another worker takes over on its next tick.
+
+File layout (little-endian):
+
+    header   magic "CSE310LB", data version (int64), row count (uint64),
+             build start time (float64, Unix seconds)
+    offsets  row count + 1 uint64 byte offsets into the payload
+    payload  one compact JSON leaderboard entry per row, in rank order
+
+Readers decode only the rows of the page they serve. The file is
+replaced atomically (write to a temp file, then rename), so a reader
+holding the old mapping keeps a consistent view until it remaps.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_MAGIC = b"CSE310LB"
+_HEADER = struct.Struct("<8sqQd")
+_OFFSET = struct.Struct("<Q")
+
+
+def write_snapshot(path: str, version: int, built_at: float, entries: list[dict]):
+    """Atomically replace the snapshot at `path` with `entries`."""
+    rows = [json.dumps(entry, separators=(",", ":")).encode() for entry in entries]
+    offsets, position = [], 0
+    for row in rows:
+        offsets.append(position)
+        position += len(row)
+    offsets.append(position)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, version, len(rows), built_at))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        f.writelines(rows)
+    os.replace(tmp_path, path)
+
+
+class Snapshot:
+    """A mapped snapshot file; rows are decoded on demand."""
+
+    def __init__(self, fileno: int):
+        self._map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count, self.built_at = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a leaderboard snapshot")
+        self._payload = _HEADER.size + _OFFSET.size * (self.count + 1)
+
+    def _offset(self, index):
+        return _OFFSET.unpack_from(self._map, _HEADER.size + _OFFSET.size * index)[0]
+
+    def rows(self, start: int, stop: int) -> list[dict]:
+        """Decode entries [start, stop)."""
+        start, stop = max(start, 0), min(stop, self.count)
+        if start >= stop:
+            return []
+        begin = self._payload + self._offset(start)
+        entries = []
+        for index in range(start, stop):
+            end = self._payload + self._offset(index + 1)
+            entries.append(json.loads(self._map[begin:end]))
+            begin = end
+        return entries
+
+
+class SnapshotReader:
+    """Keeps the newest snapshot at `path` mapped, remapping when it's replaced."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._identity = None
+
+    def current(self) -> Snapshot | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if identity != self._identity:
+                try:
+                    with open(self.path, "rb") as f:
+                        self._snapshot = Snapshot(f.fileno())
+                    self._identity = identity
+                except (OSError, ValueError, struct.error):
+                    # Caught mid-replace or corrupt; try again next call
+                    return self._snapshot
+            return self._snapshot
+
+    def watch(self, on_change, interval: float):
+        """
+        Call on_change(version) from a daemon thread whenever a snapshot
+        with a newer data version is published, by this process or any
+        other. Costs a stat() per interval, no storage reads.
+        """
+        def _run():
+            seen = None
+            while True:
+                try:
+                    snapshot = self.current()
+                    if snapshot is not None:
+                        if seen is not None and snapshot.version > seen:
+                            on_change(snapshot.version)
+                        seen = snapshot.version if seen is None else max(seen, snapshot.version)
+                except Exception:
+                    logger.exception("Watching the shared leaderboard failed")
+                time.sleep(interval)
+
+        threading.Thread(target=_run, name="leaderboard-watcher", daemon=True).start()
+
+
+class SnapshotPublisher:
+    """
+    Daemon thread that competes for the publisher lock and, while holding
+    it, keeps the snapshot current. `build()` returns (version, entries)
+    and `version()` the current data version.
+    """
+
+    def __init__(self, path: str, interval: float, max_age: float, build, version):
+        self.path = path
+        self.interval = interval
+        self.max_age = max_age
+        self.publishes = 0
+        self._build = build
+        self._version = version
+        self._lock_file = None
+        self._published = None  # (version, built_at)
+
+    @property
+    def is_leader(self):
+        return self._lock_file is not None
+
+    def start(self):
+        threading.Thread(target=self._run, name="leaderboard-publisher", daemon=True).start()
+
+    def _try_lead(self):
+        import fcntl  # Unix only, like the multi-worker deployment itself
+
+        lock_file = open(f"{self.path}.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info("Process %d is publishing the shared leaderboard", os.getpid())
+        return True
+
+    def _due(self):
+        if self._published is None:
+            return True
+        version, built_at = self._published
+        return version != self._version() or time.time() - built_at >= self.max_age / 2
+
+    def publish(self):
+        # Start time is taken before the query, so it never postdates data
+        built_at = time.time()
+        version, entries = self._build()
+        write_snapshot(self.path, version, built_at, entries)
+        self._published = (version, built_at)
+        self.publishes += 1
+
+    def _run(self):
+        while True:
+            try:
+                if self.is_leader or self._try_lead():
+                    if self._due():
+                        self.publish()
+            except Exception:
+                logger.exception("Publishing the shared leaderboard failed")
+            time.sleep(self.interval)
@@ -0,0 +1,174 @@
+"""
+Mergeable quantile sketch for daily scores and solve times.
+
+A log-bucketed histogram in the style of DDSketch: bucket i counts the
+values in (gamma^(i-1), gamma^i], so every quantile it reports is within
+`accuracy` (relative) of a value that really is at that rank. Merging two
+sketches is adding their counts, and unlike t-digest or KLL a value can
+be taken out again by decrementing its bucket, which is what a
+resubmitted day needs.
+
+Stored as {"accuracy", "zeros", "offset", "counts"}: a dense list of
+bucket counts starting at bucket `offset`. A list is replaced as a whole
+by a merge=True write, and stays at a few hundred small ints even for a
+range of values from 1 to 10,000.
+
+Relative buckets make close scores ties (1020 and 1025 share a bucket),
+which is fine for a percentile but not for "you beat N% of players".
+ScoreHistogram counts integer scores exactly in the same dense layout;
+daily scores only span 0 to a little over 1,000.
+"""
+import math
+
+# Values below this (a score of 0, a time of 0) share one bucket, read as 0
+MIN_VALUE = 0.01
+
+
+class _DenseCounts:
+    """Counts for a run of integer indexes, stored from `offset` on."""
+
+    def __init__(self):
+        self.offset = 0
+        self.counts = []
+
+    def _add_index(self, index, count):
+        if not self.counts:
+            self.offset, self.counts = index, [0]
+        elif index < self.offset:
+            self.counts[:0] = [0] * (self.offset - index)
+            self.offset = index
+        elif index >= self.offset + len(self.counts):
+            self.counts.extend([0] * (index - self.offset - len(self.counts) + 1))
+        self.counts[index - self.offset] += count
+
+    def _trim(self):
+        # Drop empty buckets at either end, e.g. after the only low score was removed
+        nonzero = [position for position, count in enumerate(self.counts) if count]
+        if not nonzero:
+            self.offset, self.counts = 0, []
+            return
+        self.offset += nonzero[0]
+        self.counts = self.counts[nonzero[0]:nonzero[-1] + 1]
+
+
+class ScoreSketch(_DenseCounts):
+    def __init__(self, accuracy: float = 0.01):
+        if not 0 < accuracy < 1:
+            raise ValueError(f"sketch accuracy must be between 0 and 1, got {accuracy}")
+        super().__init__()
+        self.accuracy = accuracy
+        self.zeros = 0
+        self._gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+
+    @classmethod
+    def from_dict(cls, data: dict | None, accuracy: float = 0.01):
+        """Load a stored sketch; None (nothing stored yet) gives an empty one."""
+        if not data:
+            return cls(accuracy)
+        sketch = cls(data["accuracy"])
+        sketch.zeros = data.get("zeros", 0)
+        sketch.offset = data.get("offset", 0)
+        sketch.counts = list(data.get("counts", []))
+        return sketch
+
+    def to_dict(self) -> dict:
+        return {
+            "accuracy": self.accuracy,
+            "zeros": self.zeros,
+            "offset": self.offset,
+            "counts": list(self.counts),
+        }
+
+    @property
+    def count(self) -> int:
+        return self.zeros + sum(self.counts)
+
+    def _index(self, value):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index):
+        # The point within `accuracy` of both ends of the bucket
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def add(self, value: float, count: int = 1):
+        """Count `value` (`count` times); a negative count removes it."""
+        if value < MIN_VALUE:
+            self.zeros += count
+        else:
+            self._add_index(self._index(value), count)
+            self._trim()
+
+    def remove(self, value: float):
+        self.add(value, -1)
+
+    def merge(self, other: "ScoreSketch"):
+        """Add every value counted by `other` (same accuracy) to this sketch."""
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"can't merge a sketch of accuracy {other.accuracy} into {self.accuracy}")
+        self.zeros += other.zeros
+        for position, count in enumerate(other.counts):
+            if count:
+                self._add_index(other.offset + position, count)
+        self._trim()
+
+    def quantile(self, q: float) -> float | None:
+        """The value at rank q * (count - 1), or None for an empty sketch."""
+        total = self.count
+        if total <= 0:
+            return None
+        rank = q * (total - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for position, count in enumerate(self.counts):
+            seen += count
+            if seen > rank:
+                return self._value(self.offset + position)
+        return self._value(self.offset + len(self.counts) - 1)
+
+    def count_below(self, value: float) -> int:
+        """
+        How many values are certainly below `value`: those in lower
+        buckets. Values within the same bucket count as ties.
+        """
+        if value < MIN_VALUE:
+            return 0
+        return self.zeros + sum(self.counts[:max(0, self._index(value) - self.offset)])
+
+
+class ScoreHistogram(_DenseCounts):
+    """Exact counts of integer values, mergeable and removable like ScoreSketch."""
+
+    @classmethod
+    def from_dict(cls, data: dict | None):
+        histogram = cls()
+        if data:
+            histogram.offset = data.get("offset", 0)
+            histogram.counts = list(data.get("counts", []))
+        return histogram
+
+    def to_dict(self) -> dict:
+        return {"offset": self.offset, "counts": list(self.counts)}
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def add(self, value: int, count: int = 1):
+        """Count `value` (`count` times); a negative count removes it."""
+        self._add_index(int(value), count)
+        self._trim()
+
+    def remove(self, value: int):
+        self.add(value, -1)
+
+    def merge(self, other: "ScoreHistogram"):
+        for position, count in enumerate(other.counts):
+            if count:
+                self._add_index(other.offset + position, count)
+        self._trim()
+
+    def count_below(self, value: int) -> int:
+        """How many values are strictly below `value`."""
+        return sum(self.counts[:max(0, int(value) - self.offset)])
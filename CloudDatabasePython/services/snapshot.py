@@ -0,0 +1,244 @@
+"""
+Bulk export/import of users, their scores and monthly aggregates.
+
+A snapshot is a stream of records, one per document:
+
+    {"kind": "user",  "userId": "...", "id": null,         "data": {...}}
+    {"kind": "score", "userId": "...", "id": "2025-01-14", "data": {...}}
+    {"kind": "month", "userId": "...", "id": "2025-01",    "data": {...}}
+
+stored either as gzip-compressed NDJSON (*.ndjson.gz, always available)
+or as Parquet (*.parquet, needs pyarrow). The Parquet file keeps each
+document as a JSON `data` column and also copies the score figures into
+typed columns, so analytics can read them without parsing JSON.
+Timestamps are written as {"__datetime__": "<UTC ISO>"} in both formats.
+
+Export pages through users in document-id order and fetches each page's
+scores and months in parallel. Import merges documents back in batched
+writes, several batches at a time. Both go through the storage
+interface, so they work the same against Firestore and SQLite.
+"""
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from .data_version import bump_version
+from .instrumentation import instrumented
+from .leaderboard import invalidate_leaderboard_cache
+from .storage import get_storage
+from .window_leaderboards import rebuild_window_boards
+
+SNAPSHOT_FORMAT = 1
+
+# Users read per page; each page's users are fetched in parallel
+EXPORT_PAGE_SIZE = 200
+
+# Documents per batched write (Firestore caps a batch at 500)
+IMPORT_BATCH_SIZE = 400
+
+# Score fields copied into their own Parquet columns
+_SCORE_COLUMNS = ("dailyScore", "timeSeconds", "mistakes", "hintsUsed", "difficulty")
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return {"__datetime__": value.astimezone(timezone.utc).isoformat()}
+    raise TypeError(f"Cannot export {type(value).__name__} values")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.fromisoformat(obj["__datetime__"])
+    return obj
+
+
+def _dumps(obj):
+    return json.dumps(obj, default=_encode_value, separators=(",", ":"))
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode_object)
+
+
+def _is_parquet(path, fmt):
+    if fmt:
+        return fmt == "parquet"
+    return path.endswith(".parquet")
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise RuntimeError("Parquet snapshots need pyarrow (pip install pyarrow)") from e
+    return pyarrow, pyarrow.parquet
+
+
+# --- writers and readers ---------------------------------------------------
+
+class _NdjsonWriter:
+    def __init__(self, path):
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(_dumps({"kind": "meta", "format": SNAPSHOT_FORMAT}) + "\n")
+
+    def write(self, records):
+        self._file.writelines(_dumps(record) + "\n" for record in records)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetWriter:
+    def __init__(self, path):
+        pa, pq = _require_pyarrow()
+        self._pa = pa
+        self._schema = pa.schema(
+            [("kind", pa.string()), ("userId", pa.string()), ("id", pa.string()), ("data", pa.string())]
+            + [(column, pa.float64()) for column in _SCORE_COLUMNS],
+            metadata={"snapshotFormat": str(SNAPSHOT_FORMAT)}
+        )
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, records):
+        if not records:
+            return
+        columns = {
+            "kind": [record["kind"] for record in records],
+            "userId": [record["userId"] for record in records],
+            "id": [record["id"] for record in records],
+            "data": [_dumps(record["data"]) for record in records],
+        }
+        for column in _SCORE_COLUMNS:
+            columns[column] = [
+                record["data"].get(column) if record["kind"] == "score" else None
+                for record in records
+            ]
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _read_ndjson(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = _loads(line)
+            if record["kind"] == "meta":
+                if record.get("format") != SNAPSHOT_FORMAT:
+                    raise ValueError(f"Unsupported snapshot format {record.get('format')!r}")
+                continue
+            yield record
+
+
+def _read_parquet(path):
+    _, pq = _require_pyarrow()
+    parquet = pq.ParquetFile(path)
+    for batch in parquet.iter_batches(columns=["kind", "userId", "id", "data"]):
+        for row in batch.to_pylist():
+            yield {**row, "data": _loads(row["data"])}
+
+
+# --- export ----------------------------------------------------------------
+
+def _user_records(store, user_id, data):
+    records = [{"kind": "user", "userId": user_id, "id": None, "data": data}]
+    records += [
+        {"kind": "score", "userId": user_id, "id": date_id, "data": score}
+        for date_id, score in store.iter_user_scores(user_id)
+    ]
+    records += [
+        {"kind": "month", "userId": user_id, "id": month, "data": month_data}
+        for month, month_data in store.iter_user_months(user_id)
+    ]
+    return records
+
+
+@instrumented
+def export_snapshot(path: str, fmt: str | None = None, workers: int = 8, progress=print):
+    """
+    Write every user with their scores and months to `path`.
+    Returns {"users", "scores", "months"} counts.
+    """
+    store = get_storage()
+    writer = _ParquetWriter(path) if _is_parquet(path, fmt) else _NdjsonWriter(path)
+    counts = {"users": 0, "scores": 0, "months": 0}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            after_id = None
+            while True:
+                page = store.page_users(after_id, EXPORT_PAGE_SIZE)
+                if not page:
+                    break
+                # map() keeps the page's user order
+                for records in pool.map(lambda user: _user_records(store, *user), page):
+                    writer.write(records)
+                    for record in records:
+                        counts[record["kind"] + "s"] += 1
+                after_id = page[-1][0]
+                if progress:
+                    progress(f"exported {counts['users']} users, {counts['scores']} scores")
+                if len(page) < EXPORT_PAGE_SIZE:
+                    break
+    finally:
+        writer.close()
+
+    return counts
+
+
+# --- import ----------------------------------------------------------------
+
+def _write_batch(store, kind, batch):
+    if kind == "user":
+        store.set_users([(record["userId"], record["data"]) for record in batch])
+    elif kind == "score":
+        store.set_scores([(record["userId"], record["id"], record["data"]) for record in batch])
+    else:
+        store.set_user_months([(record["userId"], record["id"], record["data"]) for record in batch])
+
+
+@instrumented
+def import_snapshot(path: str, fmt: str | None = None, workers: int = 4, progress=print):
+    """
+    Merge a snapshot written by export_snapshot into storage. Existing
+    documents are merged, not replaced, so importing twice is harmless.
+    Returns {"users", "scores", "months"} counts.
+    """
+    store = get_storage()
+    records = _read_parquet(path) if _is_parquet(path, fmt) else _read_ndjson(path)
+    counts = {"users": 0, "scores": 0, "months": 0}
+    pending = {"user": [], "score": [], "month": []}
+    in_flight = []
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        def _submit(kind):
+            batch, pending[kind] = pending[kind], []
+            in_flight.append(pool.submit(_write_batch, store, kind, batch))
+            counts[kind + "s"] += len(batch)
+            # Bound memory: wait for the oldest batches once enough are queued
+            while len(in_flight) > workers * 2:
+                in_flight.pop(0).result()
+
+        for record in records:
+            kind = record["kind"]
+            if kind not in pending:
+                raise ValueError(f"Unknown snapshot record kind {kind!r}")
+            pending[kind].append(record)
+            if len(pending[kind]) >= IMPORT_BATCH_SIZE:
+                _submit(kind)
+                if progress:
+                    progress(f"imported {counts['users']} users, {counts['scores']} scores")
+
+        for kind in pending:
+            if pending[kind]:
+                _submit(kind)
+        for future in in_flight:
+            future.result()
+
+    invalidate_leaderboard_cache()
+    rebuild_window_boards()
+    bump_version()
+    return counts
@@ -0,0 +1,383 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from .storage import Storage, Transaction
+from .utils import month_date_range
+
+# Replaced with the commit time wherever it appears as a field value
+SERVER_TIMESTAMP = object()
+
+_PAGE_SIZE = 500
+
+# Must match the users_by_month_total index expression for it to be used
+_TOTAL = "json_extract(data, '$.currentMonthTotal')"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id   TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS users_by_month_total
+    ON users (json_extract(data, '$.currentMonthTotal') DESC, id);
+
+CREATE TABLE IF NOT EXISTS scores (
+    user_id      TEXT NOT NULL,
+    date_id      TEXT NOT NULL,
+    submitted_at TEXT,
+    data         TEXT NOT NULL,
+    PRIMARY KEY (user_id, date_id)
+) WITHOUT ROWID;
+
+-- Months are read by date id now; drop the old submission-time index
+DROP INDEX IF EXISTS scores_by_submitted_at;
+
+CREATE TABLE IF NOT EXISTS user_months (
+    user_id TEXT NOT NULL,
+    month   TEXT NOT NULL,
+    data    TEXT NOT NULL,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id         TEXT NOT NULL,
+    data       TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID;
+"""
+
+
+def _timestamp_key(value):
+    """Sortable UTC text form of a datetime (naive values are taken as UTC)."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"__datetime__": _timestamp_key(value)}
+    raise TypeError(f"Cannot store {type(value).__name__} in SQLite storage")
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and "__datetime__" in obj:
+        return datetime.strptime(obj["__datetime__"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    return obj
+
+
+def _dumps(data):
+    return json.dumps(data, default=_encode_value, separators=(",", ":"))
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode_object) if text else None
+
+
+def _merge(existing, fields, now):
+    """Merge fields into existing like Firestore's set(..., merge=True)."""
+    merged = dict(existing or {})
+    for key, value in fields.items():
+        if value is SERVER_TIMESTAMP:
+            merged[key] = now
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value, now)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _select(data, fields):
+    return {k: data[k] for k in fields if k in data} if fields else data
+
+
+class SQLiteTransaction(Transaction):
+    def __init__(self, storage):
+        self._storage = storage
+
+    def get_user(self, user_id):
+        return self._storage.get_user(user_id)
+
+    def get_score(self, user_id, date_id):
+        return self._storage._get_score(user_id, date_id)
+
+    def get_scores(self, user_id, date_ids):
+        scores = {}
+        for date_id in set(date_ids):
+            data = self._storage._get_score(user_id, date_id)
+            if data is not None:
+                scores[date_id] = data
+        return scores
+
+    def iter_month_scores(self, user_id, month):
+        return self._storage.iter_month_scores(user_id, month)
+
+    def iter_user_scores(self, user_id):
+        return self._storage.iter_user_scores(user_id)
+
+    def get_user_months(self, user_id, months):
+        found = {}
+        for month in set(months):
+            data = self._storage._get_user_month(user_id, month)
+            if data is not None:
+                found[month] = data
+        return found
+
+    def set_user(self, user_id, fields):
+        self._storage.set_user(user_id, fields)
+
+    def set_score(self, user_id, date_id, fields):
+        self._storage.set_score(user_id, date_id, fields)
+
+    def set_user_month(self, user_id, month, fields):
+        self._storage._upsert_user_month(user_id, month, fields, datetime.now(timezone.utc))
+
+    def get_doc(self, collection, doc_id):
+        return self._storage.get_doc(collection, doc_id)
+
+    def set_doc(self, collection, doc_id, fields):
+        self._storage.set_doc(collection, doc_id, fields)
+
+
+class SQLiteStorage(Storage):
+    """
+    Local storage with the same document model as Firestore.
+
+    Documents are JSON in a `data` column; fields the services filter or
+    sort on are covered by indexes. One connection is shared by every
+    thread and guarded by a lock, which is what SQLite serialises to anyway.
+    """
+
+    server_timestamp = SERVER_TIMESTAMP
+    # "database is locked" when several processes share one file
+    transient_errors = (sqlite3.OperationalError,)
+
+    def __init__(self, path: str = ":memory:"):
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _upsert_user(self, user_id, fields, now):
+        rows = self._conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchall()
+        data = _merge(_loads(rows[0][0]) if rows else None, fields, now)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO users (id, data) VALUES (?, ?)", (user_id, _dumps(data))
+        )
+
+    # --- users -------------------------------------------------------------
+
+    def get_user(self, user_id):
+        rows = self._query("SELECT data FROM users WHERE id = ?", (user_id,))
+        return _loads(rows[0][0]) if rows else None
+
+    def iter_users(self, fields=None):
+        after_id = None
+        while True:
+            page = self.page_users(after_id, _PAGE_SIZE, fields)
+            yield from page
+            if len(page) < _PAGE_SIZE:
+                return
+            after_id = page[-1][0]
+
+    def page_users(self, after_id, limit, fields=None):
+        rows = self._query(
+            "SELECT id, data FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id or "", limit)
+        )
+        return [(user_id, _select(_loads(data), fields)) for user_id, data in rows]
+
+    def set_user(self, user_id, fields):
+        with self._lock:
+            self._upsert_user(user_id, fields, datetime.now(timezone.utc))
+
+    def set_users(self, updates):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, fields in updates:
+                    self._upsert_user(user_id, fields, now)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _leaderboard_rows(self, where, params, limit=None):
+        sql = (
+            "SELECT id, data FROM users"
+            f" WHERE {_TOTAL} IS NOT NULL{where}"
+            f" ORDER BY {_TOTAL} DESC, id"
+        )
+        if limit:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return [(user_id, _loads(data)) for user_id, data in self._query(sql, params)]
+
+    def iter_leaderboard(self, limit=None, start_after=None):
+        # Read in keyset pages so a full scan only holds one page in memory
+        remaining = limit
+        while remaining is None or remaining > 0:
+            where, params = "", ()
+            if start_after:
+                total, user_id = start_after
+                where = f" AND ({_TOTAL} < ? OR ({_TOTAL} = ? AND id > ?))"
+                params = (total, total, user_id)
+
+            page_size = _PAGE_SIZE if remaining is None else min(remaining, _PAGE_SIZE)
+            page = self._leaderboard_rows(where, params, page_size)
+            yield from page
+
+            if len(page) < page_size:
+                return
+            if remaining is not None:
+                remaining -= len(page)
+            last_id, last_data = page[-1]
+            start_after = (last_data.get("currentMonthTotal"), last_id)
+
+    def count_users_ahead(self, total, user_id):
+        return self._query(
+            f"SELECT COUNT(*) FROM users WHERE {_TOTAL} > ? OR ({_TOTAL} = ? AND id < ?)",
+            (total, total, user_id)
+        )[0][0]
+
+    def iter_leaderboard_before(self, total, user_id, limit):
+        rows = self._query(
+            "SELECT id, data FROM users"
+            f" WHERE {_TOTAL} > ? OR ({_TOTAL} = ? AND id < ?)"
+            f" ORDER BY {_TOTAL}, id DESC LIMIT ?",
+            (total, total, user_id, limit)
+        )
+        for other_id, data in rows:
+            yield other_id, _loads(data)
+
+    # --- daily scores ------------------------------------------------------
+
+    def _get_score(self, user_id, date_id):
+        rows = self._query(
+            "SELECT data FROM scores WHERE user_id = ? AND date_id = ?", (user_id, date_id)
+        )
+        return _loads(rows[0][0]) if rows else None
+
+    def _upsert_score(self, user_id, date_id, fields, now):
+        data = _merge(self._get_score(user_id, date_id), fields, now)
+        submitted_at = data.get("submittedAt")
+        self._conn.execute(
+            "INSERT OR REPLACE INTO scores (user_id, date_id, submitted_at, data) VALUES (?, ?, ?, ?)",
+            (
+                user_id,
+                date_id,
+                _timestamp_key(submitted_at) if isinstance(submitted_at, datetime) else None,
+                _dumps(data),
+            )
+        )
+
+    def set_score(self, user_id, date_id, fields):
+        with self._lock:
+            self._upsert_score(user_id, date_id, fields, datetime.now(timezone.utc))
+
+    def set_scores(self, updates):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, date_id, fields in updates:
+                    self._upsert_score(user_id, date_id, fields, now)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def iter_user_scores(self, user_id):
+        rows = self._query(
+            "SELECT date_id, data FROM scores WHERE user_id = ? ORDER BY date_id", (user_id,)
+        )
+        for date_id, data in rows:
+            yield date_id, _loads(data)
+
+    def iter_month_scores(self, user_id, month):
+        # A range on the primary key, like the date-id range on Firestore
+        rows = self._query(
+            "SELECT date_id, data FROM scores WHERE user_id = ? AND date_id BETWEEN ? AND ?"
+            " ORDER BY date_id",
+            (user_id, *month_date_range(month))
+        )
+        for date_id, data in rows:
+            yield date_id, _loads(data)
+
+    # --- monthly aggregates ------------------------------------------------
+
+    def _get_user_month(self, user_id, month):
+        rows = self._query(
+            "SELECT data FROM user_months WHERE user_id = ? AND month = ?", (user_id, month)
+        )
+        return _loads(rows[0][0]) if rows else None
+
+    def iter_user_months(self, user_id, limit=None):
+        rows = self._query(
+            "SELECT month, data FROM user_months WHERE user_id = ? ORDER BY month DESC LIMIT ?",
+            (user_id, limit or -1)
+        )
+        for month, data in rows:
+            yield month, _loads(data)
+
+    def _upsert_user_month(self, user_id, month, fields, now):
+        data = _merge(self._get_user_month(user_id, month), fields, now)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO user_months (user_id, month, data) VALUES (?, ?, ?)",
+            (user_id, month, _dumps(data))
+        )
+
+    def set_user_months(self, updates):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for user_id, month, fields in updates:
+                    self._upsert_user_month(user_id, month, fields, now)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    # --- bookkeeping documents ---------------------------------------------
+
+    def get_doc(self, collection, doc_id):
+        rows = self._query(
+            "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        )
+        return _loads(rows[0][0]) if rows else None
+
+    def set_doc(self, collection, doc_id, fields):
+        with self._lock:
+            data = _merge(self.get_doc(collection, doc_id), fields, datetime.now(timezone.utc))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)",
+                (collection, doc_id, _dumps(data))
+            )
+
+    def increment_doc(self, collection, doc_id, field, amount=1):
+        with self._lock:
+            data = self.get_doc(collection, doc_id) or {}
+            self.set_doc(collection, doc_id, {field: data.get(field, 0) + amount})
+
+    # --- transactions ------------------------------------------------------
+
+    def run_transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(SQLiteTransaction(self))
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
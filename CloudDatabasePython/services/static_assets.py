@@ -0,0 +1,164 @@
+"""
+Precompressed, content-hashed frontend assets.
+
+At startup every file under frontend/ is read once, fingerprinted with a
+short SHA-256 of its bytes, and compressed with gzip (and brotli when
+the `brotli` package is installed). Each asset can then be requested two
+ways:
+
+  - by its fingerprinted name (app.3f2a9c1d7e04.js). That URL can never
+    change content, so it is served with a one-year immutable
+    Cache-Control.
+  - by its plain name (app.js). That is served with its ETag and
+    `no-cache`, so browsers revalidate it and get a 304 when unchanged.
+
+HTML pages are served only under their plain name. Their local
+src/href references are rewritten to the fingerprinted names, so a
+deploy changes the page's ETag and its assets' URLs together.
+
+Both web apps serve from here. Neither does any file I/O or compression
+per request.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Below this, compression overhead isn't worth it
+_MIN_COMPRESS_BYTES = 256
+
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+_REFERENCE = re.compile(r'(\b(?:src|href)=")([^"#?]+)(")')
+
+
+class Asset:
+    """One file's bytes in every encoding, plus its response headers."""
+
+    def __init__(self, name, body, content_type, immutable):
+        self.name = name
+        self.content_type = content_type
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+        self.bodies = {"identity": body}
+
+        if content_type.startswith(_COMPRESSIBLE) and len(body) >= _MIN_COMPRESS_BYTES:
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            # Keep an encoding only if it actually saves bytes
+            self.bodies.update({
+                encoding: data for encoding, data in compressed.items() if len(data) < len(body)
+            })
+
+    def select(self, accept_encoding: str | None):
+        """Return (encoding, body) for the best encoding the client accepts."""
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                return encoding, self.bodies[encoding]
+        return "identity", self.bodies["identity"]
+
+    def headers(self, encoding):
+        headers = {
+            "Content-Type": self.content_type,
+            "Cache-Control": self.cache_control,
+            "ETag": f'"{self.etag}"',
+            "Vary": "Accept-Encoding",
+        }
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return headers
+
+
+def accepted_encodings(header):
+    """Encodings named in Accept-Encoding, minus any refused with q=0."""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        key, _, value = params.partition("=")
+        try:
+            refused = key.strip() == "q" and float(value) == 0
+        except ValueError:
+            refused = False
+        if name and not refused:
+            accepted.add(name)
+    if "*" in accepted:
+        accepted.update(("gzip", "br"))
+    return accepted
+
+
+def _content_type(name):
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return content_type
+
+
+def _fingerprinted_name(name, body):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{ext}"
+
+
+class AssetBundle:
+    """Every asset under a directory, keyed by the URL paths it answers to."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._assets = {}
+        self._build()
+
+    def _build(self):
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    files[rel] = f.read()
+
+        hashed = {}
+        for rel, body in files.items():
+            if not rel.endswith(".html"):
+                hashed[rel] = _fingerprinted_name(rel, body)
+                self._assets[hashed[rel]] = Asset(hashed[rel], body, _content_type(rel), True)
+                self._assets[rel] = Asset(rel, body, _content_type(rel), False)
+
+        for rel, body in files.items():
+            if rel.endswith(".html"):
+                page = _rewrite_references(rel, body.decode("utf-8"), hashed).encode("utf-8")
+                self._assets[rel] = Asset(rel, page, _content_type(rel), False)
+
+    def get(self, path):
+        """Asset for a URL path ("" and directories map to index.html)."""
+        path = path.lstrip("/")
+        if path == "" or path.endswith("/"):
+            path += "index.html"
+        return self._assets.get(path)
+
+
+def _rewrite_references(page_name, html, hashed):
+    """Point a page's relative src/href references at fingerprinted names."""
+    base = os.path.dirname(page_name)
+
+    def _replace(match):
+        ref = match.group(2)
+        if ref.startswith("/") or ":" in ref:
+            return match.group(0)
+        rel = os.path.normpath(os.path.join(base, ref)).replace(os.sep, "/")
+        if rel not in hashed:
+            return match.group(0)
+        new_ref = os.path.relpath(hashed[rel], base or ".").replace(os.sep, "/")
+        return match.group(1) + new_ref + match.group(3)
+
+    return _REFERENCE.sub(_replace, html)
@@ -0,0 +1,372 @@
+"""
+Storage interface shared by the services layer.
+
+Services never talk to a database client directly; they ask get_storage()
+for the configured backend (STORAGE_BACKEND=firestore|sqlite) and use the
+methods below. Documents are plain dicts and every write merges into the
+existing document, the same way Firestore's set(..., merge=True) does.
+
+get_async_storage() returns the asyncio flavour used by the ASGI app:
+reads are coroutines, transaction writes are buffered and stay plain calls.
+"""
+import asyncio
+import threading
+from config.settings import INSTRUMENT_STORAGE, RESILIENT_STORAGE, STORAGE_BACKEND, SQLITE_PATH
+
+_storage = None
+_async_storage = None
+_storage_lock = threading.Lock()
+
+
+class StorageUnavailable(Exception):
+    """
+    Storage couldn't be reached: retries ran out or the circuit is open
+    (see resilient_storage.py). `retry_after` is a hint in seconds.
+    """
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Transaction:
+    """Reads and writes that commit (or retry) together."""
+
+    def get_user(self, user_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def get_score(self, user_id: str, date_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def get_scores(self, user_id: str, date_ids: list[str]) -> dict[str, dict]:
+        """Return {date_id: data} for the scores among date_ids that exist."""
+        raise NotImplementedError
+
+    def iter_month_scores(self, user_id: str, month: str):
+        raise NotImplementedError
+
+    def iter_user_scores(self, user_id: str):
+        """Every score of the user; only for one-off seeding, as it reads them all."""
+        raise NotImplementedError
+
+    def get_user_months(self, user_id: str, months: list[str]) -> dict[str, dict]:
+        """Return {month: data} for the monthly aggregates among months that exist."""
+        raise NotImplementedError
+
+    def get_doc(self, collection: str, doc_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def set_user(self, user_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_score(self, user_id: str, date_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_user_month(self, user_id: str, month: str, fields: dict):
+        raise NotImplementedError
+
+    def set_doc(self, collection: str, doc_id: str, fields: dict):
+        raise NotImplementedError
+
+
+class Storage:
+    """
+    Repository for users, their daily scores and small bookkeeping docs.
+
+    `server_timestamp` is a sentinel that backends replace with the commit
+    time when it appears as a field value. `transient_errors` are the
+    exceptions worth retrying.
+    """
+
+    server_timestamp = None
+    transient_errors = ()
+
+    # --- users -------------------------------------------------------------
+
+    def get_user(self, user_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def iter_users(self, fields: list[str] | None = None):
+        """Yield (user_id, data) for every user in document-id order."""
+        raise NotImplementedError
+
+    def page_users(self, after_id: str | None, limit: int, fields: list[str] | None = None):
+        """Return up to `limit` (user_id, data) pairs with ids after `after_id`."""
+        raise NotImplementedError
+
+    def set_user(self, user_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_users(self, updates: list[tuple[str, dict]]):
+        """Merge several user updates in one batched write."""
+        raise NotImplementedError
+
+    def iter_leaderboard(self, limit: int | None = None, start_after: tuple | None = None):
+        """
+        Yield (user_id, data) ordered by currentMonthTotal descending, ties
+        by user id ascending. start_after is a (currentMonthTotal, user_id)
+        cursor from the previous page.
+        """
+        raise NotImplementedError
+
+    def count_users_ahead(self, total: int, user_id: str) -> int:
+        """Count users ordered before (total, user_id) on the leaderboard."""
+        raise NotImplementedError
+
+    def iter_leaderboard_before(self, total: int, user_id: str, limit: int):
+        """
+        Yield the `limit` users ordered just before (total, user_id),
+        nearest first (i.e. walking up the leaderboard).
+        """
+        raise NotImplementedError
+
+    # --- daily scores ------------------------------------------------------
+
+    def set_score(self, user_id: str, date_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_scores(self, updates: list[tuple[str, str, dict]]):
+        """Merge several (user_id, date_id, fields) scores in one batched write."""
+        raise NotImplementedError
+
+    def iter_month_scores(self, user_id: str, month: str):
+        """
+        Yield (date_id, data) for the scores dated in `month` ('YYYY-MM'),
+        by date id range rather than submission time, so backfilled days
+        land in the month they were played.
+        """
+        raise NotImplementedError
+
+    def iter_user_scores(self, user_id: str):
+        """Yield (date_id, data) for every score of a user, oldest first."""
+        raise NotImplementedError
+
+    # --- monthly aggregates ------------------------------------------------
+
+    def iter_user_months(self, user_id: str, limit: int | None = None):
+        """Yield (month, data) for a user's monthly aggregates, newest first."""
+        raise NotImplementedError
+
+    def set_user_months(self, updates: list[tuple[str, str, dict]]):
+        """Merge several (user_id, month, fields) updates in one batched write."""
+        raise NotImplementedError
+
+    # --- bookkeeping documents (checkpoints etc.) --------------------------
+
+    def get_doc(self, collection: str, doc_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def set_doc(self, collection: str, doc_id: str, fields: dict):
+        raise NotImplementedError
+
+    def increment_doc(self, collection: str, doc_id: str, field: str, amount: int = 1):
+        """Atomically add amount to a numeric field, creating it at 0."""
+        raise NotImplementedError
+
+    # --- transactions ------------------------------------------------------
+
+    def run_transaction(self, fn):
+        """Call fn(transaction) atomically and return its result."""
+        raise NotImplementedError
+
+
+class AsyncTransaction:
+    """Transaction for async code: awaitable reads, buffered writes."""
+
+    async def get_user(self, user_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def get_score(self, user_id: str, date_id: str) -> dict | None:
+        raise NotImplementedError
+
+    async def get_scores(self, user_id: str, date_ids: list[str]) -> dict[str, dict]:
+        raise NotImplementedError
+
+    def iter_month_scores(self, user_id: str, month: str):
+        """Async iterator of (date_id, data)."""
+        raise NotImplementedError
+
+    def iter_user_scores(self, user_id: str):
+        """Async iterator of (date_id, data) over every score of the user."""
+        raise NotImplementedError
+
+    async def get_user_months(self, user_id: str, months: list[str]) -> dict[str, dict]:
+        raise NotImplementedError
+
+    async def get_doc(self, collection: str, doc_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def set_user(self, user_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_score(self, user_id: str, date_id: str, fields: dict):
+        raise NotImplementedError
+
+    def set_user_month(self, user_id: str, month: str, fields: dict):
+        raise NotImplementedError
+
+    def set_doc(self, collection: str, doc_id: str, fields: dict):
+        raise NotImplementedError
+
+
+class AsyncStorage:
+    """The subset of Storage the async serving mode needs."""
+
+    server_timestamp = None
+    transient_errors = ()
+
+    async def get_user(self, user_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def iter_users(self, fields: list[str] | None = None):
+        """Async iterator of (user_id, data) in document-id order."""
+        raise NotImplementedError
+
+    def iter_leaderboard(self, limit: int | None = None, start_after: tuple | None = None):
+        """Async iterator with the same ordering and cursor as Storage.iter_leaderboard."""
+        raise NotImplementedError
+
+    async def run_transaction(self, fn):
+        """Await fn(transaction) atomically and return its result."""
+        raise NotImplementedError
+
+
+class _ThreadedTransaction(AsyncTransaction):
+    def __init__(self, txn: Transaction):
+        self._txn = txn
+
+    async def get_user(self, user_id):
+        return self._txn.get_user(user_id)
+
+    async def get_score(self, user_id, date_id):
+        return self._txn.get_score(user_id, date_id)
+
+    async def get_scores(self, user_id, date_ids):
+        return self._txn.get_scores(user_id, date_ids)
+
+    async def iter_month_scores(self, user_id, month):
+        for item in self._txn.iter_month_scores(user_id, month):
+            yield item
+
+    async def iter_user_scores(self, user_id):
+        for item in self._txn.iter_user_scores(user_id):
+            yield item
+
+    async def get_user_months(self, user_id, months):
+        return self._txn.get_user_months(user_id, months)
+
+    async def get_doc(self, collection, doc_id):
+        return self._txn.get_doc(collection, doc_id)
+
+    def set_user(self, user_id, fields):
+        self._txn.set_user(user_id, fields)
+
+    def set_score(self, user_id, date_id, fields):
+        self._txn.set_score(user_id, date_id, fields)
+
+    def set_user_month(self, user_id, month, fields):
+        self._txn.set_user_month(user_id, month, fields)
+
+    def set_doc(self, collection, doc_id, fields):
+        self._txn.set_doc(collection, doc_id, fields)
+
+
+class ThreadedAsyncStorage(AsyncStorage):
+    """
+    Adapts a blocking Storage (e.g. SQLite) for async callers by running
+    each call in a worker thread, so the event loop never blocks on disk.
+    """
+
+    _PAGE_SIZE = 500
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.server_timestamp = storage.server_timestamp
+        self.transient_errors = storage.transient_errors
+
+    async def get_user(self, user_id):
+        return await asyncio.to_thread(self.storage.get_user, user_id)
+
+    async def iter_users(self, fields=None):
+        after_id = None
+        while True:
+            page = await asyncio.to_thread(self.storage.page_users, after_id, self._PAGE_SIZE, fields)
+            for item in page:
+                yield item
+            if len(page) < self._PAGE_SIZE:
+                return
+            after_id = page[-1][0]
+
+    async def iter_leaderboard(self, limit=None, start_after=None):
+        rows = await asyncio.to_thread(lambda: list(self.storage.iter_leaderboard(limit, start_after)))
+        for item in rows:
+            yield item
+
+    async def run_transaction(self, fn):
+        # The whole transaction runs on one worker thread with its own loop,
+        # holding the backend's transaction for its duration
+        def _run():
+            return self.storage.run_transaction(
+                lambda txn: asyncio.run(fn(_ThreadedTransaction(txn)))
+            )
+
+        return await asyncio.to_thread(_run)
+
+
+def get_storage() -> Storage:
+    """Return the process-wide storage backend, creating it on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = _create_storage(STORAGE_BACKEND)
+    return _storage
+
+
+def get_async_storage() -> AsyncStorage:
+    """Return the process-wide async backend, creating it on first use."""
+    global _async_storage
+    if _async_storage is None:
+        if STORAGE_BACKEND == "firestore":
+            from .firestore_storage import AsyncFirestoreStorage
+            storage = AsyncFirestoreStorage()
+            if INSTRUMENT_STORAGE:
+                from .counting_storage import CountingAsyncStorage
+                storage = CountingAsyncStorage(storage)
+            if RESILIENT_STORAGE:
+                from .resilient_storage import ResilientAsyncStorage
+                storage = ResilientAsyncStorage(storage)
+        else:
+            storage = ThreadedAsyncStorage(get_storage())
+        with _storage_lock:
+            if _async_storage is None:
+                _async_storage = storage
+    return _async_storage
+
+
+def set_storage(storage: Storage | None):
+    """Swap the process-wide backend (benchmarks, tests, local tooling)."""
+    global _storage, _async_storage
+    with _storage_lock:
+        _storage = storage
+        _async_storage = ThreadedAsyncStorage(storage) if storage else None
+
+
+def _create_storage(backend: str) -> Storage:
+    if backend == "firestore":
+        from .firestore_storage import FirestoreStorage
+        storage = FirestoreStorage()
+    elif backend == "sqlite":
+        from .sqlite_storage import SQLiteStorage
+        storage = SQLiteStorage(SQLITE_PATH)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
+
+    if INSTRUMENT_STORAGE:
+        from .counting_storage import CountingStorage
+        storage = CountingStorage(storage)
+    if RESILIENT_STORAGE:
+        # Outermost, so retries and hedges show up in the counts
+        from .resilient_storage import ResilientStorage
+        storage = ResilientStorage(storage)
+    return storage
@@ -0,0 +1,48 @@
+"""
+Encoders for streamed list responses: NDJSON (one JSON document per line)
+or a JSON array written element by element. Each takes an iterator of
+dicts and yields text chunks as soon as items arrive.
+"""
+import json
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def ndjson_lines(items):
+    for item in items:
+        yield json.dumps(item) + "\n"
+
+
+def json_array_chunks(items):
+    yield "["
+    separator = ""
+    for item in items:
+        yield separator + json.dumps(item)
+        separator = ","
+    yield "]"
+
+
+async def ndjson_lines_async(items):
+    async for item in items:
+        yield json.dumps(item) + "\n"
+
+
+async def json_array_chunks_async(items):
+    yield "["
+    separator = ""
+    async for item in items:
+        yield separator + json.dumps(item)
+        separator = ","
+    yield "]"
+
+
+def stream_format(format_param: str | None, accept: str | None):
+    """
+    Pick a streaming encoding from ?format= or the Accept header:
+    "ndjson", "array" (chunked JSON array) or None for a normal response.
+    """
+    if format_param == "ndjson" or (accept and NDJSON_MIMETYPE in accept):
+        return "ndjson"
+    if format_param == "stream":
+        return "array"
+    return None
@@ -1,10 +1,48 @@
-from datetime import datetime
-from google.cloud.firestore import SERVER_TIMESTAMP
-from .firestore_client import get_db
-from .scoring import calculate_daily_score
-from .utils import today_id, start_of_month
+import asyncio
+from datetime import date
+from config.settings import SUBMIT_COALESCE_MS
+from .data_version import bump_version
+from .events import publish_rank_change
+from .instrumentation import instrumented
+from .leaderboard import invalidate_leaderboard_cache, rank_of
+from .monthly_aggregates import (
+    days_total,
+    read_month_aggregates,
+    read_month_aggregates_async,
+    rebuild_month_aggregate,
+    update_month_aggregates,
+)
+from .score_stats import (
+    read_user_sketch,
+    read_user_sketch_async,
+    rebuild_user_sketch,
+    record_day_sketches,
+    score_changes,
+    write_user_sketch,
+)
+from .scoring import CURRENT_SCORING_VERSION, calculate_daily_score
+from .storage import get_async_storage, get_storage
+from .utils import month_of, today_id, week_date_range, week_of
+from .window_leaderboards import board_totals, update_window_boards
+
+# Keeps one user's batch inside Firestore's 500-writes-per-commit limit
+MAX_BATCH_SUBMISSIONS = 400
+
+
+def _score_fields(store, date_id, time_seconds, mistakes, hints_used, difficulty):
+    """Build the fields stored on a users/{id}/scores/{date} document."""
+    daily_score = calculate_daily_score(time_seconds, mistakes, hints_used, difficulty)
+    return {
+        "date": date_id,
+        "timeSeconds": time_seconds,
+        "mistakes": mistakes,
+        "hintsUsed": hints_used,
+        "difficulty": difficulty,
+        "dailyScore": daily_score,
+        "scoringVersion": CURRENT_SCORING_VERSION,
+        "submittedAt": store.server_timestamp
+    }
 
-db = get_db()
 
 def submit_daily_score(
     user_id: str,
@@ -15,84 +53,548 @@ def submit_daily_score(
     date_str: str | None = None
 ):
     """
-    Write daily score + raw user inputs into Firestore.
+    Write daily score + raw user inputs into storage.
     If date_str is given (YYYY-MM-DD), use that as the document ID.
     Otherwise, use today's date.
-    """
-    daily_score = calculate_daily_score(time_seconds, mistakes, hints_used, difficulty)
 
+    This does not touch the running totals on the user document;
+    follow it with update_user_summary() to bring them back in sync.
+    """
+    store = get_storage()
     doc_id = date_str if date_str else today_id()
+    fields = _score_fields(store, doc_id, time_seconds, mistakes, hints_used, difficulty)
 
-    doc_ref = (
-        db.collection("users")
-          .document(user_id)
-          .collection("scores")
-          .document(doc_id)
-    )
+    store.set_score(user_id, doc_id, fields)
 
-    doc_ref.set({
-        "timeSeconds": time_seconds,
-        "mistakes": mistakes,
-        "hintsUsed": hints_used,
-        "difficulty": difficulty,
-        "dailyScore": daily_score,
-        "submittedAt": SERVER_TIMESTAMP
-    }, merge=True)
-
-    return daily_score
+    return fields["dailyScore"]
 
 
-def update_user_summary(user_id):
-    today = datetime.utcnow()
-    month_start = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-
-    user_ref = db.collection("users").document(user_id)
-    scores_ref = user_ref.collection("scores")
-
-    monthly_scores = scores_ref.where("submittedAt", ">=", month_start).stream()
-
+def _rescan_month(scores):
+    """Sum (score, time, count) over an iterable of (date_id, score) pairs."""
     total_score = 0
     total_time = 0
     count = 0
 
-    for doc in monthly_scores:
-        data = doc.to_dict()
+    for _, data in scores:
         total_score += data.get("dailyScore", 0)
         total_time += data.get("timeSeconds", 0)
         count += 1
 
+    return total_score, total_time, count
+
+
+@instrumented
+def update_user_summary(user_id):
+    """
+    Repair mode: rescan every score dated this month and rewrite
+    currentMonthTotal, averageTime and the running counters from scratch,
+    and every score for the week and all-time totals and the user's score
+    sketch. Normal submissions keep these up to date incrementally.
+    """
+    store = get_storage()
+    month_key = _current_month()
+    week_key = _current_week()
+
+    user_data = store.get_user(user_id) or {}
+    total_score, total_time, count = _rescan_month(store.iter_month_scores(user_id, month_key))
+    scores = list(store.iter_user_scores(user_id))
+    all_time, week_total = _rescan_windows(scores, week_key)
+
     avg_time = total_time / count if count > 0 else 0
 
-    user_ref.set({
+    user_fields = {
         "currentMonthTotal": total_score,
+        "currentMonthCount": count,
+        "currentMonthTime": total_time,
+        "summaryMonth": month_key,
         "averageTime": avg_time,
-        "updatedAt": SERVER_TIMESTAMP
-    }, merge=True)
+        "weekTotal": week_total,
+        "summaryWeek": week_key,
+        "allTimeTotal": all_time,
+        "updatedAt": store.server_timestamp
+    }
+    store.set_user(user_id, user_fields)
+    rebuild_user_sketch(store, user_id, scores)
+    _after_summary_change(
+        user_id, total_score, avg_time, board_totals(user_id, user_data, user_fields)
+    )
 
     return total_score, avg_time
 
+
+def verify_user_summary(user_id):
+    """
+    Verification mode: rescan this month's scores and compare them with the
+    running totals stored on the user document, without writing anything.
+    """
+    store = get_storage()
+    month_key = _current_month()
+
+    stored = store.get_user(user_id) or {}
+
+    total_score, total_time, count = _rescan_month(store.iter_month_scores(user_id, month_key))
+
+    expected = {
+        "currentMonthTotal": total_score,
+        "currentMonthCount": count,
+        "currentMonthTime": total_time,
+    }
+    actual = {field: stored.get(field) for field in expected}
+
+    return {
+        "ok": actual == expected and stored.get("summaryMonth") == month_key,
+        "expected": expected,
+        "stored": actual,
+    }
+
+
+@instrumented
+def _after_summary_change(user_id, new_total, avg_time, window_totals=None, changes=None):
+    """
+    Everything that has to follow a committed change to a user's monthly
+    total; `window_totals` (from board_totals()) also moves them on the
+    weekly/monthly/all-time boards, and `changes` (from score_changes())
+    into the day sketches. Returns the user's new rank, counted on read:
+    nobody else's document is written.
+    """
+    invalidate_leaderboard_cache()
+    if window_totals:
+        update_window_boards(user_id, window_totals)
+    record_day_sketches(changes)
+    rank = rank_of(user_id, new_total)
+    bump_version()
+    publish_rank_change(user_id, new_total, avg_time, rank)
+    return rank
+
+
+def _current_month():
+    """Return the current 'YYYY-MM', on the same clock as today_id()."""
+    return month_of(today_id())
+
+
+def _current_week():
+    """Return the current ISO week 'YYYY-Www', on the same clock as today_id()."""
+    return week_of(today_id())
+
+
+def _window_dates(date_ids, week_key):
+    """
+    Date ids whose months read_month_aggregates() has to load: the
+    submitted ones plus the current week's, whose total is summed from
+    the month documents' days.
+    """
+    return [*date_ids, *week_date_range(week_key)]
+
+
+def _rescan_windows(scores, week_key):
+    """(all-time total, total for week_key) over (date_id, score) pairs."""
+    first_date_id, last_date_id = week_date_range(week_key)
+    all_time = week_total = 0
+    for date_id, data in scores:
+        all_time += data.get("dailyScore", 0)
+        if first_date_id <= date_id <= last_date_id:
+            week_total += data.get("dailyScore", 0)
+    return all_time, week_total
+
+
+def _read_history(txn, user_id, user_data, sketch_doc):
+    """
+    Every (date_id, score) the user has, or None when neither allTimeTotal
+    nor their score sketch needs seeding. Read once per user, the first
+    time a submission finds either missing.
+    """
+    if "allTimeTotal" in user_data and sketch_doc is not None:
+        return None
+    return list(txn.iter_user_scores(user_id))
+
+
+async def _read_history_async(txn, user_id, user_data, sketch_doc):
+    """Async twin of _read_history."""
+    if "allTimeTotal" in user_data and sketch_doc is not None:
+        return None
+    return [item async for item in txn.iter_user_scores(user_id)]
+
+
+def _all_time_seed(user_data, history):
+    """Seed for allTimeTotal, or None when the user document already has one."""
+    if "allTimeTotal" in user_data:
+        return None
+    return sum(data.get("dailyScore", 0) for _, data in history)
+
+
+def _score_delta(old_scores, items):
+    """Net change in total score from writing items, in order, over old_scores."""
+    return _changes_delta(score_changes(old_scores, items))
+
+
+def _changes_delta(changes):
+    """Net change in total score from (date_id, old, new) score changes, in any order."""
+    return sum(
+        new["dailyScore"] - (old.get("dailyScore", 0) if old else 0)
+        for _, old, new in changes
+    )
+
+
+def _window_fields(user_data, all_time_seed, delta, days_by_month, week_key):
+    """
+    Week and all-time summary fields. The week is summed from the month
+    aggregates' days, so it needs no counter; the all-time total is a
+    running one moved by `delta` (on top of its seed, when seeded).
+    """
+    all_time = user_data.get("allTimeTotal", 0) if all_time_seed is None else all_time_seed
+    return {
+        "weekTotal": days_total(days_by_month, *week_date_range(week_key)),
+        "summaryWeek": week_key,
+        "allTimeTotal": all_time + delta,
+    }
+
+
+def _needs_seed(user_data, month_key):
+    """
+    True when the running counters don't belong to month_key yet (first
+    submission ever, or of a new month). They are then seeded from a scan
+    of the month's scores, which is exact even if some were written
+    without going through the counters (backfills, repairs).
+    """
+    return user_data.get("summaryMonth") != month_key
+
+
+def _fold_submission(store, user_data, old_data, date_id, fields, month_key, seed=None):
+    """
+    Fold one daily score into the user's running monthly totals.
+
+    Only scores dated in month_key count; a backfill for an earlier month
+    leaves the totals alone. If the score document already exists its old
+    values are swapped out instead of counted twice. `seed` is the
+    (score, time, count) rescan used when _needs_seed(user_data, month_key).
+    Returns (user_fields, total_score, avg_time).
+    """
+    if seed is not None:
+        total_score, total_time, count = seed
+    else:
+        total_score = user_data.get("currentMonthTotal", 0)
+        total_time = user_data.get("currentMonthTime", 0)
+        count = user_data.get("currentMonthCount", 0)
+
+    if month_of(date_id) == month_key:
+        if old_data is not None:
+            total_score -= old_data.get("dailyScore", 0)
+            total_time -= old_data.get("timeSeconds", 0)
+        else:
+            count += 1
+
+        total_score += fields["dailyScore"]
+        total_time += fields["timeSeconds"]
+
+    avg_time = total_time / count if count > 0 else 0
+
+    user_fields = {
+        "currentMonthTotal": total_score,
+        "currentMonthCount": count,
+        "currentMonthTime": total_time,
+        "summaryMonth": month_key,
+        "averageTime": avg_time,
+        "updatedAt": store.server_timestamp
+    }
+    return user_fields, total_score, avg_time
+
+
+def _fold_user_batch(store, user_data, old_scores, items, month_key, seed=None):
+    """
+    Fold several (date_id, fields) submissions for one user, in order.
+
+    A date repeated within the batch overwrites the earlier entry just like
+    a resubmission would. Returns (user_fields, total_score, avg_time).
+    """
+    return _fold_user_changes(store, user_data, score_changes(old_scores, items), month_key, seed)
+
+
+def _fold_user_changes(store, user_data, changes, month_key, seed=None):
+    """
+    Fold (date_id, old, new) score changes for one user. Each change swaps
+    its own old values out, so the totals come out the same in any order
+    as long as every committed write is folded once.
+    """
+    user_fields = None
+    total_score, avg_time = 0, 0
+
+    for date_id, old_data, fields in changes:
+        user_fields, total_score, avg_time = _fold_submission(
+            store, user_data, old_data, date_id, fields, month_key, seed
+        )
+        # Later changes build on this one's totals
+        user_data, seed = user_fields, None
+
+    return user_fields, total_score, avg_time
+
+
+def _apply_user_batch(txn, store, user_id, items):
+    """
+    Write all of one user's (date_id, fields) scores and update their
+    summary once, in one transaction, so concurrent submissions for the
+    same user cannot lose an update. A single submission is a batch of one.
+    """
+    month_key = _current_month()
+    week_key = _current_week()
+    date_ids = [date_id for date_id, _ in items]
+
+    user_data = txn.get_user(user_id) or {}
+    old_scores = txn.get_scores(user_id, date_ids)
+
+    seed = None
+    if _needs_seed(user_data, month_key):
+        seed = _rescan_month(txn.iter_month_scores(user_id, month_key))
+    month_docs, month_seeds = read_month_aggregates(txn, user_id, _window_dates(date_ids, week_key))
+    sketch_doc = read_user_sketch(txn, user_id)
+    history = _read_history(txn, user_id, user_data, sketch_doc)
+    all_time_seed = _all_time_seed(user_data, history)
+
+    user_fields, total_score, avg_time = _fold_user_batch(
+        store, user_data, old_scores, items, month_key, seed
+    )
+
+    for date_id, fields in items:
+        txn.set_score(user_id, date_id, fields)
+    days_by_month = update_month_aggregates(txn, store, user_id, month_docs, month_seeds, items)
+    delta = _score_delta(old_scores, items)
+    user_fields.update(_window_fields(user_data, all_time_seed, delta, days_by_month, week_key))
+    txn.set_user(user_id, user_fields)
+    changes = score_changes(old_scores, items)
+    write_user_sketch(txn, store, user_id, sketch_doc, history, changes)
+
+    return total_score, avg_time, board_totals(user_id, user_data, user_fields), changes
+
+
+async def _apply_user_batch_async(txn, store, user_id, items):
+    """Async twin of _apply_user_batch; the first two reads run concurrently."""
+    month_key = _current_month()
+    week_key = _current_week()
+    date_ids = [date_id for date_id, _ in items]
+
+    user_data, old_scores = await asyncio.gather(
+        txn.get_user(user_id),
+        txn.get_scores(user_id, date_ids)
+    )
+    user_data = user_data or {}
+
+    seed = None
+    if _needs_seed(user_data, month_key):
+        seed = _rescan_month([item async for item in txn.iter_month_scores(user_id, month_key)])
+    month_docs, month_seeds = await read_month_aggregates_async(
+        txn, user_id, _window_dates(date_ids, week_key)
+    )
+    sketch_doc = await read_user_sketch_async(txn, user_id)
+    history = await _read_history_async(txn, user_id, user_data, sketch_doc)
+    all_time_seed = _all_time_seed(user_data, history)
+
+    user_fields, total_score, avg_time = _fold_user_batch(
+        store, user_data, old_scores, items, month_key, seed
+    )
+
+    for date_id, fields in items:
+        txn.set_score(user_id, date_id, fields)
+    days_by_month = update_month_aggregates(txn, store, user_id, month_docs, month_seeds, items)
+    delta = _score_delta(old_scores, items)
+    user_fields.update(_window_fields(user_data, all_time_seed, delta, days_by_month, week_key))
+    txn.set_user(user_id, user_fields)
+    changes = score_changes(old_scores, items)
+    write_user_sketch(txn, store, user_id, sketch_doc, history, changes)
+
+    return total_score, avg_time, board_totals(user_id, user_data, user_fields), changes
+
+
+@instrumented
 def process_user_daily_submission(
     user_id: str,
     time_seconds: float,
     mistakes: int,
     hints_used: int,
     difficulty: int,
-    date_str: str | None = None
+    date_str: str | None = None,
+    full_rescan: bool = False
 ):
-    daily_score = submit_daily_score(
-        user_id,
-        time_seconds,
-        mistakes,
-        hints_used,
-        difficulty,
-        date_str=date_str
-    )
+    """
+    Store a daily score and update the user's monthly summary.
+
+    By default the summary is updated incrementally in O(1) reads; with
+    SUBMIT_COALESCE_MS set it is written behind (services/write_coalescer.py).
+    Pass full_rescan=True to rebuild it from every score this month instead.
+    """
+    if SUBMIT_COALESCE_MS > 0 and not full_rescan:
+        # Imported here: the coalescer builds on this module
+        from .write_coalescer import submit_coalesced
+        return submit_coalesced(user_id, time_seconds, mistakes, hints_used, difficulty, date_str)
 
-    current_month_total, avg_time = update_user_summary(user_id)
+    if full_rescan:
+        daily_score = submit_daily_score(
+            user_id,
+            time_seconds,
+            mistakes,
+            hints_used,
+            difficulty,
+            date_str=date_str
+        )
+        current_month_total, avg_time = update_user_summary(user_id)
+        rebuild_month_aggregate(user_id, month_of(date_str or today_id()))
+        current_rank = rank_of(user_id, current_month_total)
+    else:
+        store = get_storage()
+        date_id = date_str if date_str else today_id()
+        fields = _score_fields(store, date_id, time_seconds, mistakes, hints_used, difficulty)
+
+        current_month_total, avg_time, window_totals, changes = store.run_transaction(
+            lambda txn: _apply_user_batch(txn, store, user_id, [(date_id, fields)])
+        )
+        daily_score = fields["dailyScore"]
+        current_rank = _after_summary_change(
+            user_id, current_month_total, avg_time, window_totals, changes
+        )
 
     return {
         "dailyScore": daily_score,
         "currentMonthTotal": current_month_total,
-        "averageTime": avg_time
+        "averageTime": avg_time,
+        "currentRank": current_rank
     }
 
+
+@instrumented
+async def process_user_daily_submission_async(
+    user_id: str,
+    time_seconds: float,
+    mistakes: int,
+    hints_used: int,
+    difficulty: int,
+    date_str: str | None = None
+):
+    """Async version of process_user_daily_submission for the ASGI app."""
+    if SUBMIT_COALESCE_MS > 0:
+        from .write_coalescer import submit_coalesced_async
+        return await submit_coalesced_async(
+            user_id, time_seconds, mistakes, hints_used, difficulty, date_str
+        )
+
+    store = get_async_storage()
+    date_id = date_str if date_str else today_id()
+    fields = _score_fields(store, date_id, time_seconds, mistakes, hints_used, difficulty)
+
+    current_month_total, avg_time, window_totals, changes = await store.run_transaction(
+        lambda txn: _apply_user_batch_async(txn, store, user_id, [(date_id, fields)])
+    )
+    current_rank = await asyncio.to_thread(
+        _after_summary_change, user_id, current_month_total, avg_time, window_totals, changes
+    )
+
+    return {
+        "dailyScore": fields["dailyScore"],
+        "currentMonthTotal": current_month_total,
+        "averageTime": avg_time,
+        "currentRank": current_rank
+    }
+
+
+def _group_submissions(store, submissions):
+    """
+    Validate API-shaped submissions and group them by user.
+
+    Returns (results, groups) where results has one entry per input item
+    (errors already filled in) and groups maps user_id to a list of
+    (index, date_id, fields).
+    """
+    if len(submissions) > MAX_BATCH_SUBMISSIONS:
+        raise ValueError(f"At most {MAX_BATCH_SUBMISSIONS} submissions per batch")
+
+    results = []
+    groups = {}
+
+    for index, item in enumerate(submissions):
+        try:
+            user_id = item["userId"]
+            date_id = item.get("date") or today_id()
+            # Date ids name documents and are compared as text, so only
+            # a real date written as YYYY-MM-DD will do
+            if date.fromisoformat(date_id).isoformat() != date_id:
+                raise ValueError(f"date must be YYYY-MM-DD, got {date_id!r}")
+            fields = _score_fields(
+                store,
+                date_id,
+                float(item["timeSeconds"]),
+                int(item["mistakes"]),
+                int(item["hintsUsed"]),
+                int(item["difficulty"])
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            results.append({"index": index, "ok": False, "error": f"invalid submission: {e}"})
+            continue
+
+        results.append({"index": index, "ok": True, "userId": user_id, "date": date_id,
+                        "dailyScore": fields["dailyScore"]})
+        groups.setdefault(user_id, []).append((index, date_id, fields))
+
+    return results, groups
+
+
+def _record_user_result(results, summaries, user_id, group, outcome):
+    if isinstance(outcome, Exception):
+        for index, _, _ in group:
+            results[index] = {"index": index, "ok": False, "userId": user_id,
+                              "error": str(outcome)}
+        return
+    current_month_total, avg_time, window_totals, changes = outcome
+    summaries[user_id] = {
+        "currentMonthTotal": current_month_total,
+        "averageTime": avg_time,
+        "currentRank": _after_summary_change(
+            user_id, current_month_total, avg_time, window_totals, changes
+        )
+    }
+
+
+@instrumented
+def process_user_daily_submissions(submissions: list[dict]):
+    """
+    Bulk/backfill ingestion: store many submissions, grouped per user.
+
+    Each item uses the /submit body shape (userId, timeSeconds, mistakes,
+    hintsUsed, difficulty, optional date). Every affected user gets one
+    transaction that writes all of their scores and updates their summary
+    exactly once. Returns per-item results plus the final per-user totals.
+    """
+    store = get_storage()
+    results, groups = _group_submissions(store, submissions)
+    summaries = {}
+
+    for user_id, group in groups.items():
+        items = [(date_id, fields) for _, date_id, fields in group]
+        try:
+            outcome = store.run_transaction(
+                lambda txn: _apply_user_batch(txn, store, user_id, items)
+            )
+        except Exception as e:
+            outcome = e
+        _record_user_result(results, summaries, user_id, group, outcome)
+
+    return {"results": results, "users": summaries}
+
+
+@instrumented
+async def process_user_daily_submissions_async(submissions: list[dict]):
+    """Async version of process_user_daily_submissions; users run concurrently."""
+    store = get_async_storage()
+    results, groups = _group_submissions(store, submissions)
+    summaries = {}
+
+    async def _run(user_id, group):
+        items = [(date_id, fields) for _, date_id, fields in group]
+        return await store.run_transaction(
+            lambda txn: _apply_user_batch_async(txn, store, user_id, items)
+        )
+
+    outcomes = await asyncio.gather(
+        *(_run(user_id, group) for user_id, group in groups.items()),
+        return_exceptions=True
+    )
+    for (user_id, group), outcome in zip(groups.items(), outcomes):
+        await asyncio.to_thread(_record_user_result, results, summaries, user_id, group, outcome)
+
+    return {"results": results, "users": summaries}
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 def today_id() -> str:
     """Return ISO date like '2025-01-14' for doc ID."""
@@ -9,3 +9,37 @@ def start_of_month():
     """Return datetime object for the first day of the current month."""
     now = datetime.now()
     return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def month_of(date_id: str) -> str:
+    """Return the 'YYYY-MM' month a 'YYYY-MM-DD' date id belongs to."""
+    return date_id[:7]
+
+
+def previous_month(month: str) -> str:
+    """Return the 'YYYY-MM' month before a 'YYYY-MM' month."""
+    year, number = map(int, month.split("-"))
+    return f"{year - (number == 1)}-{(number - 2) % 12 + 1:02d}"
+
+
+def next_month(month: str) -> str:
+    """Return the 'YYYY-MM' month after a 'YYYY-MM' month."""
+    year, number = map(int, month.split("-"))
+    return f"{year + number // 12}-{number % 12 + 1:02d}"
+
+
+def month_date_range(month: str):
+    """First and last possible date ids of a 'YYYY-MM' month (ids sort as text)."""
+    return f"{month}-01", f"{month}-31"
+
+
+def week_of(date_id: str) -> str:
+    """Return the ISO week 'YYYY-Www' (Monday to Sunday) a date id belongs to."""
+    year, week, _ = date.fromisoformat(date_id).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def week_date_range(week: str):
+    """First and last date ids (Monday, Sunday) of a 'YYYY-Www' week."""
+    monday = datetime.strptime(f"{week}-1", "%G-W%V-%u").date()
+    return monday.isoformat(), (monday + timedelta(days=6)).isoformat()
@@ -0,0 +1,287 @@
+"""
+Precomputed weekly, monthly and all-time leaderboards.
+
+Each window has one document, leaderboards/{week|month|all}, holding the
+top LEADERBOARD_TOP_K users of its current period. Showing a board costs
+one read, however many users there are.
+
+The window totals themselves live on the user documents (weekTotal and
+summaryWeek, currentMonthTotal and summaryMonth, allTimeTotal). The
+submission transactions fold them in. Afterwards _after_summary_change
+hands the new totals to update_window_boards(). Every submission would
+otherwise write the same three documents, past Firestore's sustained rate
+of about one write per second per document. So the totals are queued, the
+latest per user, and a daemon thread moves everyone queued within the
+boards in one transaction every WINDOW_BOARD_FLUSH_SECONDS. With several
+worker processes each flushes on its own, so raise the interval with the
+worker count.
+
+A board's entries are always the exact top of its window. While
+`complete` is set, they are everyone with a positive total. Once a board
+has been trimmed to K entries, everyone outside it ranks after its last
+entry. A user who falls below that line is dropped, not guessed at. If
+that leaves fewer than K/2 entries, the board is rebuilt from a scan of
+the users. rebuild_window_boards() does the same rebuild as a repair
+tool. A board whose period has ended (last week's) reads as empty, and
+the next submission resets it.
+"""
+import atexit
+import logging
+import threading
+import time
+from config.settings import LEADERBOARD_CACHE_TTL, LEADERBOARD_TOP_K, WINDOW_BOARD_FLUSH_SECONDS
+from .data_version import bump_version, current_version
+from .instrumentation import instrumented
+from .leaderboard import LeaderboardCache
+from .storage import get_storage
+from .utils import month_of, today_id, week_of
+
+logger = logging.getLogger(__name__)
+
+WINDOWS = ("week", "month", "all")
+
+# User document fields holding each window's total and, for windows that
+# reset, the period that total belongs to
+_WINDOW_FIELDS = {
+    "week": ("weekTotal", "summaryWeek"),
+    "month": ("currentMonthTotal", "summaryMonth"),
+    "all": ("allTimeTotal", None),
+}
+
+_cache = LeaderboardCache(LEADERBOARD_CACHE_TTL)
+
+
+def current_period(window: str) -> str:
+    """'YYYY-Www', 'YYYY-MM' or 'all', on the same clock as today_id()."""
+    today = today_id()
+    return {"week": week_of(today), "month": month_of(today), "all": "all"}[window]
+
+
+def _sort_key(entry):
+    return (-entry["total"], entry["userId"])
+
+
+def _stored(board):
+    if not board:
+        return None
+    return {
+        "period": board.get("period"),
+        "entries": board.get("entries", []),
+        "complete": board.get("complete", True),
+    }
+
+
+def apply_board_change(board, period, user_id, username, total, k=LEADERBOARD_TOP_K):
+    """
+    Return (board, changed): the stored board document (or None) with
+    user_id moved to `total`. The argument isn't modified.
+    """
+    stored = _stored(board)
+    if stored and stored["period"] > period:
+        # Folded just before the period turned over; the board has moved on
+        return stored, False
+    if not stored or stored["period"] != period:
+        current = {"period": period, "entries": [], "complete": True}
+    else:
+        current = stored
+
+    entries, complete = current["entries"], current["complete"]
+    # Everyone outside an incomplete board ranks after its last entry
+    bound = _sort_key(entries[-1]) if entries and not complete else None
+
+    kept = [entry for entry in entries if entry["userId"] != user_id]
+    entry = {"userId": user_id, "username": username, "total": total}
+    if total > 0 and (bound is None or _sort_key(entry) < bound):
+        kept.append(entry)
+        kept.sort(key=_sort_key)
+    if len(kept) > k:
+        kept, complete = kept[:k], False
+
+    updated = {"period": period, "entries": kept, "complete": complete}
+    return updated, updated != stored
+
+
+def board_totals(user_id, user_data, user_fields):
+    """
+    What update_window_boards() needs from a committed summary:
+    {"username", window: (period, total)}. `user_fields` are the summary
+    fields just written, `user_data` the document they were folded into.
+    """
+    totals = {"username": user_data.get("username", user_id)}
+    for window, (total_field, period_field) in _WINDOW_FIELDS.items():
+        period = user_fields[period_field] if period_field else "all"
+        totals[window] = (period, user_fields[total_field])
+    return totals
+
+
+def apply_window_board_changes(changes: dict, k: int = LEADERBOARD_TOP_K):
+    """
+    Move users within every window's board after their totals changed, in
+    one transaction. `changes` maps user_id to board_totals(). Boards none
+    of them can reach are read but not written. Returns whether any board
+    was written.
+    """
+    store = get_storage()
+
+    def _update(txn):
+        boards = {window: txn.get_doc("leaderboards", window) for window in WINDOWS}
+        short, written = [], False
+        for window, board in boards.items():
+            changed = False
+            for user_id, totals in changes.items():
+                period, total = totals[window]
+                board, moved = apply_board_change(board, period, user_id, totals["username"], total, k)
+                changed = changed or moved
+            if changed:
+                txn.set_doc("leaderboards", window, {**board, "updatedAt": store.server_timestamp})
+                written = True
+            if not board["complete"] and len(board["entries"]) < k // 2:
+                short.append(window)
+        return short, written
+
+    try:
+        short, written = store.run_transaction(_update)
+    except Exception:
+        # The submissions themselves are committed; rebuild_window_boards() repairs
+        logger.exception("Updating the window leaderboards for %s failed", ", ".join(changes))
+        return False
+    finally:
+        _cache.invalidate()
+
+    if short:
+        rebuild_window_boards(short, k)
+    return written or bool(short)
+
+
+class BoardUpdater:
+    """
+    Latest board_totals() per user, applied to the boards by a daemon
+    thread at most once every `interval` seconds.
+    """
+
+    def __init__(self, interval: float, k: int = LEADERBOARD_TOP_K):
+        self.interval = interval
+        self.k = k
+        self.flushes = 0
+        self.updates = 0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def queue(self, user_id, totals):
+        with self._cond:
+            # A later change for the same user replaces the earlier one
+            self._pending[user_id] = totals
+            self.updates += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="window-boards", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.interval)
+            self.flush()
+
+    @instrumented
+    def flush(self):
+        """Apply everything queued so far. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self.flushes += 1
+                if apply_window_board_changes(pending, self.k):
+                    # After the submissions bumped it, so board ETags move on too
+                    bump_version()
+
+    def stats(self):
+        with self._cond:
+            queued = len(self._pending)
+        return {
+            "flushIntervalSeconds": self.interval,
+            "updates": self.updates,
+            "flushes": self.flushes,
+            "queued": queued,
+        }
+
+
+_updater = BoardUpdater(WINDOW_BOARD_FLUSH_SECONDS)
+atexit.register(_updater.flush)
+
+
+def update_window_boards(user_id: str, totals: dict):
+    """
+    Move one user within every window's board after their totals changed:
+    queued for the next batch, or right away with WINDOW_BOARD_FLUSH_SECONDS=0.
+    """
+    if _updater.interval > 0:
+        _updater.queue(user_id, totals)
+    else:
+        apply_window_board_changes({user_id: totals})
+
+
+def flush_window_boards():
+    """Apply every queued board change now, e.g. before reading the boards in a test."""
+    _updater.flush()
+
+
+@instrumented
+def rebuild_window_boards(windows=WINDOWS, k: int = LEADERBOARD_TOP_K):
+    """
+    Repair mode: scan every user and rewrite the given boards from their
+    stored window totals. Users whose summary predates allTimeTotal join
+    the all-time board with their next submission.
+    """
+    store = get_storage()
+    periods = {window: current_period(window) for window in windows}
+    fields = ["username"] + [field for window in windows for field in _WINDOW_FIELDS[window] if field]
+    candidates = {window: [] for window in windows}
+
+    for user_id, data in store.iter_users(fields=fields):
+        for window in windows:
+            total_field, period_field = _WINDOW_FIELDS[window]
+            total = data.get(total_field, 0)
+            if total > 0 and (period_field is None or data.get(period_field) == periods[window]):
+                candidates[window].append(
+                    {"userId": user_id, "username": data.get("username", user_id), "total": total}
+                )
+
+    for window in windows:
+        entries = sorted(candidates[window], key=_sort_key)
+        store.set_doc("leaderboards", window, {
+            "period": periods[window],
+            "entries": entries[:k],
+            "complete": len(entries) <= k,
+            "updatedAt": store.server_timestamp
+        })
+    _cache.invalidate()
+
+
+def _read_board(window, period):
+    board = get_storage().get_doc("leaderboards", window) or {}
+    entries = board.get("entries", []) if board.get("period") == period else []
+    return [{"rank": rank, **entry} for rank, entry in enumerate(entries, start=1)]
+
+
+@instrumented
+def get_window_leaderboard(window: str, limit: int | None = None):
+    """
+    Return {"window", "period", "entries"} for one precomputed board: up
+    to LEADERBOARD_TOP_K entries of rank, userId, username and total.
+    One document read, cached like the monthly leaderboard and never
+    older than current_version().
+    """
+    if window not in WINDOWS:
+        raise ValueError(f"unknown leaderboard window {window!r}; expected one of {', '.join(WINDOWS)}")
+    period = current_period(window)
+    entries = _cache.get((window, period), lambda: _read_board(window, period), current_version())
+    return {"window": window, "period": period, "entries": entries[:limit] if limit else entries}
+
+
+def window_leaderboard_stats():
+    return {**_cache.stats(), "updates": _updater.stats()}
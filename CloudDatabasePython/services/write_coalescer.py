@@ -0,0 +1,351 @@
+"""
+Write-behind coalescing for bursty /submit traffic.
+
+With SUBMIT_COALESCE_MS > 0 a submission is split in two:
+
+  1. The score document is written straight away in a small transaction
+     that also reads the previous score for that date. That transaction
+     only touches users/{id}/scores/{date}, so submitters never contend on
+     the user document. Once it commits, the score is durable.
+  2. The summary change (old score -> new score) is queued in memory. A
+     background flusher waits one window, merges everything queued for
+     each user, and commits the users' summaries and month aggregates in
+     a few batched transactions. _after_summary_change then runs once per
+     user per flush instead of once per submission.
+
+The request waits for its flush (group commit), so the response still
+carries the committed monthly total and rank.
+
+Two submissions for the same date can commit their scores in one order
+and reach the queue in the other. Each queued change therefore keeps the
+old score its own transaction replaced, and the totals are folded from
+those (old, new) pairs, which add up the same in any order. The month
+aggregates' days are set from the score documents as re-read by the
+flush, not from whichever submission was queued last. A first flush that
+seeds a user's totals from a scan must not see a score whose change is
+still on its way to the queue, so writing a score and queueing its change
+happen under a lock (one of a few stripes, by user) that the flush holds
+while it takes and commits that user.
+
+That lock, like the queue, belongs to one process. With several workers
+(gunicorn.conf.py) a seeding scan in one worker can still see a score
+that another worker has written but not yet queued, and that score is
+then counted twice in the user's monthly total. Only a user's first
+flush of a month seeds, so the window is small, but run coalescing in
+a single worker process, or repair with update_user_summary().
+
+If the process dies between the two steps the scores are safe but the
+summaries lag behind them; update_user_summary() / rebuild_month_aggregate()
+repair a user, and the next month's seeding rescans scores anyway.
+"""
+import asyncio
+import atexit
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from config.settings import COALESCE_USERS_PER_COMMIT, SUBMIT_COALESCE_MS
+from .instrumentation import instrumented
+from .leaderboard import rank_of
+from .monthly_aggregates import read_month_aggregates, rebuild_month_aggregate, update_month_aggregates
+from .score_stats import read_user_sketch, record_day_sketches, write_user_sketch
+from .storage import StorageUnavailable, get_async_storage, get_storage
+from .user_summary import (
+    _after_summary_change,
+    _current_month,
+    _current_week,
+    _fold_user_batch,
+    _fold_user_changes,
+    _all_time_seed,
+    _changes_delta,
+    _needs_seed,
+    _read_history,
+    _rescan_month,
+    _score_fields,
+    _window_dates,
+    _window_fields,
+    update_user_summary,
+)
+from .utils import month_of, today_id
+from .window_leaderboards import board_totals
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingUser:
+    """Everything queued for one user since the last flush."""
+
+    def __init__(self):
+        # (date_id, old, new) per committed score write, in queue order,
+        # which need not be the order they committed in
+        self.changes = []
+        self.futures = []
+
+    @property
+    def date_ids(self):
+        return list(dict.fromkeys(date_id for date_id, _, _ in self.changes))
+
+
+def _write_score(txn, user_id, date_id, fields):
+    old_data = txn.get_score(user_id, date_id)
+    txn.set_score(user_id, date_id, fields)
+    return old_data
+
+
+async def _write_score_async(txn, user_id, date_id, fields):
+    old_data = await txn.get_score(user_id, date_id)
+    txn.set_score(user_id, date_id, fields)
+    return old_data
+
+
+def _fold_pending(txn, store, user_id, pending, month_key, week_key):
+    """
+    Read phase for one user's flush; returns a function that does the
+    writes (Firestore needs all of a transaction's reads before its writes).
+    """
+    user_data = txn.get_user(user_id) or {}
+    date_ids = pending.date_ids
+    # The scores as they stand now, whatever order their writes were queued in
+    final_scores = txn.get_scores(user_id, date_ids)
+    items = [(date_id, final_scores[date_id]) for date_id in date_ids if date_id in final_scores]
+    month_docs, month_seeds = read_month_aggregates(txn, user_id, _window_dates(date_ids, week_key))
+    sketch_doc = read_user_sketch(txn, user_id)
+    history = _read_history(txn, user_id, user_data, sketch_doc)
+    all_time_seed = _all_time_seed(user_data, history)
+
+    changes = pending.changes
+    if _needs_seed(user_data, month_key):
+        # The rescan already includes the queued scores (they are written),
+        # so fold them as overwrites of their own final values: net zero
+        seed = _rescan_month(txn.iter_month_scores(user_id, month_key))
+        user_fields, total_score, avg_time = _fold_user_batch(
+            store, user_data, dict(items), items, month_key, seed
+        )
+    else:
+        user_fields, total_score, avg_time = _fold_user_changes(
+            store, user_data, changes, month_key
+        )
+    # Likewise, an all-time rescan already counts the queued scores, and
+    # so does a sketch seeded from it
+    delta = 0 if all_time_seed is not None else _changes_delta(changes)
+    sketch_changes = changes if sketch_doc is not None else []
+
+    def write():
+        days_by_month = update_month_aggregates(
+            txn, store, user_id, month_docs, month_seeds, items
+        )
+        user_fields.update(_window_fields(user_data, all_time_seed, delta, days_by_month, week_key))
+        txn.set_user(user_id, user_fields)
+        write_user_sketch(txn, store, user_id, sketch_doc, history, sketch_changes)
+        return total_score, avg_time, board_totals(user_id, user_data, user_fields), changes
+
+    return write
+
+
+# Locks striped by user id for writing a score and queueing its change
+LOCK_STRIPES = 64
+
+# Longest a submitter waits for its stripe (a flush holds it while it commits)
+WRITER_LOCK_WAIT = 30.0
+
+
+def _flush_chunk(txn, store, chunk):
+    month_key, week_key = _current_month(), _current_week()
+    writes = [(user_id, _fold_pending(txn, store, user_id, pending, month_key, week_key))
+              for user_id, pending in chunk]
+    return {user_id: write() for user_id, write in writes}
+
+
+class SummaryCoalescer:
+    """
+    Queue of per-user summary changes, flushed every `window` seconds by a
+    daemon thread. submit() returns a Future resolved with the user's
+    committed {"currentMonthTotal", "averageTime", "currentRank"}.
+    """
+
+    def __init__(self, window: float, users_per_commit: int = COALESCE_USERS_PER_COMMIT):
+        self.window = window
+        self.users_per_commit = users_per_commit
+        self.flushes = 0
+        self.submissions = 0
+        self.user_commits = 0
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._thread = None
+
+    def writer_lock(self, user_id) -> threading.Lock:
+        """Hold while writing a user's score and until submit() has queued it."""
+        return self._stripes[hash(user_id) % LOCK_STRIPES]
+
+    @contextlib.contextmanager
+    def _holding(self, user_ids):
+        # In index order, so two flushes can't deadlock (flushes are serial
+        # anyway); submitters only ever hold one stripe
+        stripes = sorted({hash(user_id) % LOCK_STRIPES for user_id in user_ids})
+        with contextlib.ExitStack() as stack:
+            for index in stripes:
+                stack.enter_context(self._stripes[index])
+            yield
+
+    def submit(self, user_id, date_id, old_data, fields) -> Future:
+        future = Future()
+        with self._cond:
+            pending = self._pending.setdefault(user_id, _PendingUser())
+            pending.changes.append((date_id, old_data, fields))
+            pending.futures.append(future)
+            self.submissions += 1
+            self._ensure_thread()
+            self._cond.notify()
+        return future
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="summary-coalescer", daemon=True)
+            self._thread.start()
+
+    def _queued_users(self):
+        with self._cond:
+            return list(self._pending)
+
+    def _take(self, user_ids):
+        with self._cond:
+            return [(user_id, self._pending.pop(user_id)) for user_id in user_ids if user_id in self._pending]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # Let the rest of the burst arrive before committing
+            time.sleep(self.window)
+            self.flush()
+
+    @instrumented
+    def flush(self):
+        """Commit everything queued so far. Safe to call from any thread."""
+        # One flush at a time, so a user's changes are never folded twice
+        with self._flush_lock:
+            self._flush(self._queued_users())
+
+    def _flush(self, user_ids):
+        if not user_ids:
+            return
+        self.flushes += 1
+        store = get_storage()
+
+        for start in range(0, len(user_ids), self.users_per_commit):
+            # Every score these users have committed is queued by now, and
+            # no more can commit until their summaries have
+            users = user_ids[start:start + self.users_per_commit]
+            with self._holding(users):
+                chunk = self._take(users)
+                try:
+                    outcomes = store.run_transaction(lambda txn: _flush_chunk(txn, store, chunk))
+                except Exception:
+                    logger.exception("Coalesced summary commit failed; rescanning %d users", len(chunk))
+                    outcomes = {}
+
+            self.user_commits += len(chunk)
+            for user_id, pending_user in chunk:
+                self._settle(user_id, pending_user, outcomes.get(user_id))
+
+    def _settle(self, user_id, pending, outcome):
+        try:
+            if outcome is None:
+                # The scores are committed; rebuild the summary from them
+                total_score, avg_time = update_user_summary(user_id)
+                for month in {month_of(date_id) for date_id in pending.date_ids}:
+                    rebuild_month_aggregate(user_id, month)
+                record_day_sketches(pending.changes)
+                rank = rank_of(user_id, total_score)
+            else:
+                total_score, avg_time, window_totals, changes = outcome
+                rank = _after_summary_change(
+                    user_id, total_score, avg_time, window_totals, changes
+                )
+        except Exception as e:
+            for future in pending.futures:
+                future.set_exception(e)
+            return
+
+        summary = {"currentMonthTotal": total_score, "averageTime": avg_time, "currentRank": rank}
+        for future in pending.futures:
+            future.set_result(dict(summary))
+
+    def stats(self):
+        with self._cond:
+            queued = sum(len(pending.changes) for pending in self._pending.values())
+        return {
+            "windowMs": self.window * 1000,
+            "submissions": self.submissions,
+            "flushes": self.flushes,
+            "userCommits": self.user_commits,
+            "queued": queued,
+        }
+
+
+_coalescer = SummaryCoalescer(SUBMIT_COALESCE_MS / 1000)
+atexit.register(_coalescer.flush)
+
+# Async submitters wait for their stripe here, not on the default executor,
+# which the stripe's holder may need to finish its commit
+_lock_waiters = ThreadPoolExecutor(max_workers=LOCK_STRIPES, thread_name_prefix="coalescer-lock")
+
+
+def _writer_busy():
+    return StorageUnavailable("timed out waiting to queue the submission", retry_after=1)
+
+
+async def _acquire_async(lock):
+    """Acquire a threading.Lock from a coroutine, waiting at most WRITER_LOCK_WAIT."""
+    waiting = asyncio.get_running_loop().run_in_executor(_lock_waiters, lock.acquire, True, WRITER_LOCK_WAIT)
+    try:
+        acquired = await asyncio.shield(waiting)
+    except asyncio.CancelledError:
+        # The thread can't be interrupted; hand the lock back once it has it
+        waiting.add_done_callback(lambda done: done.result() and lock.release())
+        raise
+    if not acquired:
+        raise _writer_busy()
+
+
+def coalescer_stats():
+    return _coalescer.stats()
+
+
+def submit_coalesced(user_id, time_seconds, mistakes, hints_used, difficulty, date_str=None):
+    """process_user_daily_submission with the summary update written behind."""
+    store = get_storage()
+    date_id = date_str if date_str else today_id()
+    fields = _score_fields(store, date_id, time_seconds, mistakes, hints_used, difficulty)
+
+    lock = _coalescer.writer_lock(user_id)
+    if not lock.acquire(timeout=WRITER_LOCK_WAIT):
+        raise _writer_busy()
+    try:
+        old_data = store.run_transaction(lambda txn: _write_score(txn, user_id, date_id, fields))
+        future = _coalescer.submit(user_id, date_id, old_data, fields)
+    finally:
+        lock.release()
+    summary = future.result()
+    return {"dailyScore": fields["dailyScore"], **summary}
+
+
+async def submit_coalesced_async(user_id, time_seconds, mistakes, hints_used, difficulty, date_str=None):
+    """Async version of submit_coalesced for the ASGI app."""
+    store = get_async_storage()
+    date_id = date_str if date_str else today_id()
+    fields = _score_fields(store, date_id, time_seconds, mistakes, hints_used, difficulty)
+
+    lock = _coalescer.writer_lock(user_id)
+    await _acquire_async(lock)
+    try:
+        old_data = await store.run_transaction(lambda txn: _write_score_async(txn, user_id, date_id, fields))
+        future = _coalescer.submit(user_id, date_id, old_data, fields)
+    finally:
+        lock.release()
+    summary = await asyncio.wrap_future(future)
+    return {"dailyScore": fields["dailyScore"], **summary}
@@ -0,0 +1,36 @@
+"""
+Export or import users, scores and monthly aggregates as a local file.
+
+    python snapshot.py export backup.ndjson.gz
+    python snapshot.py export scores.parquet          # needs pyarrow
+    python snapshot.py import backup.ndjson.gz
+
+The format follows the extension unless --format is given. Uses the
+configured STORAGE_BACKEND, so a Firestore export can be imported into
+SQLite (STORAGE_BACKEND=sqlite) for offline analytics and back again.
+"""
+import argparse
+import json
+import logging
+from services.snapshot import export_snapshot, import_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=["ndjson", "parquet"])
+    parser.add_argument("--workers", type=int, default=8,
+                        help="parallel per-user reads (export) or batch commits (import)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        counts = export_snapshot(args.path, args.format, args.workers)
+    else:
+        counts = import_snapshot(args.path, args.format, args.workers)
+    print(json.dumps(counts))
+
+
+if __name__ == "__main__":
+    main()
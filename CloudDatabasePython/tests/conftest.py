@@ -0,0 +1,25 @@
+import os
+import pytest
+
+# Behaviour tests run on a fresh in-memory SQLite database each. Set before
+# config.settings is imported, which reads these once; caches are off so
+# every read sees the test's own writes.
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = ":memory:"
+os.environ["LEADERBOARD_CACHE_TTL"] = "0"
+os.environ["DATA_VERSION_TTL"] = "0"
+os.environ["SUBMIT_COALESCE_MS"] = "0"
+os.environ["WINDOW_BOARD_FLUSH_SECONDS"] = "0"
+
+
+@pytest.fixture
+def store():
+    from services.idempotency import _cache as idempotency_cache
+    from services.sqlite_storage import SQLiteStorage
+    from services.storage import set_storage
+
+    storage = SQLiteStorage(":memory:")
+    set_storage(storage)
+    idempotency_cache.clear()
+    yield storage
+    set_storage(None)
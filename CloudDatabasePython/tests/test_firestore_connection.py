@@ -1,5 +1,6 @@
 from google.cloud import firestore
 import os
+import pytest
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -8,7 +9,8 @@ load_dotenv()
 # Check for service account path
 cred_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
 if not cred_path:
-    raise ValueError("GOOGLE_APPLICATION_CREDENTIALS environment variable not set")
+    # A live connection check, not a unit test: skip it where no project is configured
+    pytest.skip("GOOGLE_APPLICATION_CREDENTIALS environment variable not set", allow_module_level=True)
 
 print(f"Using service account: {cred_path}")
 
@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from services.idempotency import (
+    IdempotencyCache,
+    IdempotencyConflict,
+    IdempotencyInProgress,
+    run_idempotent,
+    submission_key,
+)
+from services.user_summary import process_user_daily_submission
+from services.utils import month_of, today_id
+
+
+def _submit(user_id, time_seconds, date_id=None, mistakes=0):
+    return process_user_daily_submission(user_id, time_seconds, mistakes, 0, 3, date_str=date_id)
+
+
+def _month_day(day):
+    return f"{month_of(today_id())}-{day:02d}"
+
+
+def test_idempotent_replay_returns_the_first_result(store):
+    body = {"userId": "ann", "timeSeconds": 100, "mistakes": 0, "hintsUsed": 0, "difficulty": 3,
+            "date": _month_day(1)}
+    key = submission_key(body, "retry-1")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return _submit("ann", 100, _month_day(1))
+
+    first, replayed_first = run_idempotent(key, body, compute)
+    second, replayed_second = run_idempotent(key, body, compute)
+
+    assert (replayed_first, replayed_second) == (False, True)
+    assert second == first and len(calls) == 1
+    assert store.get_user("ann")["currentMonthCount"] == 1
+
+    with pytest.raises(IdempotencyConflict):
+        run_idempotent(key, {**body, "timeSeconds": 50}, compute)
+
+
+def test_idempotent_failure_is_not_replayed(store):
+    body = {"userId": "ann", "timeSeconds": 100, "date": _month_day(1)}
+    key = submission_key(body, "retry-2")
+
+    def fail():
+        raise RuntimeError("storage went away")
+
+    with pytest.raises(RuntimeError):
+        run_idempotent(key, body, fail)
+    assert run_idempotent(key, body, lambda: {"ok": True}) == ({"ok": True}, False)
+
+
+def test_retry_stops_waiting_for_a_first_attempt_that_hangs():
+    cache = IdempotencyCache(ttl=60, max_keys=10, wait=0.01)
+    key = ("ann", "2026-01-01", "retry-3")
+    first, _ = cache._claim(key, "body")
+
+    async def unused():
+        raise AssertionError("a retry must not compute")
+
+    with pytest.raises(IdempotencyInProgress):
+        cache.run(key, "body", lambda: {"ok": False})
+    with pytest.raises(IdempotencyInProgress):
+        asyncio.run(cache.run_async(key, "body", unused))
+
+    # Giving up didn't cancel the first attempt, which can still finish
+    first.set_result({"ok": True})
+    assert cache.run(key, "body", lambda: {"ok": False}) == ({"ok": True}, True)
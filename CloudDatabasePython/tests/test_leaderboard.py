@@ -0,0 +1,44 @@
+from services.leaderboard import get_current_month_leaderboard, rank_of
+from services.user_summary import process_user_daily_submission
+from services.utils import month_of, today_id
+
+
+def _submit(user_id, time_seconds, date_id=None, mistakes=0):
+    return process_user_daily_submission(user_id, time_seconds, mistakes, 0, 3, date_str=date_id)
+
+
+def _positions():
+    return {entry["userId"]: entry["rank"] for entry in get_current_month_leaderboard()}
+
+
+def _month_day(day):
+    return f"{month_of(today_id())}-{day:02d}"
+
+
+def test_submission_rank_is_its_leaderboard_position(store):
+    for user_id in ("ann", "bob", "cat", "dan"):
+        store.set_user(user_id, {"username": user_id.title()})
+
+    # Includes a tie (ann and bob, broken by user id) and a resubmission
+    # that moves cat from first to last
+    for user_id, time_seconds, day in [("cat", 10, 1), ("bob", 200, 1), ("ann", 200, 1),
+                                       ("dan", 100, 2), ("cat", 1900, 1)]:
+        result = _submit(user_id, time_seconds, _month_day(day))
+        positions = _positions()
+        assert result["currentRank"] == positions[user_id]
+        for other, rank in positions.items():
+            total = store.get_user(other)["currentMonthTotal"]
+            assert rank_of(other, total) == rank
+
+    assert list(_positions()) == ["dan", "ann", "bob", "cat"]
+    # Counted on read, never stored, so it can't go stale
+    assert not any("currentRank" in store.get_user(user_id) for user_id in ("ann", "bob", "cat", "dan"))
+
+
+def test_users_on_zero_are_ranked_where_they_are_listed(store):
+    _submit("ann", 100, _month_day(1))
+    # A backfill for last year leaves bob on the board with nothing this month
+    result = _submit("bob", 100, f"{int(today_id()[:4]) - 1}-01-01")
+
+    assert result["currentMonthTotal"] == 0
+    assert result["currentRank"] == _positions()["bob"] == 2
@@ -0,0 +1,63 @@
+from services.monthly_rollover import run_monthly_rollover
+from services.user_summary import process_user_daily_submission, verify_user_summary
+from services.utils import month_of, next_month, previous_month, today_id
+
+
+def _submit(user_id, time_seconds, date_id=None, mistakes=0):
+    return process_user_daily_submission(user_id, time_seconds, mistakes, 0, 3, date_str=date_id)
+
+
+def _month_day(day):
+    return f"{month_of(today_id())}-{day:02d}"
+
+
+def _month_doc(store, user_id, month):
+    return dict(store.iter_user_months(user_id))[month]
+
+
+def test_rollover_finalizes_each_month_with_its_rank(store):
+    for user_id, time_seconds in [("ann", 400), ("bob", 100), ("cat", 250)]:
+        _submit(user_id, time_seconds, _month_day(1))
+    month = month_of(today_id())
+    # Run at the start of the next month, which names the rollover
+    rollover_id = next_month(month)
+    totals = {user_id: store.get_user(user_id)["currentMonthTotal"] for user_id in ("ann", "bob", "cat")}
+
+    assert run_monthly_rollover(rollover_id, progress=None) == 3
+
+    for user_id, rank in {"bob": 1, "cat": 2, "ann": 3}.items():
+        data = store.get_user(user_id)
+        assert data["lastMonthTotal"] == totals[user_id]
+        assert data["currentMonthTotal"] == 0
+        aggregate = _month_doc(store, user_id, month)
+        assert (aggregate["finalized"], aggregate["finalTotal"], aggregate["finalRank"]) == (True, totals[user_id], rank)
+
+    # Running it again with the same id changes nothing
+    assert run_monthly_rollover(rollover_id, progress=None) == 3
+    assert store.get_user("bob")["lastMonthTotal"] == totals["bob"]
+
+
+def test_rollover_leaves_counters_already_on_the_new_month_alone(store, monkeypatch):
+    month = month_of(today_id())
+    closed = previous_month(month)
+
+    def submit_on(user_id, date_id, time_seconds):
+        monkeypatch.setattr("services.user_summary.today_id", lambda: date_id)
+        return _submit(user_id, time_seconds)
+
+    ann_closed = submit_on("ann", f"{closed}-20", 100)["currentMonthTotal"]
+    bob_closed = submit_on("bob", f"{closed}-20", 500)["currentMonthTotal"]
+    # ann plays on the 1st before the rollover runs, and ends up below bob
+    # on the board by her new month's total
+    first = submit_on("ann", f"{month}-01", 1900)["currentMonthTotal"]
+    assert first < bob_closed < ann_closed
+
+    assert run_monthly_rollover(month, progress=None) == 2
+    second = submit_on("ann", f"{month}-02", 1900)["currentMonthTotal"]
+
+    data = store.get_user("ann")
+    assert verify_user_summary("ann")["ok"]
+    assert (second, data["currentMonthCount"], data["lastMonthTotal"]) == (2 * first, 2, ann_closed)
+    for user_id, total, rank in [("ann", ann_closed, 1), ("bob", bob_closed, 2)]:
+        aggregate = _month_doc(store, user_id, closed)
+        assert (aggregate["finalized"], aggregate["finalTotal"], aggregate["finalRank"]) == (True, total, rank)
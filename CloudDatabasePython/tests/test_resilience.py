@@ -0,0 +1,106 @@
+import sqlite3
+import time
+import pytest
+from services.resilient_storage import CircuitBreaker, ResiliencePolicy, ResilientStorage
+from services.sqlite_storage import SQLiteStorage
+from services.storage import StorageUnavailable
+
+
+def _resilient(failures=2, cooldown=60.0):
+    storage = SQLiteStorage(":memory:")
+    policy = ResiliencePolicy(storage.transient_errors, attempts=1, base_delay=0,
+                              breaker=CircuitBreaker(failures, cooldown))
+    return ResilientStorage(storage, policy), policy.breaker
+
+
+def _locked():
+    raise sqlite3.OperationalError("database is locked")
+
+
+def test_breaker_opens_after_consecutive_failures_and_rejects_until_cooldown():
+    store, breaker = _resilient(failures=2)
+
+    for _ in range(2):
+        with pytest.raises(StorageUnavailable):
+            store._call("get_doc", _locked)
+    assert breaker.state == "open"
+
+    calls = []
+    with pytest.raises(StorageUnavailable, match="circuit is open"):
+        store._call("get_doc", lambda: calls.append(1))
+    assert calls == [] and breaker.stats()["rejected"] == 1
+
+
+def test_half_open_breaker_lets_one_probe_through():
+    breaker = CircuitBreaker(failures=1, cooldown=0)
+    breaker.record_failure()
+
+    probe = breaker.allow()
+    assert probe and breaker.state == "half-open"
+    assert breaker.allow() is None
+
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow() == 0
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(failures=5, cooldown=0)
+    for _ in range(5):
+        breaker.record_failure()
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.stats()["opened"] == 2
+
+
+def test_probe_ending_in_a_non_transient_error_does_not_wedge_the_breaker():
+    store, breaker = _resilient(failures=1, cooldown=0)
+    with pytest.raises(StorageUnavailable):
+        store._call("get_doc", _locked)
+
+    with pytest.raises(KeyError):
+        store._call("get_doc", lambda: {}["missing"])
+    assert breaker.state == "open"
+
+    # The next call probes again instead of being rejected for good
+    assert store.get_doc("meta", "missing") is None
+    assert breaker.state == "closed"
+
+
+def test_abandoned_stream_releases_its_probe():
+    store, breaker = _resilient(failures=1, cooldown=0)
+    store.storage.set_user("ann", {"currentMonthTotal": 10})
+    store.storage.set_user("bob", {"currentMonthTotal": 5})
+    with pytest.raises(StorageUnavailable):
+        store._call("get_doc", _locked)
+
+    rows = store.iter_users()
+    next(rows)
+    rows.close()
+    assert breaker.state == "open"
+
+    assert [user_id for user_id, _ in store.iter_users()] == ["ann", "bob"]
+    assert breaker.state == "closed"
+
+
+def test_full_leaderboard_read_is_hedged(monkeypatch):
+    store, _ = _resilient()
+    store.resilience.hedge_after = 0.01
+    store.storage.set_user("ann", {"currentMonthTotal": 10})
+    store.storage.set_user("bob", {"currentMonthTotal": 5})
+
+    # The first attempt stalls, so the hedge answers
+    read = store.storage.iter_leaderboard
+    attempts = []
+
+    def stall_first(*args):
+        attempts.append(1)
+        if len(attempts) == 1:
+            time.sleep(0.2)
+        return read(*args)
+
+    monkeypatch.setattr(store.storage, "iter_leaderboard", stall_first)
+    rows = store.iter_leaderboard()
+
+    assert isinstance(rows, list) and [user_id for user_id, _ in rows] == ["ann", "bob"]
+    assert (store.resilience.hedges, store.resilience.hedge_wins) == (1, 1)
@@ -0,0 +1,57 @@
+import random
+import numpy as np
+from services.scoring import (
+    SCORING_FORMULAS,
+    calculate_daily_score,
+    calculate_daily_scores,
+    rescore,
+)
+
+
+def _random_submissions(rng, n):
+    # Mix of realistic inputs and ones that push the score below zero
+    times = [rng.choice([rng.uniform(0, 300), rng.uniform(0, 5000), float(rng.randint(0, 3000))])
+             for _ in range(n)]
+    mistakes = [rng.randint(0, 30) for _ in range(n)]
+    hints = [rng.randint(0, 30) for _ in range(n)]
+    difficulty = [rng.randint(1, 5) for _ in range(n)]
+    return times, mistakes, hints, difficulty
+
+
+def test_batch_scores_match_scalar_scores():
+    rng = random.Random(310)
+
+    for version in SCORING_FORMULAS:
+        for _ in range(50):
+            times, mistakes, hints, difficulty = _random_submissions(rng, 200)
+
+            batch = calculate_daily_scores(times, mistakes, hints, difficulty, version=version)
+            scalar = [
+                calculate_daily_score(t, m, h, d, version=version)
+                for t, m, h, d in zip(times, mistakes, hints, difficulty)
+            ]
+
+            assert batch.dtype == np.int64
+            assert batch.tolist() == scalar
+
+
+def test_truncation_and_clamping_edges():
+    # 1000 - 0.5*t hits fractional, exact-zero and negative results
+    times = [1.0, 1999.0, 2000.0, 2001.0, 2002.5, 0.3]
+    zeros = [0] * len(times)
+    batch = calculate_daily_scores(times, zeros, zeros, zeros)
+    assert batch.tolist() == [calculate_daily_score(t, 0, 0, 0) for t in times]
+    assert batch.tolist() == [999, 0, 0, 0, 0, 999]
+
+
+def test_rescore_reads_score_document_columns():
+    rows = {
+        "timeSeconds": [23.7, 100.0],
+        "mistakes": [1, 0],
+        "hintsUsed": [0, 2],
+        "difficulty": [4, 3],
+    }
+    assert rescore(rows).tolist() == [
+        calculate_daily_score(23.7, 1, 0, 4),
+        calculate_daily_score(100.0, 0, 2, 3),
+    ]
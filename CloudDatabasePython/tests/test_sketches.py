@@ -0,0 +1,95 @@
+import random
+from services.score_stats import get_user_stats
+from services.sketches import ScoreHistogram, ScoreSketch
+from services.user_summary import process_user_daily_submission
+
+
+def _true_quantile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))]
+
+
+def test_quantiles_within_relative_accuracy():
+    rng = random.Random(310)
+    values = [rng.choice([0, rng.randint(1, 1050), rng.uniform(5, 5000)]) for _ in range(5000)]
+
+    sketch = ScoreSketch(0.01)
+    for value in values:
+        sketch.add(value)
+
+    assert sketch.count == len(values)
+    for q in (0, 0.1, 0.5, 0.9, 0.99, 1):
+        expected = _true_quantile(values, q)
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected + 1e-9
+
+
+def test_merge_and_remove_match_a_single_sketch():
+    rng = random.Random(25)
+    values = [rng.randint(0, 1050) for _ in range(2000)]
+    replaced = values[:300]
+
+    whole = ScoreSketch(0.01)
+    for value in values[300:]:
+        whole.add(value)
+
+    # Shards that saw the replaced values, and a shard that saw them removed
+    shards = [ScoreSketch(0.01) for _ in range(4)]
+    for index, value in enumerate(values):
+        shards[index % 3].add(value)
+    for value in replaced:
+        shards[3].remove(value)
+
+    merged = ScoreSketch.from_dict(None, 0.01)
+    for shard in shards:
+        merged.merge(ScoreSketch.from_dict(shard.to_dict()))
+
+    assert merged.to_dict() == whole.to_dict()
+
+
+def test_count_below_ignores_ties():
+    sketch = ScoreSketch(0.01)
+    for value in [0, 100, 200, 200, 500, 900]:
+        sketch.add(value)
+
+    assert sketch.count_below(0) == 0
+    assert sketch.count_below(200) == 2
+    assert sketch.count_below(1000) == 6
+    assert ScoreSketch().quantile(0.5) is None
+
+
+def test_histogram_counts_close_scores_exactly():
+    # A 1% sketch puts 1020 and 1025 in one bucket and calls them a tie
+    day = ScoreHistogram()
+    for score in [1025, 1020, 1005, 1005, 880]:
+        day.add(score)
+
+    assert day.count_below(1025) == 4
+    assert day.count_below(1020) == 3
+    assert day.count_below(1005) == 1
+    assert day.count_below(880) == 0
+
+
+def test_histogram_merge_and_remove():
+    shards = [ScoreHistogram(), ScoreHistogram()]
+    shards[0].add(0)
+    shards[0].add(700)
+    shards[1].add(1025)
+    shards[1].remove(700)
+
+    merged = ScoreHistogram.from_dict(None)
+    for shard in shards:
+        merged.merge(ScoreHistogram.from_dict(shard.to_dict()))
+
+    assert merged.count == 2
+    assert merged.to_dict() == {"offset": 0, "counts": [1] + [0] * 1024 + [1]}
+
+
+def test_todays_top_scorer_beats_everyone(store):
+    # Daily scores 1025, 1020, 1005, 1005 and 880
+    for user_id, time_seconds in [("ann", 20), ("bob", 30), ("cat", 60), ("dan", 60), ("eve", 310)]:
+        process_user_daily_submission(user_id, time_seconds, 0, 0, 3)
+
+    assert get_user_stats("ann")["today"]["beatPercent"] == 100.0
+    assert get_user_stats("bob")["today"]["beatPercent"] == 75.0
+    assert get_user_stats("cat")["today"]["beatPercent"] == 25.0
+    assert get_user_stats("eve")["today"]["beatPercent"] == 0.0
@@ -0,0 +1,50 @@
+from services.user_summary import (
+    _score_fields,
+    process_user_daily_submission,
+    process_user_daily_submissions,
+    verify_user_summary,
+)
+from services.utils import month_of, today_id
+
+
+def _submit(user_id, time_seconds, date_id=None, mistakes=0):
+    return process_user_daily_submission(user_id, time_seconds, mistakes, 0, 3, date_str=date_id)
+
+
+def _month_day(day):
+    return f"{month_of(today_id())}-{day:02d}"
+
+
+def test_resubmitting_a_day_replaces_its_score(store):
+    first = _submit("ann", 100, _month_day(1))
+    second = _submit("ann", 300, _month_day(1))
+
+    assert second["currentMonthTotal"] == second["dailyScore"] < first["dailyScore"]
+    assert store.get_user("ann")["currentMonthCount"] == 1
+    assert verify_user_summary("ann")["ok"]
+
+
+def test_first_submission_of_a_month_seeds_from_its_scores(store):
+    # Counters left over from an old month, plus a score for this month
+    # written without going through them (a backfill)
+    store.set_user("ann", {"summaryMonth": "2020-01", "currentMonthTotal": 999,
+                           "currentMonthCount": 9, "currentMonthTime": 99})
+    backfill = _score_fields(store, _month_day(1), 120, 0, 0, 3)
+    store.set_score("ann", _month_day(1), backfill)
+
+    result = _submit("ann", 60, _month_day(2))
+
+    assert result["currentMonthTotal"] == backfill["dailyScore"] + result["dailyScore"]
+    assert store.get_user("ann")["currentMonthCount"] == 2
+    assert verify_user_summary("ann")["ok"]
+
+
+def test_batch_rejects_malformed_dates_per_item(store):
+    good = {"userId": "ann", "timeSeconds": 100, "mistakes": 0, "hintsUsed": 0, "difficulty": 3}
+    dates = [_month_day(1), "2026-13-45", "garbage", "20260101", 20260101]
+
+    results = process_user_daily_submissions([{**good, "date": date_id} for date_id in dates])["results"]
+
+    assert [result["ok"] for result in results] == [True, False, False, False, False]
+    assert all("invalid submission" in result["error"] for result in results[1:])
+    assert [month for month, _ in store.iter_user_months("ann")] == [month_of(_month_day(1))]
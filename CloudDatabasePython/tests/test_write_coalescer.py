@@ -0,0 +1,54 @@
+from services.user_summary import _score_fields, verify_user_summary
+from services.utils import month_of, today_id
+from services.write_coalescer import SummaryCoalescer, _write_score
+
+
+def _month_day(day):
+    return f"{month_of(today_id())}-{day:02d}"
+
+
+def _month_doc(store, user_id, month):
+    return dict(store.iter_user_months(user_id, 1))[month]
+
+
+def _write_and_queue(store, coalescer, user_id, day, time_seconds):
+    """What submit_coalesced does, with the flush left to the test."""
+    date_id = _month_day(day)
+    fields = _score_fields(store, date_id, time_seconds, 0, 0, 3)
+    old_data = store.run_transaction(lambda txn: _write_score(txn, user_id, date_id, fields))
+    return coalescer.submit(user_id, date_id, old_data, fields)
+
+
+def test_coalescer_folds_a_users_burst_in_one_commit(store):
+    coalescer = SummaryCoalescer(window=60)
+    burst = [_write_and_queue(store, coalescer, "ann", day, t) for day, t in [(1, 100), (2, 50), (1, 400)]]
+    _write_and_queue(store, coalescer, "bob", 1, 10)
+
+    coalescer.flush()
+
+    assert coalescer.user_commits == 2
+    total = store.get_user("ann")["currentMonthTotal"]
+    assert [future.result()["currentMonthTotal"] for future in burst] == [total] * 3
+    assert verify_user_summary("ann")["ok"] and verify_user_summary("bob")["ok"]
+
+
+def test_coalescer_keeps_the_score_that_committed_last(store):
+    coalescer = SummaryCoalescer(window=60)
+    date_id = _month_day(1)
+    _write_and_queue(store, coalescer, "ann", 1, 500)
+    coalescer.flush()
+
+    # Two submissions for the same day commit a then b, but reach the queue b then a
+    first = _score_fields(store, date_id, 100, 0, 0, 3)
+    last = _score_fields(store, date_id, 10, 0, 0, 3)
+    old_first = store.run_transaction(lambda txn: _write_score(txn, "ann", date_id, first))
+    old_last = store.run_transaction(lambda txn: _write_score(txn, "ann", date_id, last))
+    coalescer.submit("ann", date_id, old_last, last)
+    coalescer.submit("ann", date_id, old_first, first)
+    coalescer.flush()
+
+    data = store.get_user("ann")
+    assert data["currentMonthTotal"] == data["allTimeTotal"] == last["dailyScore"]
+    month = month_of(date_id)
+    assert _month_doc(store, "ann", month)["days"][date_id]["score"] == last["dailyScore"]
+    assert verify_user_summary("ann")["ok"]